@@ -1,16 +1,24 @@
-__all__ = ('backend', 'SearchableModel', 'SearchableManager',
-           'SimpleSearchableModel', 'SimpleSearchableManager',
-           'DummySearchableModel', 'DummySearchableManager',
-           'MysqlSearchableModel', 'MysqlSearchableManager',
-           'PgsqlSearchableModel', 'PgsqlSearchableManager',
-           'SphinxSearchableModel', 'SphinxSearchableManager',
-           'XapianSearchableModel', 'XapianSearchableManager')
+__all__ = ('backend', 'SearchableModel', 'SearchManager',
+           'SimpleSearchableModel', 'SimpleSearchManager',
+           'DummySearchableModel', 'DummySearchManager',
+           'MysqlSearchableModel', 'MysqlSearchManager',
+           'PgsqlSearchableModel', 'PgsqlSearchManager',
+           'SphinxSearchableModel', 'SphinxSearchManager',
+           'XapianSearchableModel', 'XapianSearchManager',
+           'SqliteSearchableModel', 'SqliteSearchManager',
+           'search_models')
 
+import sys
+from types import ModuleType
 from cgi import parse_qsl
 from django.core import signals
-from fts.backends.base import InvalidFtsBackendError
+from fts.backends.base import InvalidFtsBackendError, BaseManager
 
 from fts.settings import *
+from fts.words.stop import register_stopwords_file
+
+for _language, _source in FTS_STOPWORDS_FILES.items():
+    register_stopwords_file(_language, _source)
 
 # Name for use in settings file --> name of module in "backends" directory.
 # Any backend scheme that is not in this dictionary is treated as a Python
@@ -22,6 +30,7 @@ BACKENDS = {
     'xapian': 'xapian',
     'simple': 'simple',
     'dummy': 'dummy',
+    'sqlite': 'sqlite',
 }
 
 def get_fts(backend_uri):
@@ -47,70 +56,91 @@ def get_fts(backend_uri):
         module = __import__(scheme, {}, {}, [''])
     return getattr(module, 'SearchClass')(host, params), getattr(module, 'SearchableModel'), getattr(module, 'SearchManager')
 
-SearchableModel, SearchManager = None, None
-SimpleSearchableModel, SimpleSearchManager = None, None
-DummySearchableModel, DummySearchManager = None, None
-MysqlSearchableModel, MysqlSearchManager = None, None
-PgsqlSearchableModel, PgsqlSearchManager = None, None
-SphinxSearchableModel, SphinxSearchManager = None, None
-XapianSearchableModel, XapianSearchManager = None, None
-
-if FTS_CONFIGURE_ALL_BACKENDS or FTS_BACKEND.startswith('simple://'):
-    try:
-        _fts, SimpleSearchableModel, SimpleSearchManager = get_fts('simple://')
-        if FTS_BACKEND.startswith('simple://'):
-            SearchableModel, SearchManager = SimpleSearchableModel, SimpleSearchManager
-            backend = _fts.backend
-    except InvalidFtsBackendError:
-        if FTS_BACKEND.startswith('simple://'):
-            raise
-
-if FTS_CONFIGURE_ALL_BACKENDS or FTS_BACKEND.startswith('dummy://'):
-    try:
-        _fts, DummySearchableModel, DummySearchManager = get_fts('dummy://')
-        if FTS_BACKEND.startswith('dummy://'):
-            SearchableModel, SearchManager = DummySearchableModel, DummySearchManager
-            backend = _fts.backend
-    except InvalidFtsBackendError:
-        if FTS_BACKEND.startswith('dummy://'):
-            raise
-    
-if FTS_CONFIGURE_ALL_BACKENDS or FTS_BACKEND.startswith('mysql://'):
-    try:
-        _fts, MysqlSearchableModel, MysqlSearchManager = get_fts('mysql://')
-        if FTS_BACKEND.startswith('mysql://'):
-            SearchableModel, SearchManager = MysqlSearchableModel, MysqlSearchManager
-            backend = _fts.backend
-    except InvalidFtsBackendError:
-        if FTS_BACKEND.startswith('mysql://'):
-            raise
-    
-if FTS_CONFIGURE_ALL_BACKENDS or FTS_BACKEND.startswith('pgsql://'):
-    try:
-        _fts, PgsqlSearchableModel, PgsqlSearchManager = get_fts('pgsql://')
-        if FTS_BACKEND.startswith('pgsql://'):
-            SearchableModel, SearchManager = PgsqlSearchableModel, PgsqlSearchManager
-            backend = _fts.backend
-    except InvalidFtsBackendError:
-        if FTS_BACKEND.startswith('pgsql://'):
-            raise
-    
-if FTS_CONFIGURE_ALL_BACKENDS or FTS_BACKEND.startswith('sphinx://'):
-    try:
-        _fts, SphinxSearchableModel, SphinxSearchManager = get_fts('sphinx://')
-        if FTS_BACKEND.startswith('sphinx://'):
-            SearchableModel, SearchManager = SphinxSearchableModel, SphinxSearchManager
-            backend = _fts.backend
-    except InvalidFtsBackendError:
-        if FTS_BACKEND.startswith('sphinx://'):
-            raise
-    
-if FTS_CONFIGURE_ALL_BACKENDS or FTS_BACKEND.startswith('xapian://'):
-    try:
-        _fts, XapianSearchableModel, XapianSearchManager = get_fts('xapian://')
-        if FTS_BACKEND.startswith('xapian://'):
-            SearchableModel, SearchManager = XapianSearchableModel, XapianSearchManager
-            backend = _fts.backend
-    except InvalidFtsBackendError:
-        if FTS_BACKEND.startswith('xapian://'):
-            raise
+def _search_manager(model):
+    # The default manager of the model if it's a search manager, else its first one
+    managers = getattr(model, '_search_managers', [])
+    if not managers:
+        raise ValueError('%s has no search manager.' % model._meta.object_name)
+    if model._default_manager in managers:
+        return model._default_manager
+    return managers[0]
+
+def search_models(query, models, limit=20, **kwargs):
+    """
+    Searches the instances of several models at once. models are searchable models,
+    or the search managers to use. Returns the best limit SearchHits, which are
+    (content_type, object_id, rank) tuples, best first, with the instance as their
+    object attribute; the instances of every model are loaded with a single query.
+
+    Models of the simple backend are searched with a single query (per index
+    database); others with a search per model. The ranks of different backends
+    can't be compared.
+    """
+    managers = {}
+    for model in models:
+        manager = isinstance(model, BaseManager) and model or _search_manager(model)
+        managers.setdefault(type(manager), []).append(manager)
+    hits = []
+    for manager_class, class_managers in managers.items():
+        hits.extend(manager_class._search_models(query, class_managers, limit, **kwargs))
+    hits.sort(key=lambda hit: -(hit[2] or 0))
+    hits = hits[:limit]
+
+    to_load = {}
+    for hit in hits:
+        if hit.object is None:
+            to_load.setdefault(hit[0], []).append(hit[1])
+    for ctype, ids in to_load.items():
+        objects = ctype.model_class()._default_manager.in_bulk(ids)
+        for hit in hits:
+            if hit[0] == ctype and hit.object is None:
+                hit.object = objects.get(hit[1])
+    # Instances deleted since they were indexed
+    return [hit for hit in hits if hit.object is not None]
+
+# Backends are only imported the first time one of their names is looked up on
+# this module (eg. fts.PgsqlSearchableModel), so processes don't pay for the
+# backends they don't use.
+_backends = {}
+
+def get_backend(scheme):
+    """
+    Returns the (SearchClass instance, SearchableModel, SearchManager) of the backend
+    registered as scheme in BACKENDS, importing it the first time.
+    """
+    if scheme not in _backends:
+        _backends[scheme] = get_fts('%s://' % scheme)
+    return _backends[scheme]
+
+# Name of the module attribute -> (backend scheme, position in get_backend's result).
+# SearchableModel, SearchManager and backend belong to FTS_BACKEND.
+_LAZY_NAMES = {}
+for _scheme in BACKENDS:
+    _LAZY_NAMES['%sSearchableModel' % _scheme.capitalize()] = (_scheme, 1)
+    _LAZY_NAMES['%sSearchManager' % _scheme.capitalize()] = (_scheme, 2)
+
+class _LazyBackendsModule(ModuleType):
+    def __getattr__(self, name):
+        if name in ('backend', 'SearchableModel', 'SearchManager'):
+            # Errors of the configured backend are not hidden
+            fts, model, manager = get_backend(FTS_BACKEND.split(':', 1)[0])
+            value = {'backend': fts.backend, 'SearchableModel': model, 'SearchManager': manager}[name]
+        elif name in _LAZY_NAMES:
+            scheme, i = _LAZY_NAMES[name]
+            try:
+                value = get_backend(scheme)[i]
+            except InvalidFtsBackendError:
+                if FTS_BACKEND.startswith('%s://' % scheme):
+                    raise
+                value = None
+        else:
+            raise AttributeError("'module' object has no attribute '%s'" % name)
+        setattr(self, name, value)
+        return value
+
+_module = sys.modules[__name__]
+_lazy_module = _LazyBackendsModule(__name__, __doc__)
+_lazy_module.__dict__.update(_module.__dict__)
+# Keep the original module alive: its globals are used by the functions above
+_lazy_module._module = _module
+sys.modules[__name__] = _lazy_module
@@ -1,16 +1,170 @@
 "Base Fts class."
 
+from itertools import islice
+
 from django.db import transaction
 from django.db import models
+from django.db import connections
+from django.db.models.query import QuerySet, EmptyQuerySet
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 
 from django.core.exceptions import ImproperlyConfigured
 
+from fts import instrumentation
+
 VALID_WEIGHTS = ('A', 'B', 'C', 'D')
 
+# Number of instances highlighted at a time while a HighlightQuerySet is iterated.
+HIGHLIGHT_CHUNK_SIZE = 100
+# Number of matches read from an index at a time while a PagedQuerySet is iterated.
+SEARCH_PAGE_SIZE = 500
+
 class InvalidFtsBackendError(ImproperlyConfigured):
     pass
 
+class SearchCount(int):
+    """
+    The number of hits of a search. The method attribute tells how it was obtained:
+    'exact' for a real count, 'estimate' for the database planner's estimate.
+    """
+    def __new__(cls, value, method='exact'):
+        obj = super(SearchCount, cls).__new__(cls, value)
+        obj.method = method
+        return obj
+
+class SearchHit(tuple):
+    """
+    A (content_type, object_id, rank) result of fts.search_models(). The object
+    attribute is the instance, once loaded.
+    """
+    def __new__(cls, content_type, object_id, rank, object=None):
+        hit = super(SearchHit, cls).__new__(cls, (content_type, object_id, rank))
+        hit.object = object
+        return hit
+
+class HighlightQuerySet(QuerySet):
+    """
+    A QuerySet that passes the instances it fetches, a chunk at a time, to its
+    highlighter, so highlights are only ever computed for the rows that are
+    actually read (eg. the slice displayed on a page).
+    When its manager is set, reading the results is timed as a 'fetch' operation
+    (see fts.instrumentation).
+    """
+    _highlighter = None
+    _manager = None
+
+    def _clone(self, klass=None, setup=False, **kwargs):
+        kwargs.setdefault('_highlighter', self._highlighter)
+        kwargs.setdefault('_manager', self._manager)
+        return super(HighlightQuerySet, self)._clone(klass, setup, **kwargs)
+
+    def iterator(self):
+        timer = instrumentation.NULL_TIMER
+        if self._manager is not None:
+            timer = instrumentation.start('fetch', self._manager)
+        try:
+            rows = super(HighlightQuerySet, self).iterator()
+            while True:
+                chunk = list(islice(rows, HIGHLIGHT_CHUNK_SIZE))
+                if not chunk:
+                    break
+                timer.phase('fetch')
+                if self._highlighter is not None:
+                    self._highlighter(chunk)
+                    timer.phase('highlight')
+                timer.add_rows(len(chunk))
+                # The caller may never ask for the next chunk: don't keep the debug
+                # cursors forced on meanwhile
+                timer.pause()
+                for obj in chunk:
+                    yield obj
+                timer.resume()
+        finally:
+            timer.finish()
+
+class PagedQuerySet(HighlightQuerySet):
+    """
+    The results of a search whose matches are read from an index outside of the
+    model's table (on another database, or in Xapian). Every slice reads the (pk, rank)
+    matches of that page only from the index, then their instances by primary key;
+    iterating reads them a page of SEARCH_PAGE_SIZE matches at a time, and count()
+    asks the index. So all the matches can be read, however many there are.
+
+    _matches(offset, limit) returns the matches, best first (all of them from offset
+    if limit is None), and _count() their number. At most _limit matches are read,
+    if it is set. Filters added to the queryset apply to the instances of every page,
+    which can then be short of the matches read; count() reads them all in that case.
+    """
+    _matches = None
+    _count = None
+    _limit = None
+    _rank_field = None
+
+    def _clone(self, klass=None, setup=False, **kwargs):
+        if klass is None or issubclass(klass, PagedQuerySet):
+            kwargs.setdefault('_matches', self._matches)
+            kwargs.setdefault('_count', self._count)
+            kwargs.setdefault('_limit', self._limit)
+            kwargs.setdefault('_rank_field', self._rank_field)
+        return super(PagedQuerySet, self)._clone(klass, setup, **kwargs)
+
+    def _read(self, offset, limit):
+        if self._limit is not None:
+            if offset >= self._limit:
+                return []
+            if limit is None or offset + limit > self._limit:
+                limit = self._limit - offset
+        return self._matches(offset, limit)
+
+    def _by_pks(self, matches):
+        """
+        Returns a plain queryset of the instances of the (pk, rank) matches, in their order.
+        """
+        qs = self._clone(klass=HighlightQuerySet)
+        if not matches:
+            return qs.none()
+        qn = connections[self.db].ops.quote_name
+        pk = '%s.%s' % (qn(self.model._meta.db_table), qn(self.model._meta.pk.column))
+        select = {
+            '_fts_position': 'CASE %s %s END' % (pk, ' '.join(['WHEN %d THEN %d' % (p, i) for i, (p, r) in enumerate(matches)])),
+        }
+        if self._rank_field is not None:
+            select[self._rank_field] = 'CASE %s %s END' % (pk, ' '.join(['WHEN %d THEN %s' % m for m in matches]))
+        return qs.filter(pk__in=[p for p, r in matches]).extra(select=select, order_by=['_fts_position'])
+
+    def count(self):
+        if self._result_cache is not None and not self._iter:
+            return len(self._result_cache)
+        if self.query.where:
+            return len(list(self.iterator()))
+        count = self._count()
+        if self._limit is not None:
+            count = min(count, self._limit)
+        return count
+
+    def __getitem__(self, k):
+        if self._result_cache is not None or (isinstance(k, slice) and k.step):
+            return super(PagedQuerySet, self).__getitem__(k)
+        if isinstance(k, slice):
+            assert (k.start or 0) >= 0 and (k.stop is None or k.stop >= 0), "Negative indexing is not supported."
+            offset = k.start or 0
+            if k.stop is None:
+                return self._by_pks(self._read(offset, None))
+            return self._by_pks(self._read(offset, max(k.stop - offset, 0)))
+        assert k >= 0, "Negative indexing is not supported."
+        return list(self._by_pks(self._read(k, 1)))[0]
+
+    def iterator(self):
+        offset = 0
+        while True:
+            matches = self._read(offset, SEARCH_PAGE_SIZE)
+            for obj in self._by_pks(matches):
+                yield obj
+            if len(matches) < SEARCH_PAGE_SIZE:
+                return
+            offset += SEARCH_PAGE_SIZE
+
 class BaseClass(object):
     class Meta:
         abstract = True
@@ -64,15 +218,122 @@ class BaseManager(models.Manager):
     def _search(self, query, **kwargs):
         raise NotImplementedError
 
+    def _with_highlighter(self, qs, highlighter):
+        """
+        Returns qs as a HighlightQuerySet that runs highlighter(instances) on the instances it fetches.
+        """
+        if isinstance(qs, HighlightQuerySet):
+            return qs._clone(_highlighter=highlighter)
+        return qs._clone(klass=HighlightQuerySet, _highlighter=highlighter)
+
     @transaction.commit_on_success
     def update_index(self, pk=None):
         """
         Updates the full-text index for one, many, or all instances of this manager's model.
         """
-        return self._update_index(pk)
+        timer = instrumentation.start('update_index', self)
+        try:
+            return self._update_index(pk)
+        finally:
+            timer.finish()
+
+    def rebuild_index(self):
+        """
+        Rebuilds the index of all the instances. Backends whose update_index() exposes
+        a partially built index to searches while it runs do it differently.
+        """
+        return self.update_index()
 
     def search(self, query, **kwargs):
-        return self._search(query, **kwargs)
+        timer = instrumentation.start('search', self)
+        try:
+            qs = self._search(query, **kwargs)
+        finally:
+            timer.finish()
+        if instrumentation.is_enabled() and isinstance(qs, QuerySet) and not isinstance(qs, EmptyQuerySet):
+            if isinstance(qs, HighlightQuerySet):
+                qs = qs._clone(_manager=self)
+            else:
+                qs = qs._clone(klass=HighlightQuerySet, _manager=self)
+        return qs
+
+    def search_ids(self, query, limit=None, offset=0, with_rank=True, after=None, **kwargs):
+        """
+        Returns the primary keys of the matches of query, best first and then by primary
+        key, as (pk, rank) pairs if with_rank. after is the (rank, pk) of the last match
+        of the previous page: the matches start right after it, which unlike offset
+        doesn't get slower the further the pages go. This runs a search and reads the
+        instances; backends that can read their index alone override it.
+        """
+        kwargs['rank_field'] = '_fts_rank'
+        matches = [(-(getattr(obj, '_fts_rank', 0) or 0), obj.pk) for obj in self.search(query, **kwargs)]
+        matches.sort()
+        if after is not None:
+            matches = [m for m in matches if m > (-after[0], after[1])]
+        if limit is not None:
+            matches = matches[offset:offset + limit]
+        else:
+            matches = matches[offset:]
+        if with_rank:
+            return [(pk, -rank) for rank, pk in matches]
+        return [pk for rank, pk in matches]
+
+    def iter_search(self, query, chunk_size=100, **kwargs):
+        """
+        Yields the instances matching query, best first. Every chunk_size matches are
+        read with search_ids() after the last one yielded, and their instances with a
+        single query, so memory use doesn't grow with the number of matches and deep
+        chunks are as fast as the first ones. Instances deleted meanwhile are skipped.
+        If rank_field is given, the rank is put on every instance as rank_field.
+        """
+        rank_field = kwargs.pop('rank_field', None)
+        kwargs.pop('highlight', None)
+        after = None
+        while True:
+            matches = self.search_ids(query, limit=chunk_size, after=after, **kwargs)
+            objects = self.in_bulk([pk for pk, rank in matches])
+            for pk, rank in matches:
+                obj = objects.get(pk)
+                if obj is not None:
+                    if rank_field is not None:
+                        setattr(obj, rank_field, rank)
+                    yield obj
+            if len(matches) < chunk_size:
+                return
+            after = (matches[-1][1], matches[-1][0])
+
+    def search_many(self, queries, limit=10, **kwargs):
+        """
+        Returns a dict of every query of queries to the primary keys of its best limit
+        matches, best first. This runs a search per query; backends that can run
+        them together override it.
+        """
+        results = {}
+        for query in queries:
+            if query not in results:
+                results[query] = [obj.pk for obj in self.search(query, rank_field='_fts_rank', **kwargs)[:limit]]
+        return results
+
+    @classmethod
+    def _search_models(cls, query, managers, limit, **kwargs):
+        """
+        Returns the best limit SearchHits of query among the instances of the managers'
+        models, best first. This runs a search per manager; backends that can search
+        several models at once override it.
+        """
+        hits = []
+        for manager in managers:
+            ctype = ContentType.objects.get_for_model(manager.model)
+            for obj in manager.search(query, rank_field='_fts_rank', **kwargs)[:limit]:
+                hits.append(SearchHit(ctype, obj.pk, getattr(obj, '_fts_rank', 0), obj))
+        hits.sort(key=lambda hit: -(hit[2] or 0))
+        return hits[:limit]
+
+    def search_count(self, query, **kwargs):
+        """
+        Returns the number of instances matching query as a SearchCount.
+        """
+        return SearchCount(self.search(query, **kwargs).count())
 
     def _find_text_fields(self):
         """
@@ -1,10 +1,13 @@
 "Pgsql Fts backend"
+import re
 
-from django.db import connection, transaction
+from django.db import connection, connections, router, transaction, DEFAULT_DB_ALIAS
 from django.db.models.fields import FieldDoesNotExist
 
+from fts import instrumentation
+from fts.routers import db_for_search
 from fts.backends.base import InvalidFtsBackendError
-from fts.backends.base import BaseClass, BaseModel, BaseManager
+from fts.backends.base import BaseClass, BaseModel, BaseManager, SearchCount
 
 qn = connection.ops.quote_name
 
@@ -28,6 +31,28 @@ LANGUAGES = {
     'tr' : 'turkish',
 }
 
+# Words accepted in autocomplete queries; everything else (tsquery operators,
+# quotes, punctuation) is dropped so user input can't break the tsquery.
+PREFIX_TERM = re.compile(r'\w+', re.UNICODE)
+
+# Estimated row count of the top node of an EXPLAIN plan.
+PLAN_ROWS = re.compile(r'rows=(\d+)')
+
+# Queries per statement of search_many()
+SEARCH_MANY_BATCH_SIZE = 1000
+
+def plan_rows(row):
+    """
+    Returns the estimated row count of row, the first row of an EXPLAIN, or None if
+    it has none (eg. an unexpected plan format).
+    """
+    if not row or not isinstance(row[0], basestring):
+        return None
+    match = PLAN_ROWS.search(row[0])
+    if match is None:
+        return None
+    return int(match.group(1))
+
 class VectorField(models.Field):
     def __init__(self, *args, **kwargs):
         kwargs['null'] = True
@@ -45,9 +70,30 @@ class SearchClass(BaseClass):
 class SearchManager(BaseManager):
     def __init__(self, **kwargs):
         super(SearchManager, self).__init__(**kwargs)
+        if self.language_code not in LANGUAGES:
+            # eg. the LANGUAGE_CODE of the site: no stemming rather than no searching
+            self.language_code = ''
         self.language = LANGUAGES[self.language_code]
+        # For autocomplete, prefix_field names a second VectorField built with
+        # the unstemmed 'simple' configuration and trigram_field names a text
+        # column covered by a pg_trgm index (see query_type='prefix').
+        self.prefix_field = kwargs.get('prefix_field')
+        self.trigram_field = kwargs.get('trigram_field')
+        # language_field names a field holding a language code (a key of LANGUAGES)
+        # that selects the text search configuration of each row.
+        self.language_field = kwargs.get('language_field')
         self._vector_field_cache = None
 
+    def _language(self, language_code):
+        """
+        Returns the text search configuration of language_code, one of the keys of LANGUAGES.
+        """
+        try:
+            return LANGUAGES[language_code]
+        except KeyError:
+            raise ValueError('Unknown language %r, expected one of: %s' % (language_code,
+                ', '.join([code for code in sorted(LANGUAGES.keys()) if code])))
+
     def _vector_field(self):
         """
         Returns the VectorField defined for this manager's model. There must be exactly one VectorField defined.
@@ -55,7 +101,7 @@ class SearchManager(BaseManager):
         if self._vector_field_cache is not None:
             return self._vector_field_cache
 
-        vectors = [f for f in self.model._meta.fields if isinstance(f, VectorField)]
+        vectors = [f for f in self.model._meta.fields if isinstance(f, VectorField) and f.name != self.prefix_field]
 
         if len(vectors) != 1:
             raise ValueError('There must be exactly 1 VectorField defined for the %s model.' % self.model._meta.object_name)
@@ -65,25 +111,135 @@ class SearchManager(BaseManager):
         return self._vector_field_cache
     vector_field = property(_vector_field)
 
-    def _vector_sql(self, field, weight):
+    def _relation_path(self, field):
         """
-        Returns the SQL used to build a tsvector from the given (django) field name.
+        Returns the ForeignKeys followed by a 'fk__field' style field name and the
+        field it ends on, or None if field isn't such a name.
         """
+        if not isinstance(field, basestring) or '__' not in field:
+            return None
+        names = field.split('__')
+        model = self.model
+        path = []
         try:
-            f = self.model._meta.get_field(field)
-            return ("setweight(to_tsvector('%s', coalesce(%s,'')), '%s')" % (self.language, qn(f.column), weight), [])
+            for name in names[:-1]:
+                f = model._meta.get_field(name, many_to_many=False)
+                if f.rel is None:
+                    return None
+                path.append(f)
+                model = f.rel.to
+            return path, model._meta.get_field(names[-1], many_to_many=False)
         except FieldDoesNotExist:
-            return ("setweight(to_tsvector('%s', %%s), '%s')" % (self.language, weight), [field])
+            return None
 
-    def _update_index_update(self, pk=None):
-        # Build a list of SQL clauses that generate tsvectors for each specified field.
-        clauses = []
+    def _column_sql(self, field, alias=None):
+        """
+        Returns the SQL expression for the value of the given (django) field name on the
+        row aliased as alias: a column of the model's table or, for a 'fk__field' name, a
+        correlated subquery on the related tables. Returns None for anything else.
+        """
+        if alias is None:
+            alias = qn(self.model._meta.db_table)
+        if not isinstance(field, basestring):
+            return None
+        relation = self._relation_path(field)
+        if relation is None:
+            try:
+                f = self.model._meta.get_field(field)
+            except FieldDoesNotExist:
+                return None
+            return '%s.%s' % (alias, qn(f.column))
+        path, final = relation
+        tables = []
+        for i, f in enumerate(path):
+            table = '%s r%d' % (qn(f.rel.to._meta.db_table), i)
+            if i:
+                table = 'INNER JOIN %s ON r%d.%s = r%d.%s' % (table, i, qn(f.rel.get_related_field().column), i - 1, qn(f.column))
+            tables.append(table)
+        return '(SELECT r%d.%s FROM %s WHERE r0.%s = %s.%s)' % (len(path) - 1, qn(final.column), ' '.join(tables),
+            qn(path[0].rel.get_related_field().column), alias, qn(path[0].column))
+
+    def _config_sql(self, alias=None):
+        """
+        Returns the SQL expression of the text search configuration for the row aliased
+        as alias: the manager's language, or the one named by the row's language_field.
+        """
+        if not self.language_field:
+            return "'%s'" % self.language
+        if alias is None:
+            alias = qn(self.model._meta.db_table)
+        column = '%s.%s' % (alias, qn(self.model._meta.get_field(self.language_field).column))
+        whens = ' '.join(["WHEN '%s' THEN '%s'" % (code, name) for code, name in sorted(LANGUAGES.items()) if code])
+        return "(CASE %s %s ELSE '%s' END)::regconfig" % (column, whens, self.language)
+
+    def _vector_sql(self, field, weight, config=None, alias=None):
+        """
+        Returns the SQL used to build a tsvector from the given (django) field name.
+        Anything that isn't a field name is indexed as a value, None as an empty text.
+        """
+        config = config or self._config_sql(alias)
+        column = self._column_sql(field, alias)
+        if column is not None:
+            return ("setweight(to_tsvector(%s, coalesce(%s,'')), '%s')" % (config, column, weight), [])
+        if field is None:
+            field = u''
+        elif not isinstance(field, basestring):
+            field = unicode(field)
+        return ("setweight(to_tsvector(%s, %%s), '%s')" % (config, weight), [field])
+
+    def _set_vectors_sql(self, values, alias=None):
+        """
+        Returns the SET clause (and its params) of an UPDATE that stores the tsvectors
+        built from values, a list of (value, weight) pairs as accepted by _vector_sql.
+        The prefix vector, if any, is built alongside the main one.
+        """
+        sets = []
         params = []
-        for field, weight in self._fields.items():
-            v = self._vector_sql(field, weight)
-            clauses.append(v[0])
-            params.extend(v[1])
-        vector_sql = ' || '.join(clauses)
+        for column, config in self._vector_columns(alias):
+            clauses = []
+            for value, weight in values:
+                v = self._vector_sql(value, weight, config, alias)
+                clauses.append(v[0])
+                params.extend(v[1])
+            sets.append('%s = %s' % (qn(column), ' || '.join(clauses)))
+        return ', '.join(sets), params
+
+    def _vector_columns(self, alias=None):
+        """
+        Returns the (column, text search configuration SQL) pairs of the vectors to maintain.
+        """
+        columns = [(self.vector_field.column, self._config_sql(alias))]
+        if self.prefix_field:
+            columns.append((self.model._meta.get_field(self.prefix_field).column, "'simple'"))
+        return columns
+
+    def _language_where(self, language_code):
+        """
+        Returns the WHERE clause restricting a search to the rows in the given language,
+        or None if the manager has no language_field. With the partial indexes from
+        get_create_index(), this only reads the postings of that language.
+        """
+        if not self.language_field:
+            return None
+        self._language(language_code) # only known codes are put in the SQL
+        column = self.model._meta.get_field(self.language_field).column
+        return self._language_condition(language_code, '%s.%s' % (qn(self.model._meta.db_table), qn(column)))
+
+    def _language_condition(self, language_code, column):
+        """
+        Returns the condition on column of the rows indexed in the given language. The
+        rows without a known code are indexed with the manager's language (see
+        _config_sql()), so they're searched with it.
+        """
+        condition = "%s = '%s'" % (column, language_code)
+        if language_code == self.language_code:
+            known = ', '.join(["'%s'" % code for code in sorted(LANGUAGES.keys()) if code])
+            condition = "(%s OR %s IS NULL OR %s NOT IN (%s))" % (condition, column, column, known)
+        return condition
+
+    def _update_index_update(self, pk=None):
+        # Build the SQL clauses that generate tsvectors for each specified field.
+        set_sql, params = self._set_vectors_sql(self._fields.items())
 
         where = ''
         # If one or more pks are specified, tack a WHERE clause onto the SQL.
@@ -93,47 +249,57 @@ class SearchManager(BaseManager):
                 where = ' WHERE %s IN (%s)' % (qn(self.model._meta.pk.column), ids)
             else:
                 where = ' WHERE %s = %d' % (qn(self.model._meta.pk.column), pk)
-        sql = 'UPDATE %s SET %s = %s%s' % (qn(self.model._meta.db_table), qn(self.vector_field.column), vector_sql, where)
-        cursor = connection.cursor()
+        sql = 'UPDATE %s SET %s%s' % (qn(self.model._meta.db_table), set_sql, where)
+        timer = instrumentation.current()
+        timer.phase('build')
+        db = router.db_for_write(self.model)
+        cursor = connections[db].cursor()
         cursor.execute(sql, tuple(params))
-        transaction.set_dirty()
+        transaction.commit_unless_managed(using=db)
+        timer.add_rows(max(0, cursor.rowcount))
+        timer.phase('write')
 
     def _update_index_walking(self, pk=None):
+        # Read the instances from the primary, replicas may not have them yet
+        db = router.db_for_write(self.model)
+        items = self.using(db)
         if pk is not None:
             if isinstance(pk, (list,tuple)):
-                items = self.filter(pk__in=pk)
+                items = items.filter(pk__in=pk)
             else:
-                items = self.filter(pk=pk)
-        else:
-            items = self.all()
+                items = items.filter(pk=pk)
 
+        timer = instrumentation.current()
         IW = {}
         for item in items:
-            clauses = []
-            params = []
+            timer.phase('fetch')
+            values = []
             for field, weight in self._fields.items():
                 if callable(field):
                     words = field(item)
-                elif '__' in field:
+                elif '__' in field and self._relation_path(field) is None:
                     words = item
                     for col in field.split('__'):
                         words = getattr(words, col)
                 else:
                     words = field
-                v = self._vector_sql(words, weight)
-                clauses.append(v[0])
-                params.extend(v[1])
-            vector_sql = ' || '.join(clauses)
-            sql = 'UPDATE %s SET %s = %s WHERE %s = %d' % (qn(self.model._meta.db_table), qn(self.vector_field.column), vector_sql, qn(self.model._meta.pk.column), item.pk)
-            cursor = connection.cursor()
+                values.append((words, weight))
+            set_sql, params = self._set_vectors_sql(values)
+            sql = 'UPDATE %s SET %s WHERE %s = %d' % (qn(self.model._meta.db_table), set_sql, qn(self.model._meta.pk.column), item.pk)
+            timer.phase('build')
+            cursor = connections[db].cursor()
             cursor.execute(sql, tuple(params))
-        transaction.set_dirty()
+            timer.add_rows()
+            timer.phase('write')
+        transaction.commit_unless_managed(using=db)
 
     @transaction.commit_on_success
     def _update_index(self, pk=None):
+        # Local columns and ForeignKey paths are indexed by a single UPDATE; callables
+        # and other relations (eg. reverse or many-to-many) need walking the instances.
         index_walking = False
         for field, weight in self._fields.items():
-            if callable(field) or '__' in field:
+            if callable(field) or ('__' in field and self._relation_path(field) is None):
                 index_walking = True
                 break
         if index_walking:
@@ -141,6 +307,50 @@ class SearchManager(BaseManager):
         else:
             self._update_index_update(pk)
 
+    def _prefix_tsquery(self, query):
+        """
+        Returns a to_tsquery() expression that matches every word of query as a prefix,
+        eg. 'new yo' becomes 'new':* & 'yo':*
+        """
+        terms = PREFIX_TERM.findall(query.lower())
+        return ' & '.join("'%s':*" % t for t in terms)
+
+    def _search_trigram(self, query, **kwargs):
+        """
+        Autocomplete through a pg_trgm index on trigram_field. Every word of the query
+        must appear in the column; results are ranked by trigram similarity.
+        """
+        rank_field = kwargs.get('rank_field')
+        language_code = kwargs.get('language') or self.language_code
+        qs = self._search_query_set(kwargs.get('primary'))
+
+        column = '%s.%s' % (qn(self.model._meta.db_table), qn(self.model._meta.get_field(self.trigram_field).column))
+        where = []
+        params = []
+        language_where = self._language_where(language_code)
+        if language_where:
+            where.append(language_where)
+        for term in PREFIX_TERM.findall(query):
+            # \w excludes the other LIKE wildcards, but not the underscore
+            term = term.replace('_', '\\_')
+            where.append('%s ILIKE %%s' % column)
+            params.append('%%%s%%' % term)
+
+        select = {}
+        select_params = []
+        order = []
+        if rank_field is not None:
+            select[rank_field] = 'similarity(%s, %%s)' % column
+            select_params.append(query)
+            order = ['-%s' % rank_field]
+
+        qs = qs.extra(select=select, select_params=select_params, where=where, params=params, order_by=order)
+        if kwargs.get('highlight'):
+            language = self._language(language_code)
+            ts_query = "to_tsquery('%s', %%s)" % language
+            qs = self._with_highlighter(qs, self._highlighter(ts_query, self._prefix_tsquery(query), language, using=qs.db, **kwargs))
+        return qs
+
     def _search(self, query, query_type='plain', **kwargs):
         """
         Returns a queryset after having applied the full-text search query. If rank_field
@@ -150,66 +360,342 @@ class SearchManager(BaseManager):
         query_type='' specifies the use of to_tsquery. The query_type is prefixed to ts_query.
         Also None can be used.
 
+        query_type='prefix' is meant for autocomplete: every word in the query is matched
+        as a prefix. It searches the trigram_field if the manager has one, otherwise the
+        prefix_field vector, otherwise the regular vector.
+
+        If the manager has a language_field, only the rows in the given language (by
+        default the manager's language_code) are searched, with that language's
+        configuration.
+
+        highlight is a list of field names to highlight with ts_headline; the result
+        is put on each instance as <field>_highlight. Headlines are expensive, so they
+        are computed with a separate query for the instances that are actually fetched,
+        never for the whole match set. highlight_start and highlight_stop (default
+        <b> and </b>) surround the matches, highlight_words limits the headline length.
+
         For possible rank_normalization values, refer to:
         http://www.postgresql.org/docs/8.3/static/textsearch-controls.html#TEXTSEARCH-RANKING
         """
         rank_field = kwargs.get('rank_field')
         rank_normalization = kwargs.get('rank_normalization', 32)
         rank_cutoff = kwargs.get('rank_cutoff')
-        qs = self.get_query_set()
 
-        func_name = '%sto_tsquery' % (query_type if query_type else '')
-        ts_query = "%s('%s', '%s')" % (func_name, self.language, query.replace("'", "''"))
-        where = ['%s.%s @@ %s' % (qn(self.model._meta.db_table), qn(self.vector_field.column), ts_query)]
+        language_code = kwargs.get('language') or self.language_code
+        vector_column = self.vector_field.column
+        language = self._language(language_code)
+        if query_type == 'prefix':
+            if self.trigram_field:
+                return self._search_trigram(query, **kwargs)
+            if self.prefix_field:
+                vector_column = self.model._meta.get_field(self.prefix_field).column
+                language = 'simple'
+            func_name = 'to_tsquery'
+            ts_text = self._prefix_tsquery(query)
+        else:
+            func_name = '%sto_tsquery' % (query_type if query_type else '')
+            ts_text = query
+        # The text of the query is a parameter of ts_query, never part of the SQL
+        ts_query = "%s('%s', %%s)" % (func_name, language)
+
+        qs = self._search_query_set(kwargs.get('primary'))
+        where = ['%s.%s @@ %s' % (qn(self.model._meta.db_table), qn(vector_column), ts_query)]
+        params = [ts_text]
+        language_where = self._language_where(language_code)
+        if language_where:
+            where.append(language_where)
 
         select = {}
+        select_params = []
         order = []
         if rank_field is not None:
-            select[rank_field] = 'ts_rank(%s.%s, %s, %d)' % (qn(self.model._meta.db_table), qn(self.vector_field.column), ts_query, rank_normalization)
+            select[rank_field] = 'ts_rank(%s.%s, %s, %d)' % (qn(self.model._meta.db_table), qn(vector_column), ts_query, rank_normalization)
+            select_params.append(ts_text)
             order = ['-%s' % rank_field]
             if rank_cutoff is not None:
-                cutoff_where = '%s > %s' % (select[rank_field], rank_cutoff)
+                cutoff_where = '%s > %s' % (select[rank_field], float(rank_cutoff))
                 where.append(cutoff_where)
+                params.append(ts_text)
 
-        qs = qs.extra(select=select, where=where, order_by=order)
+        qs = qs.extra(select=select, select_params=select_params, where=where, params=params, order_by=order)
+        if kwargs.get('highlight'):
+            qs = self._with_highlighter(qs, self._highlighter(ts_query, ts_text, language, using=qs.db, **kwargs))
+        instrumentation.current().phase('build')
         return qs
 
+    def search_ids(self, query, limit=None, offset=0, with_rank=True, after=None, **kwargs):
+        """
+        Only reads the primary keys and ranks of the matches. The ranks are numeric
+        rather than real, so the rank of after compares exactly.
+        """
+        kwargs['rank_field'] = '_fts_rank'
+        kwargs.pop('highlight', None)
+        qs = self._search(query, **kwargs)
+        rank_sql, rank_params = qs.query.extra['_fts_rank']
+        rank_sql = '(%s)::numeric' % rank_sql
+        qs = qs.extra(select={'_fts_rank': rank_sql}, select_params=rank_params).order_by('-_fts_rank', 'pk')
+        if after is not None:
+            pk = '%s.%s' % (qn(self.model._meta.db_table), qn(self.model._meta.pk.column))
+            qs = qs.extra(where=['(%s < %%s OR (%s = %%s AND %s > %%s))' % (rank_sql, rank_sql, pk)],
+                params=list(rank_params) + [after[0]] + list(rank_params) + [after[0], after[1]])
+        qs = qs.values_list('pk', '_fts_rank')
+        if limit is not None:
+            rows = qs[offset:offset + limit]
+        else:
+            rows = qs[offset:]
+        if with_rank:
+            return list(rows)
+        return [pk for pk, rank in rows]
+
+    def search_many(self, queries, limit=10, query_type='plain', **kwargs):
+        """
+        Runs the searches of queries together: the queries are a VALUES list, each
+        getting its best limit matches from a LATERAL subquery, SEARCH_MANY_BATCH_SIZE
+        queries per statement. LATERAL needs PostgreSQL 9.3 or later.
+        Trigram searches run one by one.
+        """
+        if query_type == 'prefix' and self.trigram_field:
+            return super(SearchManager, self).search_many(queries, limit, query_type=query_type, **kwargs)
+        rank_normalization = kwargs.get('rank_normalization', 32)
+        language_code = kwargs.get('language') or self.language_code
+        vector_column = self.vector_field.column
+        language = self._language(language_code)
+        if query_type == 'prefix':
+            if self.prefix_field:
+                vector_column = self.model._meta.get_field(self.prefix_field).column
+                language = 'simple'
+            func_name = 'to_tsquery'
+        else:
+            func_name = '%sto_tsquery' % (query_type if query_type else '')
+
+        table = qn(self.model._meta.db_table)
+        ts_query = "%s('%s', q.text)" % (func_name, language)
+        where = ['%s.%s @@ %s' % (table, qn(vector_column), ts_query)]
+        language_where = self._language_where(language_code)
+        if language_where:
+            where.append(language_where)
+        sql = ('SELECT q.id, r.pk FROM (VALUES %%s) q(id, text) CROSS JOIN LATERAL ('
+            'SELECT %s.%s AS pk, ts_rank(%s.%s, %s, %d) AS rank FROM %s WHERE %s ORDER BY 2 DESC LIMIT %d) r '
+            'ORDER BY q.id, r.rank DESC') % (table, qn(self.model._meta.pk.column), table, qn(vector_column), ts_query,
+            rank_normalization, table, ' AND '.join(where), limit)
+
+        results = dict((query, []) for query in queries)
+        queries = results.keys()
+        texts = queries
+        if query_type == 'prefix':
+            texts = [self._prefix_tsquery(query) for query in queries]
+        cursor = connections[self._search_query_set(kwargs.get('primary')).db].cursor()
+        for start in range(0, len(queries), SEARCH_MANY_BATCH_SIZE):
+            batch = texts[start:start + SEARCH_MANY_BATCH_SIZE]
+            params = []
+            for i, text in enumerate(batch):
+                params.extend([i, text])
+            cursor.execute(sql % ', '.join(['(%s, %s)'] * len(batch)), params)
+            for i, pk in cursor.fetchall():
+                results[queries[start + i]].append(pk)
+        return results
+
+    def _search_query_set(self, primary=False):
+        """
+        Returns the queryset searches start from, on a replica of the model's database
+        unless primary is true (see fts.routers).
+        """
+        return self.get_query_set().using(db_for_search(router.db_for_write(self.model), primary))
+
+    def _highlighter(self, ts_query, ts_text, language, highlight, using=None, **kwargs):
+        """
+        Returns a function that puts the ts_headline of every field in highlight on
+        the given instances, as <field>_highlight, with a single query on using.
+        ts_query is the SQL of the tsquery, whose parameter is ts_text.
+        """
+        options = 'StartSel=%s, StopSel=%s, MaxWords=%d, MinWords=%d' % (
+            kwargs.get('highlight_start', '<b>'),
+            kwargs.get('highlight_stop', '</b>'),
+            kwargs.get('highlight_words', 35),
+            max(1, kwargs.get('highlight_words', 35) / 2),
+        )
+        headlines = self._headlines_sql(highlight, ts_query, language)
+        pk_column = qn(self.model._meta.pk.column)
+
+        def highlighter(instances):
+            by_pk = dict((obj.pk, obj) for obj in instances)
+            sql = 'SELECT %s, %s FROM %s WHERE %s IN (%s)' % (pk_column, headlines, qn(self.model._meta.db_table), pk_column, ', '.join(['%s'] * len(by_pk)))
+            cursor = connections[using or DEFAULT_DB_ALIAS].cursor()
+            cursor.execute(sql, [ts_text, options] * len(highlight) + by_pk.keys())
+            for row in cursor.fetchall():
+                obj = by_pk[row[0]]
+                for field, headline in zip(highlight, row[1:]):
+                    setattr(obj, '%s_highlight' % field, headline)
+        return highlighter
+
+    def _headlines_sql(self, highlight, ts_query, language):
+        """
+        Returns the SQL selecting the ts_headline of every field in highlight, a field or
+        a 'fk__field' name like the indexed fields, taking ts_query and the options as params.
+        """
+        headlines = []
+        for field in highlight:
+            column = self._column_sql(field)
+            if column is None:
+                raise ValueError("Can't highlight %r: only fields of %s and 'fk__field' names are." % (field, self.model._meta.object_name))
+            headlines.append("ts_headline('%s', coalesce(%s,''), %s, %%s)" % (language, column, ts_query))
+        return ', '.join(headlines)
+
+    def search_count(self, query, approximate=False, threshold=10000, **kwargs):
+        """
+        Returns the number of instances matching query as a SearchCount.
+
+        Counting runs the whole match again, which is slow for broad queries. With
+        approximate=True the planner's row estimate is returned instead whenever it
+        is at least threshold; smaller results are still counted exactly. The method
+        attribute of the result is 'estimate' or 'exact' accordingly.
+        The estimate is only as good as the table statistics, so keep them fresh
+        with ANALYZE.
+        """
+        kwargs.pop('rank_field', None)
+        qs = self._search(query, **kwargs)
+        if approximate:
+            sql, params = qs.query.get_compiler(using=qs.db).as_sql()
+            cursor = connections[qs.db].cursor()
+            cursor.execute('EXPLAIN %s' % sql, params)
+            estimate = plan_rows(cursor.fetchone())
+            # Counted exactly if the plan has no estimate
+            if estimate is not None and estimate >= threshold:
+                return SearchCount(estimate, 'estimate')
+        return SearchCount(qs.count(), 'exact')
+
     def get_create_trigger(self):
         """Get the query required to create a trigger that updates the index
+
+        'fk__field' fields are supported: the vector is computed with subqueries on the
+        related tables, and triggers on those tables refresh the vectors of the rows
+        referencing a changed row with a single UPDATE.
+        Callables can't be evaluated by the database and are rejected.
         """
+        for field in self._fields.keys():
+            if self._column_sql(field, 'new') is None:
+                raise ValueError('%r of the %s model can not be indexed by a trigger.' % (field, self.model._meta.object_name))
+        relations = [f for f in self._fields.keys() if self._relation_path(f) is not None]
 
         # Unweighted version, all the weights are the same
-        if len(set(self._fields.values())) == 1:
+        if len(set(self._fields.values())) == 1 and not relations and not self.language_field:
             cols = ', '.join(["'%s'" % k for k in self._fields.keys()])
             q = "CREATE TRIGGER %s_tsvectorupdate_trigger BEFORE INSERT OR UPDATE ON %s FOR EACH ROW EXECUTE PROCEDURE tsvector_update_trigger(%s, '%s', %s);"
             q = q % (self.model._meta.db_table, self.model._meta.db_table, self.vector_field.column, self.language, cols)
-        else:
-            q = """CREATE OR REPLACE FUNCTION %(table)s_tsvectorupdate_function() RETURNS trigger AS $$
+            if self.prefix_field:
+                p = "\nCREATE TRIGGER %s_tsprefixupdate_trigger BEFORE INSERT OR UPDATE ON %s FOR EACH ROW EXECUTE PROCEDURE tsvector_update_trigger(%s, 'pg_catalog.simple', %s);"
+                q += p % (self.model._meta.db_table, self.model._meta.db_table, self.model._meta.get_field(self.prefix_field).column, cols)
+            return q
+
+        q = """CREATE OR REPLACE FUNCTION %(table)s_tsvectorupdate_function() RETURNS trigger AS $$
             BEGIN
-                NEW.%(vector_field)s :=
             """
-            items = self._fields.items()
-            items.sort(key=lambda i: i[1])
-            f, w = items[0]
-            f = self.model._meta.get_field(f)
-            clause = "setweight(to_tsvector('%s', coalesce(new.%s,'')), '%s')" % (self.language, qn(f.column), w)
-            q += "%s\n" % clause
-            if len(items) > 1:
-                for f, w in items[1:]:
-                    f = self.model._meta.get_field(f)
-                    clause = "|| setweight(to_tsvector('%s', coalesce(new.%s,'')), '%s')" % (self.language, qn(f.column), w)
-                    q += "%s\n" % clause
-            q += """;
+        items = self._fields.items()
+        items.sort(key=lambda i: i[1])
+        for column, config in self._vector_columns('new'):
+            q += "    NEW.%s :=\n" % column
+            q += "%s\n" % '\n|| '.join([self._vector_sql(f, w, config, 'new')[0] for f, w in items])
+            q += ";\n"
+        q += """
                 RETURN NEW;
             END
             $$ LANGUAGE plpgsql;
 
-            CREATE TRIGGER %(table)s_tsvectorupdate_trigger BEFORE INSERT OR UPDATE ON %(table)s FOR EACH ROW EXECUTE PROCEDURE %(table)s_tsvectorupdate_function();
+            CREATE TRIGGER %(table)s_tsvectorupdate_trigger BEFORE INSERT OR UPDATE%(of)s ON %(table)s FOR EACH ROW EXECUTE PROCEDURE %(table)s_tsvectorupdate_function();
             """
-
-            q = q % {'table': self.model._meta.db_table, 'vector_field': self.vector_field.column}
+        of = ''
+        if relations:
+            # The triggers on the related tables set the vectors themselves, don't recompute them
+            columns = set()
+            for field in self._fields.keys():
+                relation = self._relation_path(field)
+                columns.add(relation and relation[0][0].column or self.model._meta.get_field(field).column)
+            if self.language_field:
+                columns.add(self.model._meta.get_field(self.language_field).column)
+            of = ' OF %s' % ', '.join([qn(c) for c in sorted(columns)])
+        q = q % {'table': self.model._meta.db_table, 'of': of}
+
+        for relation_trigger in self._get_create_relation_triggers():
+            q += relation_trigger
         return q
 
+    def get_create_index(self):
+        """Get the query required to create the GIN index(es) on the search vector
+
+        With a language_field there is one partial index per language, so a search only
+        reads the postings of the language it is restricted to.
+        """
+        table = self.model._meta.db_table
+        column = self.vector_field.column
+        if not self.language_field:
+            return 'CREATE INDEX %s ON %s USING gin(%s);' % (qn('%s_%s' % (table, column)), qn(table), qn(column))
+        language_column = self.model._meta.get_field(self.language_field).column
+        q = []
+        for code in sorted(LANGUAGES.keys()):
+            if code or code == self.language_code:
+                # The same condition as the searches', so the planner picks the index
+                q.append("CREATE INDEX %s ON %s USING gin(%s) WHERE %s;" % (qn('%s_%s_%s' % (table, column, code or 'simple')), qn(table), qn(column),
+                    self._language_condition(code, qn(language_column))))
+        return '\n'.join(q)
+
+    def _get_create_relation_triggers(self):
+        """
+        Returns the queries creating a trigger on every table a 'fk__field' field goes
+        through. When a row changes in a way that affects the indexed text, the vectors
+        of all the rows referencing it are rebuilt with a set-based UPDATE.
+        """
+        # (ForeignKey names up to a related table) -> (ForeignKeys, columns to watch)
+        watched = {}
+        for field in self._fields.keys():
+            relation = self._relation_path(field)
+            if relation is None:
+                continue
+            path, final = relation
+            for i in range(len(path)):
+                key = tuple([f.name for f in path[:i + 1]])
+                column = i + 1 < len(path) and path[i + 1].column or final.column
+                watched.setdefault(key, (path[:i + 1], set()))[1].add(column)
+
+        table = qn(self.model._meta.db_table)
+        set_sql = self._set_vectors_sql(self._fields.items(), table)[0]
+        queries = []
+        for key, (path, columns) in sorted(watched.items()):
+            last = path[-1]
+            if len(path) == 1:
+                where = '%s.%s = NEW.%s' % (table, qn(last.column), qn(last.rel.get_related_field().column))
+            else:
+                tables = []
+                for i, f in enumerate(path[:-1]):
+                    related = '%s r%d' % (qn(f.rel.to._meta.db_table), i)
+                    if i:
+                        related = 'INNER JOIN %s ON r%d.%s = r%d.%s' % (related, i, qn(f.rel.get_related_field().column), i - 1, qn(f.column))
+                    tables.append(related)
+                where = '%s.%s IN (SELECT r0.%s FROM %s WHERE r%d.%s = NEW.%s)' % (table, qn(path[0].column),
+                    qn(path[0].rel.get_related_field().column), ' '.join(tables), len(path) - 2, qn(last.column),
+                    qn(last.rel.get_related_field().column))
+            columns = sorted(columns)
+            q = """
+            CREATE OR REPLACE FUNCTION %(name)s_function() RETURNS trigger AS $$
+            BEGIN
+                UPDATE %(table)s SET %(set)s WHERE %(where)s;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER %(name)s_trigger AFTER UPDATE OF %(of)s ON %(related)s FOR EACH ROW
+                WHEN (%(changed)s) EXECUTE PROCEDURE %(name)s_function();
+            """
+            queries.append(q % {
+                'name': '%s_%s_tsvector' % (self.model._meta.db_table, '_'.join(key)),
+                'table': table,
+                'set': set_sql,
+                'where': where,
+                'of': ', '.join([qn(c) for c in columns]),
+                'related': qn(last.rel.to._meta.db_table),
+                'changed': ' OR '.join(['OLD.%s IS DISTINCT FROM NEW.%s' % (qn(c), qn(c)) for c in columns]),
+            })
+        return queries
+
 
 class SearchableModel(BaseModel):
     class Meta:
@@ -1,19 +1,31 @@
 "Simple Fts backend"
 import re
 import os
+import time
 import datetime
 
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
-from django.db import connection, transaction
+from django.db import connection, connections, router, transaction, DEFAULT_DB_ALIAS
 from django.db.models import Q, Max
 from django.core.cache import cache
+from django.utils.hashcompat import md5_constructor
 
-from fts.backends.base import BaseClass, BaseModel, BaseManager
-from fts.models import Word, Index, Namespace
+from fts import instrumentation
+from fts.settings import FTS_FUZZY_MAX_DISTANCE, FTS_FUZZY_REFRESH
+from fts.routers import db_for_index, db_for_search
+from fts.query import Term, Phrase, Not, And, Or, parse as parse_boolean, positive_terms
+from fts.backends.base import InvalidFtsBackendError
+from fts.backends.base import BaseClass, BaseModel, BaseManager, PagedQuerySet, SearchHit, SearchCount
+try:
+    from fts.models import Word, Index, Namespace
+except ImportError:
+    raise InvalidFtsBackendError("Simple FTS backend requires FTS_BACKEND = 'simple://' or FTS_CONFIGURE_ALL_BACKENDS = True")
 
 import unicodedata
 from fts.words.stop import FTS_STOPWORDS
+from fts.words.fuzzy import SymmetricDeleteIndex
+from fts.words.suggest import Completions
 try:
     from fts.words.snowball import Stemmer
 except ImportError:
@@ -28,9 +40,127 @@ WEIGHTS = {
     'D' : 1
 }
 SEP = re.compile(r'[\s,.()\[\]|]')
+TOKEN = re.compile(r'[^\s,.()\[\]|]+', re.UNICODE)
+# Quoted phrases, and NEAR/n between two words (chains like a NEAR/2 b NEAR/3 c overlap)
+PHRASE = re.compile(r'"([^"]*)"')
+NEAR = re.compile(r'(?=(?:^|\s)([^\s"]+)\s+NEAR/(\d+)\s+([^\s"]+))')
+NEAR_OPERATOR = re.compile(r'\bNEAR/\d+\b')
+# Positions skipped between two fields, so phrases never span fields
+POSITION_GAP = 100
+# Primary keys given as params per query when checking further positional constraints
+POSITIONS_BATCH_SIZE = 500
 
 _NAMESPACES_CACHE = {}
 _NAMESPACES_CACHE_SYNC = {}
+# Database alias -> SymmetricDeleteIndex of its words
+_FUZZY_INDEXES = {}
+# (database alias, generation key) -> Completions of the words of a model and namespace
+_COMPLETIONS = {}
+
+def _namespace_condition(namespace_id):
+    # Right hand side of the condition on fts_index.namespace_id
+    return namespace_id is None and u'IS NULL' or u'= %d' % namespace_id
+
+def pack_positions(positions):
+    """
+    Returns the sorted positions as the base 36 differences between consecutive
+    positions, comma separated: [3, 5, 40] is '3,2,z'.
+    """
+    packed = []
+    last = 0
+    for position in sorted(positions):
+        delta = position - last
+        digits = ''
+        while True:
+            delta, digit = divmod(delta, 36)
+            digits = '0123456789abcdefghijklmnopqrstuvwxyz'[digit] + digits
+            if not delta:
+                break
+        packed.append(digits)
+        last = position
+    return ','.join(packed)
+
+def unpack_positions(packed):
+    positions = []
+    last = 0
+    for delta in (packed or '').split(','):
+        if delta:
+            last += int(delta, 36)
+            positions.append(last)
+    return positions
+
+def _phrase_match(slots):
+    """
+    Tells if there is a position p such that p + offset is among the positions of
+    every (offset, positions) in slots.
+    """
+    offset, positions = slots[0]
+    others = [(o - offset, set(p)) for o, p in slots[1:]]
+    for position in positions:
+        for delta, candidates in others:
+            if position + delta not in candidates:
+                break
+        else:
+            return True
+    return False
+
+def _near_match(first, second, distance):
+    """
+    Tells if two positions of the sorted lists first and second are at most distance apart.
+    """
+    i = j = 0
+    while i < len(first) and j < len(second):
+        if abs(first[i] - second[j]) <= distance:
+            return True
+        if first[i] < second[j]:
+            i += 1
+        else:
+            j += 1
+    return False
+
+def _boolean_match(node, leaf_match):
+    """
+    Tells if the tree of a boolean query (see fts.query) matches, leaf_match(node) telling
+    if each of its words and phrases does, or None if it has no words to look for, which
+    is then left out, as in SearchManager._boolean_sql().
+    """
+    if node is None:
+        return None
+    if isinstance(node, Not):
+        matched = _boolean_match(node.child, leaf_match)
+        if matched is None:
+            return None
+        return not matched
+    if isinstance(node, (And, Or)):
+        matched = [m for m in [_boolean_match(c, leaf_match) for c in node.children] if m is not None]
+        if not matched:
+            return None
+        if isinstance(node, And):
+            return False not in matched
+        return True in matched
+    return leaf_match(node)
+
+# Instances indexed per transaction by rebuild_index()
+REBUILD_BATCH_SIZE = 1000
+# Most queries, and parameters, per statement of search_many(): SQLite takes 999
+# parameters, and every word of a query is one
+SEARCH_MANY_BATCH_SIZE = 100
+SEARCH_MANY_BATCH_PARAMS = 900
+# Fuzzy searches: words shorter than FUZZY_MIN_LENGTH aren't expanded, and with
+# fuzzy=True words shorter than FUZZY_LONG_WORD within one edit only. Every word is
+# expanded to at most FUZZY_EXPANSIONS words, whose weight is multiplied by FUZZY_PENALTY
+# for every edit.
+FUZZY_MIN_LENGTH = 4
+FUZZY_LONG_WORD = 8
+FUZZY_EXPANSIONS = 20
+FUZZY_PENALTY = 0.5
+# Seconds the completions of suggest() are kept after the index changes
+SUGGEST_REFRESH = 60
+# Facets of search_facets() -> their column in the index
+FACETS = {
+    'namespace': 'namespace_id',
+    'content_type': 'content_type_id',
+}
 
 class SearchClass(BaseClass):
     def __init__(self, server, params):
@@ -47,9 +177,20 @@ class SearchManager(BaseManager):
         self.stem_words = kwargs.get('stem_words', True)
         self.exact_search = kwargs.get('exact_search', True)
         self.namespace = kwargs.get('namespace', None)
+        # Store the positions of the words, which phrase and NEAR queries need.
+        # Autocompletion (full_index) doesn't need them, and has many more postings.
+        self.positions = kwargs.get('positions', not self.full_index)
+
+    def _index_db(self):
+        """
+        Returns the alias of the database holding the words and postings of this manager.
+        """
+        return db_for_index(self.model, self.namespace)
 
     def _get_namespace_id(self, namespace):
-        _k_ = namespace
+        # Every database has its own namespace ids
+        db = self._index_db()
+        _k_ = (db, namespace)
         try:
             now = datetime.datetime.now()
             sync_time = _NAMESPACES_CACHE_SYNC.get(_k_)
@@ -68,11 +209,13 @@ class SearchManager(BaseManager):
             if expired:
                 raise KeyError
             namespace_id = _NAMESPACES_CACHE[_k_]
+            instrumentation.current().hit()
         except KeyError:
-            for n in Namespace.objects.all():
-                _NAMESPACES_CACHE[n.slug] = n.id
+            instrumentation.current().miss()
+            for n in Namespace.objects.using(db).all():
+                _NAMESPACES_CACHE[(db, n.slug)] = n.id
 
-            namespace_id = _NAMESPACES_CACHE.get(namespace)
+            namespace_id = _NAMESPACES_CACHE.get(_k_)
 
             # save sync time for cache:
             _NAMESPACES_CACHE[_k_] = namespace_id
@@ -80,6 +223,49 @@ class SearchManager(BaseManager):
 
         return namespace_id
 
+    def _fuzzy_index(self):
+        """
+        Returns the in-memory index of the words of the index database, first adding the
+        words created since it was last refreshed, at most every FTS_FUZZY_REFRESH seconds.
+        """
+        db = self._index_db()
+        index = _FUZZY_INDEXES.get(db)
+        if index is None:
+            index = _FUZZY_INDEXES.setdefault(db, SymmetricDeleteIndex(FTS_FUZZY_MAX_DISTANCE))
+            index.refreshed = 0
+        if time.time() - index.refreshed >= FTS_FUZZY_REFRESH and index.lock.acquire(False):
+            # Searches meanwhile use the index as it is
+            try:
+                words = Word.objects.using(db).filter(id__gt=index.last_id).order_by('id').values_list('id', 'word')
+                for id, word in words.iterator():
+                    index.add(word)
+                    index.last_id = id
+                index.refreshed = time.time()
+            finally:
+                index.lock.release()
+        return index
+
+    def _fuzzy_expansions(self, words, distance):
+        """
+        Returns a dict of the words to the (word, distance) pairs of the closest other
+        words of the vocabulary within distance, or if it's True within 1 edit of short
+        words and FTS_FUZZY_MAX_DISTANCE of long ones.
+        """
+        index = self._fuzzy_index()
+        expansions = {}
+        for word in words:
+            if len(word) >= FUZZY_MIN_LENGTH:
+                if distance is True:
+                    limit = len(word) < FUZZY_LONG_WORD and 1 or FTS_FUZZY_MAX_DISTANCE
+                else:
+                    limit = distance
+                # Searches matching words as prefixes already find the words it starts
+                prefix = not (self.full_index or self.exact_search)
+                found = [(w, d) for w, d in index.lookup(word, limit) if w != word and not (prefix and w.startswith(word))]
+                if found:
+                    expansions[word] = found[:FUZZY_EXPANSIONS]
+        return expansions
+
     def _get_idx_words(self, line, minlen=0):
         words = self._get_words(line, minlen)
         if self.full_index:
@@ -87,20 +273,225 @@ class SearchManager(BaseManager):
             words = set( word[i:j] for word in words for i in not word.isdigit() and range(len(word)) or (0,) for j in range(i+1, len(word)+1) if j-i > minlen )
         return words
     
-    def _get_words(self, line, minlen=0):
-        # Remove accents
-        line = ''.join((c for c in unicodedata.normalize('NFD', unicode(line)) if unicodedata.category(c) != 'Mn'))
-        # Lowercase and split in a set of words
-        words = set(SEP.split(line.lower()))
+    def _get_idx_positions(self, line, start=0):
+        """
+        Returns the positions of the words to index in line, as a dict, numbering
+        the tokens from start, and the position following the last token. Stop words
+        are not indexed but still take a position, so phrases keep their gaps.
+        """
+        stem = self._stemmer()
+        stopwords = FTS_STOPWORDS[self.language_code]
+        positions = {}
+        position = start
+        for token in SEP.split(self._normalize(line)):
+            if not token:
+                continue
+            if token not in stopwords:
+                word = stem(token)
+                if self.full_index:
+                    words = set( word[i:j] for i in not word.isdigit() and range(len(word)) or (0,) for j in range(i+1, len(word)+1) )
+                else:
+                    words = (word,)
+                for word in words:
+                    positions.setdefault(word, []).append(position)
+            position += 1
+        return positions, position
+
+    def _get_phrase_terms(self, phrase):
+        """
+        Returns the (offset, word) of the words of phrase to look for, stop words excluded.
+        """
+        stem = self._stemmer()
+        stopwords = FTS_STOPWORDS[self.language_code]
+        terms = []
+        position = 0
+        for token in SEP.split(self._normalize(phrase)):
+            if not token:
+                continue
+            if token not in stopwords:
+                terms.append((position, stem(token)))
+            position += 1
+        return terms
+
+    def _parse_query(self, query):
+        """
+        Returns the words the matches must all have, and the positional constraints
+        of the query: ('phrase', [(offset, word), ...]) for each quoted phrase and
+        ('near', word, word, distance) for each "word NEAR/distance word".
+        """
+        constraints = []
+        for phrase in PHRASE.findall(query):
+            terms = self._get_phrase_terms(phrase)
+            if len(terms) > 1:
+                constraints.append(('phrase', terms))
+        rest = PHRASE.sub(' ', query)
+        for first, distance, second in NEAR.findall(rest):
+            first = self._get_phrase_terms(first)
+            second = self._get_phrase_terms(second)
+            if len(first) == 1 and len(second) == 1:
+                constraints.append(('near', first[0][1], second[0][1], int(distance)))
+        words = self._get_words(NEAR_OPERATOR.sub(' ', rest))
+        for phrase in PHRASE.findall(query):
+            words |= self._get_words(phrase)
+        return words, constraints
+
+    def _positional_matches(self, constraints, namespace_id, db):
+        """
+        Returns the primary keys of the instances satisfying all the positional constraints,
+        read from the index on db. The positions for every constraint after the first are
+        only read for the instances matching so far, POSITIONS_BATCH_SIZE at a time.
+        """
+        ctype = ContentType.objects.get_for_model(self.model)
+        cursor = connections[db].cursor()
+        matches = None
+        for constraint in constraints:
+            if constraint[0] == 'phrase':
+                slots = constraint[1]
+            else:
+                slots = [(0, constraint[1]), (0, constraint[2])]
+            sql, params = self._postings_sql([w for o, w in slots], namespace_id, ctype.pk,
+                columns=u', '.join([u'i%d.positions' % i for i in range(len(slots))]))
+            if matches is None:
+                batches = [[]]
+            elif not matches:
+                return matches
+            else:
+                matches = sorted(matches)
+                batches = [matches[i:i+POSITIONS_BATCH_SIZE] for i in range(0, len(matches), POSITIONS_BATCH_SIZE)]
+            # Words matched as prefixes can give several rows per instance
+            found = {}
+            for batch in batches:
+                if batch:
+                    cursor.execute(u'%s AND i0.object_id IN (%s)' % (sql, u', '.join([u'%s'] * len(batch))), params + batch)
+                else:
+                    cursor.execute(sql, params)
+                for row in cursor.fetchall():
+                    lists = found.setdefault(row[0], [set() for s in slots])
+                    for positions, packed in zip(lists, row[1:]):
+                        positions.update(unpack_positions(packed))
+            pks = set()
+            for pk, lists in found.items():
+                if constraint[0] == 'phrase':
+                    ok = _phrase_match([(o, p) for (o, w), p in zip(slots, lists)])
+                else:
+                    ok = _near_match(sorted(lists[0]), sorted(lists[1]), constraint[3])
+                if ok:
+                    pks.add(pk)
+            matches = pks
+        return matches
+
+    def _normalize(self, line):
+        # Remove accents and lowercase
+        return ''.join((c for c in unicodedata.normalize('NFD', unicode(line)) if unicodedata.category(c) != 'Mn')).lower()
+
+    def _stemmer(self):
         # Stemmer function
         if self.stem_words:
-            stem = Stemmer(self.language_code)
-        else:
-            stem = lambda w: w
+            return Stemmer(self.language_code)
+        return lambda w: w
+
+    def _get_words(self, line, minlen=0):
+        # Split in a set of words
+        words = set(SEP.split(self._normalize(line)))
+        stem = self._stemmer()
         # Get stemmed set of words not in the list of stop words and with a minimum of a minlen length
         return set( stem(word) for word in words if word and word not in FTS_STOPWORDS[self.language_code] and len(word) > minlen )
+
+    def _highlight_text(self, text, words, start='<b>', stop='</b>', max_words=35):
+        """
+        Python counterpart of PostgreSQL's ts_headline: returns up to max_words words of
+        text, starting a little before the first match, with every word whose indexed
+        form matches one of words (as returned by _get_words) surrounded by start and stop.
+        """
+        text = unicode(text)
+        stem = self._stemmer()
+        stopwords = FTS_STOPWORDS[self.language_code]
+        tokens = list(TOKEN.finditer(text))
+        hits = []
+        for i, token in enumerate(tokens):
+            word = self._normalize(token.group())
+            if word in stopwords:
+                continue
+            word = stem(word)
+            if self.full_index:
+                matched = [w for w in words if w in word]
+            elif self.exact_search:
+                matched = word in words
+            else:
+                matched = [w for w in words if word.startswith(w)]
+            if matched:
+                hits.append(i)
+        if not tokens:
+            return text
+
+        first = 0
+        if len(tokens) > max_words and hits:
+            first = max(0, min(hits[0] - max_words / 4, len(tokens) - max_words))
+        last = min(len(tokens), first + max_words)
+        hits = set(hits)
+        headline = []
+        pos = tokens[first].start()
+        for i in range(first, last):
+            token = tokens[i]
+            headline.append(text[pos:token.start()])
+            if i in hits:
+                headline.append(u'%s%s%s' % (start, token.group(), stop))
+            else:
+                headline.append(token.group())
+            pos = token.end()
+        if last == len(tokens):
+            headline.append(text[pos:])
+        return u''.join(headline)
+
+    def _highlighter(self, query, highlight, **kwargs):
+        """
+        Returns a function that puts the highlighted text of every field in highlight on
+        the given instances, as <field>_highlight.
+        """
+        if kwargs.get('query_type') == 'boolean':
+            words = set()
+            for term in positive_terms(parse_boolean(query)):
+                words |= self._get_words(term.text)
+        else:
+            words = self._parse_query(query)[0]
+        options = {
+            'start': kwargs.get('highlight_start', '<b>'),
+            'stop': kwargs.get('highlight_stop', '</b>'),
+            'max_words': kwargs.get('highlight_words', 35),
+        }
+        def highlighter(instances):
+            for obj in instances:
+                for field in highlight:
+                    text = obj
+                    for col in field.split('__'):
+                        text = getattr(text, col)
+                    setattr(obj, '%s_highlight' % field, self._highlight_text(text or u'', words, **options))
+        return highlighter
         
-    def _update_index(self, pk, dumping=None):
+    def _shadow_namespace(self):
+        """
+        Returns the slug of the namespace rebuild_index() writes this model's new postings to.
+        Long namespaces are shortened with a hash of them, to fit in the slug column.
+        """
+        ctype = ContentType.objects.get_for_model(self.model)
+        suffix = u'~rebuild-%d' % ctype.pk
+        namespace = self.namespace or u''
+        max_length = Namespace._meta.get_field('slug').max_length
+        if len(namespace) + len(suffix) > max_length:
+            digest = md5_constructor(namespace.encode('utf8')).hexdigest()[:8]
+            namespace = u'%s-%s' % (namespace[:max_length - len(suffix) - len(digest) - 1], digest)
+        return namespace + suffix
+
+    def _rebuilding(self):
+        """
+        Returns the id of the shadow namespace if a rebuild_index() is in progress, else None.
+        The namespace only exists while it runs. It is looked up in the database, not
+        in the namespaces cache, so every process sees it right away.
+        """
+        ids = Namespace.objects.using(self._index_db()).filter(slug=self._shadow_namespace()).values_list('id', flat=True)
+        return ids and ids[0] or None
+
+    def _update_index(self, pk, dumping=None, shadow=None):
         """
             Recommended to call this in a separate transaction
             Index Update (Live or Dumping)
@@ -118,48 +509,73 @@ class SearchManager(BaseManager):
                     COPY fts_index FROM 'fts_index.txt';
             For Live update (very slow compared to dumping update):
                 TagLabel.autocomplete.update_index()
+            To rebuild the whole index while it's being searched:
+                TagLabel.autocomplete.rebuild_index()
             Usage:
                 TagLabel.autocomplete.search('label')
+            shadow is the id of the namespace of a rebuild_index() to index into instead.
         """
         if self.model._meta.abstract:
             return # skip abstract class updates
-        namespace_id = self._get_namespace_id(self.namespace)
-        if not namespace_id and self.namespace:
-            ns = Namespace.objects.create(slug=self.namespace)
-            namespace_id = ns.id
+        if shadow is None and pk is not None and dumping is None:
+            shadow_id = self._rebuilding()
+            if shadow_id is not None:
+                # A rebuild is in progress, its copy of the index must see this update too
+                self._update_index(pk, shadow=shadow_id)
+        timer = instrumentation.current()
+        db = self._index_db()
+        if shadow is not None:
+            namespace_id = shadow
+        else:
+            namespace_id = self._get_namespace_id(self.namespace)
+            if not namespace_id and self.namespace:
+                ns = Namespace.objects.using(db).create(slug=self.namespace)
+                namespace_id = ns.id
         ctype = ContentType.objects.get_for_model(self.model)
-        filter = { 'content_type__pk': ctype.pk }
-        if namespace_id: filter['namespace'] = namespace_id
+        delete_sql = 'DELETE FROM %s WHERE content_type_id = %%s AND namespace_id %s' % (qn(Index._meta.db_table), _namespace_condition(namespace_id))
+        # Read the instances from the primary, replicas may not have them yet
+        items = self.using(router.db_for_write(self.model))
         if pk is not None:
             if isinstance(pk, (set,list,tuple)):
-                filter['object_id__in'] = pk
-                items = self.filter(pk__in=pk)
+                # Inlined, as there can be more of them than SQLite takes parameters
+                delete_sql += ' AND object_id IN (%s)' % (', '.join([str(int(p)) for p in pk]) or 'NULL')
+                items = items.filter(pk__in=pk)
             else:
-                filter['object_id'] = pk
-                items = self.filter(pk=pk)
-        else:
-            items = self.all()
-        cursor = connection.cursor()
-        cursor.execute('DELETE FROM'+str(Index.objects.filter(**filter).query).split('FROM')[1])
-        transaction.set_dirty()
+                delete_sql += ' AND object_id = %d' % int(pk)
+                items = items.filter(pk=pk)
+        cursor = connections[db].cursor()
+        timer.phase('namespace')
+        cursor.execute(delete_sql, [ctype.pk])
+        transaction.commit_unless_managed(using=db)
+        timer.phase('delete')
         if dumping is None:
             c = { 'IW': {} }
         else:
-            c = dumping
-            c['fw'] = c.get('fw') or open('fts_word.txt', 'wt')
-            c['fi'] = c.get('fi') or open('fts_index.txt', 'wt')
+            # Every database gets its own files, with its own ids: fts_word.txt, fts_word.<alias>.txt...
+            if db == DEFAULT_DB_ALIAS:
+                c = dumping
+                suffix = ''
+            else:
+                c = dumping.setdefault(db, {})
+                suffix = '.%s' % db
+            c['fw'] = c.get('fw') or open('fts_word%s.txt' % suffix, 'wt')
+            c['fi'] = c.get('fi') or open('fts_index%s.txt' % suffix, 'wt')
             c['IW'] = c.get('IW')
             if not c['IW']:
                 c['IW'] = {}
                 c['widx'] = 0
-                c['iidx'] = (Index.objects.aggregate(Max('id'))['id__max'] or 0) + 1
-                for iw in Word.objects.all():
+                c['iidx'] = (Index.objects.using(db).aggregate(Max('id'))['id__max'] or 0) + 1
+                for iw in Word.objects.using(db).all():
                     if iw.id > c['widx']:
                         c['widx'] = iw.id
                     c['IW'][iw.word] = iw.id
                 c['widx'] += 1
+        timer.phase('words')
         for item in items:
+            timer.phase('fetch')
             item_words = {}
+            item_positions = {}
+            position = 0
             for field, weight in self._fields.items():
                 if callable(field):
                     words = field(item)
@@ -167,13 +583,21 @@ class SearchManager(BaseManager):
                     words = item
                     for col in field.split('__'):
                         words = getattr(words, col)
-                # get all the possible substrings for words
-                idx_words = self._get_idx_words(words)
+                if self.positions:
+                    idx_positions, position = self._get_idx_positions(words, position)
+                    position += POSITION_GAP
+                    idx_words = idx_positions.keys()
+                else:
+                    # get all the possible substrings for words
+                    idx_words = self._get_idx_words(words)
+                timer.phase('tokenize')
                 if dumping is None:
                     # of all those substrings, retrieve the missing ones in our c['IW'] dictionary
                     idx_words_to_get = [w for w in idx_words if w not in c['IW']]
-                if len(idx_words_to_get):
-                    for iw in Word.objects.filter(word__in=idx_words_to_get):
+                    timer.hit(len(idx_words) - len(idx_words_to_get))
+                    timer.miss(len(idx_words_to_get))
+                    if len(idx_words_to_get):
+                        for iw in Word.objects.using(db).filter(word__in=idx_words_to_get):
                             c['IW'][iw.word] = iw
                 # finally, for each substring to index, build the index in item_words:
                 for word in idx_words:
@@ -185,33 +609,756 @@ class SearchManager(BaseManager):
                             iw = c['IW'][word] = c['widx']
                             c['widx'] += 1
                         else:
-                            iw = Word.objects.get_or_create(word=word)[0]
+                            iw = Word.objects.using(db).get_or_create(word=word)[0]
                             c['IW'][word] = iw
                     if ord(weight) < ord(item_words.get(iw, 'Z')):
                         item_words[iw] = weight
+                    if self.positions:
+                        item_positions.setdefault(iw, []).extend(idx_positions[word])
+                timer.phase('words')
             for iw, weight in item_words.items():
+                positions = self.positions and pack_positions(item_positions[iw]) or None
                 if dumping is not None:
-                    print >>c['fi'], u'\t'.join([unicode(w) or '' for w in (c['iidx'], iw, WEIGHTS[weight], namespace_id, ctype.pk, item.pk)]).encode('utf8')
+                    print >>c['fi'], u'\t'.join([unicode(w) or '' for w in (c['iidx'], iw, WEIGHTS[weight], namespace_id, ctype.pk, item.pk)] + [positions or '']).encode('utf8')
                     c['iidx'] += 1
                 else:
-                    Index.objects.create(content_object=item, word=iw, weight=WEIGHTS[weight], namespace_id=namespace_id)
+                    Index.objects.using(db).create(content_type_id=ctype.pk, object_id=item.pk, word=iw, weight=WEIGHTS[weight], namespace_id=namespace_id, positions=positions)
+            timer.add_rows(len(item_words))
+            timer.phase('write')
+        if shadow is None:
+            self._bump_generation()
+
+    def rebuild_index(self, batch_size=REBUILD_BATCH_SIZE):
+        """
+        Rebuilds the index of all the instances while searches keep reading the current one.
+        The new postings are written to a shadow namespace, batch_size instances per
+        transaction, and live updates of instances go to both while it runs. Then a single
+        transaction replaces the current postings by the new ones, so searches see either
+        the old index or the new one, never a partial one. Don't call it inside a transaction.
+
+        The shadow namespace exists in the index's database only while the rebuild runs,
+        which is how the updates of every process know they must write to it too. If the
+        rebuild fails, it is deleted; if its process dies, updates keep writing to it too
+        until the next rebuild_index().
+        """
+        if self.model._meta.abstract:
+            return
+        in_transaction = transaction.commit_on_success(using=self._index_db())
+        index = in_transaction(self._update_index)
+        shadow_id = in_transaction(self._clear_shadow)()
+        try:
+            last_pk = None
+            while True:
+                items = self.using(router.db_for_write(self.model)).order_by('pk')
+                if last_pk is not None:
+                    items = items.filter(pk__gt=last_pk)
+                pks = list(items.values_list('pk', flat=True)[:batch_size])
+                if not pks:
+                    break
+                index(pks, shadow=shadow_id)
+                last_pk = pks[-1]
+            in_transaction(self._swap_shadow)(shadow_id)
+        except:
+            in_transaction(self._drop_shadow)(shadow_id)
+            raise
+
+    def _clear_shadow(self):
+        """
+        Creates the shadow namespace, or deletes what an interrupted rebuild left in it,
+        and returns its id.
+        """
+        db = self._index_db()
+        namespace_id = self._rebuilding()
+        if not namespace_id:
+            return Namespace.objects.using(db).create(slug=self._shadow_namespace()).id
+        ctype = ContentType.objects.get_for_model(self.model)
+        cursor = connections[db].cursor()
+        cursor.execute('DELETE FROM %s WHERE content_type_id = %%s AND namespace_id = %%s' % qn(Index._meta.db_table), [ctype.pk, namespace_id])
+        transaction.set_dirty(using=db)
+        return namespace_id
+
+    def _drop_shadow(self, shadow_id):
+        """
+        Deletes the shadow namespace and its postings, which ends the rebuild.
+        """
+        db = self._index_db()
+        cursor = connections[db].cursor()
+        cursor.execute('DELETE FROM %s WHERE namespace_id = %%s' % qn(Index._meta.db_table), [shadow_id])
+        transaction.set_dirty(using=db)
+        for ns in Namespace.objects.using(db).filter(pk=shadow_id):
+            ns.delete()
+
+    def _swap_shadow(self, shadow_id):
+        """
+        Replaces the postings of the model by the ones written by rebuild_index(), and
+        deletes the shadow namespace.
+        """
+        db = self._index_db()
+        ctype = ContentType.objects.get_for_model(self.model)
+        namespace_id = self._get_namespace_id(self.namespace)
+        if not namespace_id and self.namespace:
+            namespace_id = Namespace.objects.using(db).create(slug=self.namespace).id
+        index_table_name = qn(Index._meta.db_table)
+        cursor = connections[db].cursor()
+        if namespace_id:
+            cursor.execute('DELETE FROM %s WHERE content_type_id = %%s AND namespace_id = %%s' % index_table_name, [ctype.pk, namespace_id])
+        else:
+            cursor.execute('DELETE FROM %s WHERE content_type_id = %%s AND namespace_id IS NULL' % index_table_name, [ctype.pk])
+        cursor.execute('UPDATE %s SET namespace_id = %%s WHERE content_type_id = %%s AND namespace_id = %%s' % index_table_name,
+            [namespace_id, ctype.pk, shadow_id])
+        transaction.set_dirty(using=db)
+        self._drop_shadow(shadow_id)
+        self._bump_generation()
+
+    def update_index(self, pk=None):
+        # The postings may not be on the database of the instances
+        update_index = super(SearchManager, self).update_index
+        if self._index_db() != DEFAULT_DB_ALIAS:
+            update_index = transaction.commit_on_success(using=self._index_db())(update_index)
+        return update_index(pk)
+
+    def _postings_sql(self, words, namespace_id, ctype_id, columns=None, expansions=None):
+        """
+        Returns the SQL, and its params, selecting the object_id and rank of the instances
+        of ctype_id matching all of words in namespace_id, from the index alone. If columns
+        is given, it is selected instead of the rank, for every matching combination of postings.
+        expansions are the fuzzy matches of words (see _fuzzy_expansions()), which match too
+        with a penalty.
+        """
+        tables = []
+        params = []
+        weights = []
+        weights_params = []
+        for idx, word in enumerate(words):
+            if self.full_index or self.exact_search:
+                word_sql = u'w%d.word = %%%%s' % idx
+                params.append(word)
+            else:
+                word_sql = u'w%d.word LIKE %%%%s' % idx
+                params.append(u'%s%%' % word)
+            fuzzy = expansions and expansions.get(word)
+            if fuzzy:
+                word_sql = u'(%s OR w%d.word IN (%s))' % (word_sql, idx, u', '.join([u'%%s'] * len(fuzzy)))
+                params.extend([w for w, d in fuzzy])
+            if idx == 0:
+                tables.append(u'%(index)s i0 INNER JOIN %(word)s w0 ON (w0.id = i0.word_id AND ' + word_sql + u')')
+            else:
+                tables.append(u'INNER JOIN %%(index)s i%(idx)d ON (i%(idx)d.content_type_id = i0.content_type_id AND i%(idx)d.object_id = i0.object_id AND i%(idx)d.namespace_id %%(namespace)s) '
+                    u'INNER JOIN %%(word)s w%(idx)d ON (w%(idx)d.id = i%(idx)d.word_id AND ' % { 'idx': idx } + word_sql + u')')
+            if fuzzy:
+                weights.append(u'i%d.weight * (CASE w%d.word %s ELSE 1 END)' % (idx, idx,
+                    u' '.join([u'WHEN %%%%s THEN %s' % FUZZY_PENALTY ** d for w, d in fuzzy])))
+                weights_params.extend([w for w, d in fuzzy])
+            else:
+                weights.append(u'i%d.weight' % idx)
+        if columns is None:
+            sql = u'SELECT i0.object_id, MAX(%s) AS fts_rank FROM %s WHERE i0.content_type_id = %d AND i0.namespace_id %%(namespace)s GROUP BY i0.object_id' % (
+                u' + '.join(weights), u' '.join(tables), ctype_id)
+            params = weights_params + params
+        else:
+            sql = u'SELECT i0.object_id, %s FROM %s WHERE i0.content_type_id = %d AND i0.namespace_id %%(namespace)s' % (
+                columns, u' '.join(tables), ctype_id)
+        sql = sql % {
+            'index': qn(Index._meta.db_table),
+            'word': qn(Word._meta.db_table),
+            'namespace': _namespace_condition(namespace_id),
+        }
+        return sql, params
+
+    def _boolean_sql(self, node, namespace_id, ctype_id, db, outer, negated=False, leaves=None):
+        """
+        Compiles the tree of a boolean query (see fts.query) to a condition on outer, the
+        SQL of the primary keys. The words are IN subqueries on the index, which don't
+        depend on outer, so the matches are read from the postings of the words; only
+        the words under a NOT (negated) are correlated NOT EXISTS subqueries.
+        Returns the condition, its params, the (SQL, params) of the weight of every
+        word that isn't excluded, and the (SQL, params) of the object_id of postings
+        every match has one of (None if matches can have none, eg. under a NOT); or None
+        if node has no words to look for.
+
+        Phrases are only checked on the positions of their words if leaves is given: the
+        (node, condition, params, primary keys of the matches or None) of every word and
+        phrase are appended to it, to be checked in Python (see _boolean_postings_sql()).
+        The condition then only asks for the words of phrases, or nothing under a NOT.
+        """
+        if node is None:
+            return None
+        if isinstance(node, Not):
+            compiled = self._boolean_sql(node.child, namespace_id, ctype_id, db, outer, not negated, leaves)
+            if compiled is None:
+                return None
+            return u'NOT (%s)' % compiled[0], compiled[1], [], None
+        if isinstance(node, (And, Or)):
+            compiled = [self._boolean_sql(c, namespace_id, ctype_id, db, outer, negated, leaves) for c in node.children]
+            compiled = [c for c in compiled if c is not None]
+            if not compiled:
+                return None
+            operator = isinstance(node, And) and u' AND ' or u' OR '
+            sql = operator.join([u'(%s)' % c[0] for c in compiled])
+            params = []
+            ranks = []
+            for c in compiled:
+                params.extend(c[1])
+                ranks.extend(c[2])
+            drivers = [c[3] for c in compiled if c[3] is not None]
+            if isinstance(node, And) or len(compiled) == 1:
+                driver = drivers and drivers[0] or None
+            elif len(drivers) == len(compiled):
+                driver = (u' UNION '.join([d[0] for d in drivers]), [p for d in drivers for p in d[1]])
+                # The IN subqueries of the alternatives can't be read from on their own
+                # but their union can; it is all there is to check for single words
+                if [(c[0], c[1]) for c in compiled] == [(u'%s IN (%s)' % (outer, d[0]), d[1]) for d in drivers]:
+                    sql, params = u'%s IN (%s)' % (outer, driver[0]), driver[1]
+                else:
+                    sql, params = u'%s IN (%s) AND (%s)' % (outer, driver[0], sql), driver[1] + params
+            else:
+                driver = None
+            return sql, params, ranks, driver
+
+        if isinstance(node, Term) and node.prefix:
+            # Prefixes are neither stemmed nor expanded to substrings
+            words = [(u'%s%%' % w, True) for w in SEP.split(self._normalize(node.text)) if w]
+        else:
+            like = not (self.full_index or self.exact_search)
+            words = [(like and u'%s%%' % w or w, like) for w in self._get_words(node.text)]
+        if not words:
+            return None
+        postings = u'FROM %s bi INNER JOIN %s bw ON (bw.id = bi.word_id) WHERE bi.content_type_id = %d AND bi.namespace_id %s' % (
+            qn(Index._meta.db_table), qn(Word._meta.db_table), ctype_id, _namespace_condition(namespace_id))
+        correlated = u'%s AND bi.object_id = %s' % (postings, outer)
+        conditions = []
+        params = []
+        ranks = []
+        driver = None
+        for word, like in words:
+            word_sql = like and u'bw.word LIKE %s' or u'bw.word = %s'
+            if negated:
+                conditions.append(u'EXISTS (SELECT 1 %s AND %s)' % (correlated, word_sql))
+            else:
+                conditions.append(u'%s IN (SELECT bi.object_id %s AND %s)' % (outer, postings, word_sql))
+                driver = driver or (u'SELECT bi.object_id %s AND %s' % (postings, word_sql), [word])
+            params.append(word)
+            ranks.append((u'COALESCE((SELECT MAX(bi.weight) %s AND %s), 0)' % (correlated, word_sql), [word]))
+        sql = u' AND '.join(conditions)
+        pks = None
+        if leaves is not None:
+            if isinstance(node, Phrase) and self._has_positions(node):
+                pks = self._positional_matches([('phrase', self._get_phrase_terms(node.text))], namespace_id, db)
+            leaves.append((node, sql, params, pks))
+            if pks is not None and negated:
+                return u'1 = 0', [], [], None
+        return sql, params, ranks, driver
+
+    def _has_positions(self, node):
+        """
+        Tells if the tree of a boolean query has phrases to check on the positions of their words.
+        """
+        if isinstance(node, Phrase):
+            return self.positions and len(self._get_phrase_terms(node.text)) > 1
+        if isinstance(node, Not):
+            return self._has_positions(node.child)
+        if isinstance(node, (And, Or)):
+            return True in [self._has_positions(c) for c in node.children]
+        return False
+
+    def _search_boolean(self, query, qs, namespace_id, db, read_db, **kwargs):
+        """
+        Searches a boolean query (see fts.query) with a single query: the words are
+        semi-joins (IN) and anti-joins (NOT EXISTS) on the index, and the rank is
+        the sum of the weights of the words found that aren't excluded.
+        """
+        rank_field = kwargs.get('rank_field')
+        node = parse_boolean(query)
+        ctype = ContentType.objects.get_for_model(self.model)
+        sharded = db != router.db_for_write(self.model)
+        if not sharded and not self._has_positions(node):
+            outer = u'%s.%s' % (qn(self.model._meta.db_table), qn(self.model._meta.pk.column))
+            compiled = self._boolean_sql(node, namespace_id, ctype.pk, read_db, outer)
+            if compiled is None:
+                return qs.none()
+            where, params, ranks, driver = compiled
+            qs = qs.using(read_db).extra(where=[where], params=params)
+            if rank_field is not None:
+                select_params = []
+                for sql, rank_params in ranks:
+                    select_params.extend(rank_params)
+                qs = qs.extra(select={rank_field: u' + '.join([sql for sql, rank_params in ranks]) or u'0'},
+                    select_params=select_params, order_by=['-%s' % rank_field])
+            return qs
+
+        # The index isn't on the database of the instances, so only the indexed ones can be
+        # found, or phrases are checked on their positions: the matches are read from the index
+        if not sharded:
+            qs = qs.using(read_db)
+        compiled = self._boolean_postings_sql(node, namespace_id, ctype.pk, read_db)
+        if compiled is None:
+            return qs.none()
+        sql, params, keep = compiled
+        return self._paged(qs, sql, params, read_db, keep, **kwargs)
+
+    def _boolean_postings_sql(self, node, namespace_id, ctype_id, db):
+        """
+        Returns the SQL, and its params, selecting the object_id and rank of the instances
+        of ctype_id matching the tree of a boolean query, from the index alone, and the
+        function telling which of its rows match (None if all do); or None if it has no
+        words. The instances are those of the postings of the words, unless the query can
+        match instances without any (eg. NOT word).
+
+        Phrases are checked on the positions of their words in Python: the rows then have
+        a column for each word and phrase, telling if the instance has its words, and the
+        function evaluates the query with them, instead of sending the matches of the
+        phrases back to the database.
+        """
+        leaves = []
+        compiled = self._boolean_sql(node, namespace_id, ctype_id, db, u'o.object_id', leaves=leaves)
+        if compiled is None:
+            return None
+        where, params, ranks, driver = compiled
+        select_params = []
+        for sql, word_params in ranks:
+            select_params.extend(word_params)
+        keep = None
+        flags = u''
+        if [pks for leaf, sql, word_params, pks in leaves if pks is not None]:
+            columns = dict((id(leaf[0]), i) for i, leaf in enumerate(leaves))
+            def keep(row):
+                def leaf_match(leaf):
+                    if id(leaf) not in columns:
+                        return None
+                    i = columns[id(leaf)]
+                    pks = leaves[i][3]
+                    return bool(row[2 + i]) and (pks is None or row[0] in pks)
+                return _boolean_match(node, leaf_match)
+            flags = u''.join([u', CASE WHEN %s THEN 1 ELSE 0 END' % sql for leaf, sql, word_params, pks in leaves])
+            for leaf, sql, word_params, pks in leaves:
+                select_params.extend(word_params)
+        if driver is None:
+            driver = u'SELECT object_id FROM %s WHERE content_type_id = %d AND namespace_id %s' % (
+                qn(Index._meta.db_table), ctype_id, _namespace_condition(namespace_id)), []
+        sql = u'SELECT o.object_id, %s AS fts_rank%s FROM (SELECT DISTINCT object_id FROM (%s) d) o WHERE %s' % (
+            u' + '.join([sql for sql, word_params in ranks]) or u'0', flags, driver[0], where)
+        return sql, select_params + driver[1] + params, keep
+
+    def _search_shard(self, qs, words, namespace_id, db, expansions=None, pks=None, **kwargs):
+        """
+        Searches an index that isn't on the database of the model, or with positional
+        constraints: the matches are read from the index on db a page at a time, then
+        fetched by primary key (see _paged()). pks are the only instances that can match,
+        if given.
+        """
+        ctype = ContentType.objects.get_for_model(self.model)
+        sql, params = self._postings_sql(words, namespace_id, ctype.pk, expansions=expansions)
+        keep = None
+        if pks is not None:
+            keep = lambda row: row[0] in pks
+        return self._paged(qs, sql, params, db, keep, **kwargs)
+
+    def _search_grouped(self, qs, words, namespace_id, expansions, **kwargs):
+        """
+        Searches with the fuzzy expansions of words: as several words can match each
+        word of the query, the postings are grouped by instance first (see _postings_sql()),
+        so every instance comes once, with its best rank.
+        """
+        rank_field = kwargs.get('rank_field')
+        ctype = ContentType.objects.get_for_model(self.model)
+        sql, params = self._postings_sql(words, namespace_id, ctype.pk, expansions=expansions)
+        # FROM params aren't supported either, they're inlined like in _search()
+        sql = sql % tuple(["'%s'" % p.replace("'", "''").replace('%', '%%') for p in params])
+        table_name = self.model._meta.db_table
+        joins = u'INNER JOIN (%s) fts_matches ON (fts_matches.object_id = %s.%s)' % (sql, qn(table_name), qn(self.model._meta.pk.column))
+        qs.query.table_alias(table_name)
+        qs.query.alias_map[table_name] = (table_name, joins, None, None, None, None, None)
+        if rank_field is not None:
+            qs = qs.extra(select={rank_field: 'fts_matches.fts_rank'}, order_by=['-%s' % rank_field])
+        return qs
+
+    def _paged(self, qs, sql, params, db, keep=None, **kwargs):
+        """
+        Returns qs as a PagedQuerySet of the (object_id, fts_rank) rows sql selects from
+        the index on db, best first: every page of them is read with LIMIT and OFFSET,
+        and they are counted with COUNT(*). If keep is given, the rows for which it
+        isn't true are left out as they are read instead.
+        """
+        def matches(offset, limit):
+            cursor = connections[db].cursor()
+            if keep is None and limit is not None:
+                cursor.execute(u'%s ORDER BY 2 DESC, 1 LIMIT %d OFFSET %d' % (sql, limit, offset), params)
+                return cursor.fetchall()
+            cursor.execute(u'%s ORDER BY 2 DESC, 1' % sql, params)
+            rows = [tuple(row[:2]) for row in cursor.fetchall() if keep is None or keep(row)][offset:]
+            if limit is not None:
+                rows = rows[:limit]
+            return rows
+
+        def count():
+            if keep is not None:
+                return len(matches(0, None))
+            cursor = connections[db].cursor()
+            cursor.execute(u'SELECT COUNT(*) FROM (%s) fts_matches' % sql, params)
+            return cursor.fetchone()[0]
+
+        return qs._clone(klass=PagedQuerySet, _matches=matches, _count=count,
+            _limit=kwargs.get('limit'), _rank_field=kwargs.get('rank_field'))
+
+    def _matches_sql(self, query, **kwargs):
+        """
+        Returns the SQL selecting the object_id and fts_rank of the matches of query from
+        the index alone, its params, the function telling which of its rows match (None
+        if all do, see _boolean_postings_sql()), and the database to run it on; or None if
+        nothing can match.
+        """
+        namespace_id = self._get_namespace_id(self.namespace)
+        if namespace_id is None and self.namespace:
+            return None
+        ctype = ContentType.objects.get_for_model(self.model)
+        read_db = db_for_search(self._index_db(), kwargs.get('primary'))
+        keep = None
+        if kwargs.get('query_type') == 'boolean':
+            compiled = self._boolean_postings_sql(parse_boolean(query), namespace_id, ctype.pk, read_db)
+            if compiled is not None:
+                compiled, keep = compiled[:2], compiled[2]
+        else:
+            words, constraints = self._parse_query(query)
+            expansions = kwargs.get('fuzzy') and self._fuzzy_expansions(words, kwargs['fuzzy']) or None
+            compiled = words and self._postings_sql(sorted(words), namespace_id, ctype.pk, expansions=expansions) or None
+            if compiled is not None and constraints and self.positions:
+                pks = self._positional_matches(constraints, namespace_id, read_db)
+                if not pks:
+                    return None
+                keep = lambda row: row[0] in pks
+        if compiled is None:
+            return None
+        return compiled[0], compiled[1], keep, read_db
+
+    def search_ids(self, query, limit=None, offset=0, with_rank=True, after=None, **kwargs):
+        """
+        Reads the matches from the index alone, never from the model's table, so they
+        can include instances deleted since they were indexed (see fts_gc).
+        """
+        compiled = self._matches_sql(query, **kwargs)
+        if compiled is None:
+            return []
+        sql, params, keep, read_db = compiled
+        sql = u'SELECT t.* FROM (%s) t' % sql
+        if after is not None:
+            sql += u' WHERE t.fts_rank < %s OR (t.fts_rank = %s AND t.object_id > %s)'
+            params = params + [after[0], after[0], after[1]]
+        sql += u' ORDER BY 2 DESC, 1'
+        if limit is not None and keep is None:
+            sql += u' LIMIT %d OFFSET %d' % (limit, offset)
+        cursor = connections[read_db].cursor()
+        cursor.execute(sql, params)
+        rows = [tuple(row[:2]) for row in cursor.fetchall() if keep is None or keep(row)]
+        if limit is None or keep is not None:
+            rows = rows[offset:]
+            if limit is not None:
+                rows = rows[:limit]
+        if with_rank:
+            return rows
+        return [pk for pk, rank in rows]
+
+    def _generation_key(self):
+        return 'fts-generation-%s-%s' % (ContentType.objects.get_for_model(self.model).pk, self.namespace or '')
+
+    def _generation(self):
+        """
+        Returns the stamp of the current state of the index of the model, which changes
+        whenever it is updated. Cached counts are keyed by it, so they're never stale.
+        """
+        generation = cache.get(self._generation_key())
+        if generation is None:
+            generation = self._bump_generation()
+        return generation
+
+    def _bump_generation(self):
+        generation = '%.6f' % time.time()
+        cache.set(self._generation_key(), generation)
+        return generation
+
+    def search_count(self, query, cache_timeout=None, **kwargs):
+        """
+        Counts the matches of query from the index alone, without the model's table (see
+        search_ids()). With cache_timeout, the count is cached for that many seconds, or
+        until the index of the model is updated.
+        """
+        key = None
+        if cache_timeout is not None:
+            # Every argument changing which instances match must be in the key
+            key = 'fts-count-%s' % md5_constructor(repr((self._generation_key(), self._generation(),
+                query, kwargs.get('query_type'), kwargs.get('fuzzy')))).hexdigest()
+            count = cache.get(key)
+            if count is not None:
+                return SearchCount(count)
+        count = 0
+        compiled = self._matches_sql(query, **kwargs)
+        if compiled is not None:
+            sql, params, keep, read_db = compiled
+            cursor = connections[read_db].cursor()
+            if keep is not None:
+                cursor.execute(sql, params)
+                count = len([row for row in cursor.fetchall() if keep(row)])
+            else:
+                cursor.execute(u'SELECT COUNT(*) FROM (%s) t' % sql, params)
+                count = cursor.fetchone()[0]
+        if key is not None:
+            cache.set(key, count, cache_timeout)
+        return SearchCount(count)
+
+    def search_facets(self, query, by=('namespace', 'content_type'), **kwargs):
+        """
+        Counts the matches of query in every namespace and content type of the index
+        (not only the manager's), with a single query: a UNION ALL of the counts grouped
+        by each of by. Returns {'namespace': {slug: count}, 'content_type': {ContentType:
+        count}}, the slug of the postings outside any namespace being None. Phrases and
+        NEAR are taken as plain words.
+        """
+        for facet in by:
+            if facet not in FACETS:
+                raise ValueError('Unknown facet %r, expected one of %s.' % (facet, ', '.join(FACETS)))
+        facets = dict((facet, {}) for facet in by)
+        words = sorted(self._parse_query(query)[0])
+        if not words or not by:
+            return facets
+        like = not (self.full_index or self.exact_search)
+        word_sql = like and u'w.word LIKE %s' or u'w.word = %s'
+        if like:
+            words = [u'%s%%' % w for w in words]
+        db = db_for_search(self._index_db(), kwargs.get('primary'))
+        namespaces = dict(Namespace.objects.using(db).values_list('id', 'slug'))
+        # The copies of the index of the rebuilds in progress would count their instances twice
+        shadows = [str(int(pk)) for pk, slug in namespaces.items() if '~rebuild-' in slug]
+        shadows_sql = shadows and u' AND (i.namespace_id IS NULL OR i.namespace_id NOT IN (%s))' % u', '.join(shadows) or u''
+        # An instance matches if it has all the words in the same content type and namespace
+        matches = (u'SELECT i.content_type_id, i.namespace_id, i.object_id FROM %s i INNER JOIN %s w ON (w.id = i.word_id) '
+            u'WHERE (%s)%s GROUP BY i.content_type_id, i.namespace_id, i.object_id HAVING COUNT(DISTINCT CASE %s END) = %d') % (
+            qn(Index._meta.db_table), qn(Word._meta.db_table), u' OR '.join([word_sql] * len(words)), shadows_sql,
+            u' '.join([u'WHEN %s THEN %d' % (word_sql, i) for i in range(len(words))]), len(words))
+        selects = []
+        params = []
+        for i, facet in enumerate(by):
+            selects.append(u'SELECT %d, m.%s, COUNT(*) FROM (%s) m GROUP BY m.%s' % (i, FACETS[facet], matches, FACETS[facet]))
+            params.extend(words + words)
+        cursor = connections[db].cursor()
+        cursor.execute(u' UNION ALL '.join(selects), params)
+        rows = cursor.fetchall()
+
+        for i, value, count in rows:
+            facet = by[i]
+            if facet == 'namespace':
+                facets[facet][value is not None and namespaces.get(value) or None] = count
+            else:
+                facets[facet][ContentType.objects.get_for_id(value)] = count
+        return facets
+
+    def suggest(self, prefix, limit=10):
+        """
+        Returns the (word, number of instances) pairs of the limit indexed words starting
+        with the last word of prefix that the most instances of the model have, most
+        frequent first. The words are those of the index, so they're stems if the manager
+        stems them. They're completed in memory, without any query once loaded.
+        """
+        words = SEP.split(self._normalize(prefix))
+        if not words[-1]:
+            return []
+        return self._completions().complete(words[-1], limit)
+
+    def _completions(self):
+        """
+        Returns the Completions of the indexed words of the model and namespace, loaded
+        again if the index changed and they are SUGGEST_REFRESH seconds old.
+        """
+        key = (self._index_db(), self._generation_key())
+        generation = self._generation()
+        completions = _COMPLETIONS.get(key)
+        if completions is not None and (completions.generation == generation or time.time() - completions.loaded < SUGGEST_REFRESH):
+            return completions
+
+        frequencies = []
+        namespace_id = self._get_namespace_id(self.namespace)
+        if namespace_id is not None or not self.namespace:
+            ctype = ContentType.objects.get_for_model(self.model)
+            # An instance has a single posting per word
+            cursor = connections[db_for_search(self._index_db())].cursor()
+            cursor.execute('SELECT w.word, COUNT(*) FROM %s i INNER JOIN %s w ON (w.id = i.word_id) '
+                'WHERE i.content_type_id = %d AND i.namespace_id %s GROUP BY w.word' % (
+                qn(Index._meta.db_table), qn(Word._meta.db_table), ctype.pk, _namespace_condition(namespace_id)))
+            frequencies = cursor.fetchall()
+        completions = Completions(frequencies)
+        completions.generation = generation
+        completions.loaded = time.time()
+        _COMPLETIONS[key] = completions
+        return completions
+
+    def search_many(self, queries, limit=10, **kwargs):
+        """
+        Runs the searches of queries together, from the index alone: every statement
+        is a UNION ALL of the best limit matches of up to SEARCH_MANY_BATCH_SIZE queries,
+        with SEARCH_MANY_BATCH_PARAMS params at most (unless one query alone has more).
+        Phrases and NEAR are taken as plain words, and the primary keys can be of
+        instances deleted since they were indexed (see fts_gc).
+        """
+        if kwargs.get('query_type') == 'boolean':
+            return super(SearchManager, self).search_many(queries, limit, **kwargs)
+        results = dict((query, []) for query in queries)
+        namespace_id = self._get_namespace_id(self.namespace)
+        if namespace_id is None and self.namespace:
+            return results
+        ctype = ContentType.objects.get_for_model(self.model)
+        compiled = []
+        for query in results:
+            words = sorted(self._parse_query(query)[0])
+            if words:
+                sql, params = self._postings_sql(words, namespace_id, ctype.pk)
+                compiled.append((query, sql, params))
+
+        batches = []
+        batch_params = 0
+        for query in compiled:
+            if not batches or len(batches[-1]) == SEARCH_MANY_BATCH_SIZE or batch_params + len(query[2]) > SEARCH_MANY_BATCH_PARAMS:
+                batches.append([])
+                batch_params = 0
+            batches[-1].append(query)
+            batch_params += len(query[2])
+
+        cursor = connections[db_for_search(self._index_db(), kwargs.get('primary'))].cursor()
+        for batch in batches:
+            selects = []
+            params = []
+            for i, (query, sql, query_params) in enumerate(batch):
+                selects.append(u'SELECT %d, t.* FROM (%s ORDER BY 2 DESC, 1 LIMIT %d) t' % (i, sql, limit))
+                params.extend(query_params)
+            cursor.execute(u' UNION ALL '.join(selects), params)
+            matches = {}
+            for i, pk, rank in cursor.fetchall():
+                matches.setdefault(i, []).append((-rank, pk))
+            for i, ranked in matches.items():
+                ranked.sort()
+                results[batch[i][0]] = [pk for rank, pk in ranked]
+        return results
+
+    @classmethod
+    def _search_models(cls, query, managers, limit, **kwargs):
+        """
+        Searches all the managers with one query per index database. Every word of query
+        is looked for on its own, with the best weight of the postings it matches, then
+        the instances having all the words of a manager are kept, with the sum of these
+        weights as rank. Phrases and NEAR are taken as plain words.
+        """
+        by_db = {}
+        for manager in managers:
+            db = manager._index_db()
+            by_db.setdefault(db_for_search(db, kwargs.get('primary')), []).append(manager)
+        hits = []
+        for db, managers in by_db.items():
+            terms = []
+            params = []
+            needed = []
+            ctypes = {}
+            for m, manager in enumerate(managers):
+                namespace_id = manager._get_namespace_id(manager.namespace)
+                words = sorted(manager._parse_query(query)[0])
+                if (namespace_id is None and manager.namespace) or not words:
+                    continue
+                ctype = ContentType.objects.get_for_model(manager.model)
+                ctypes[ctype.pk] = ctype
+                like = not (manager.full_index or manager.exact_search)
+                word_sql = like and u'w.word LIKE %s' or u'w.word = %s'
+                if like:
+                    words = [u'%s%%' % w for w in words]
+                # One row per instance and word, so a posting can match several prefixes,
+                # and a word matching several postings counts once, with the best weight
+                for word in words:
+                    terms.append(u'SELECT %d AS manager, i.content_type_id, i.namespace_id, i.object_id, MAX(i.weight) AS weight '
+                        u'FROM %s i INNER JOIN %s w ON (w.id = i.word_id) WHERE i.content_type_id = %d AND i.namespace_id %s AND %s '
+                        u'GROUP BY i.content_type_id, i.namespace_id, i.object_id' % (m, qn(Index._meta.db_table), qn(Word._meta.db_table),
+                        ctype.pk, _namespace_condition(namespace_id), word_sql))
+                    params.append(word)
+                needed.append(u'WHEN %d THEN %d' % (m, len(words)))
+            if not terms:
+                continue
+            # Managers of the same content type and namespace find the same instances,
+            # which are kept once
+            sql = (u'SELECT content_type_id, object_id, MAX(fts_rank) FROM (SELECT t.content_type_id, t.namespace_id, t.object_id, SUM(t.weight) AS fts_rank '
+                u'FROM (%s) t GROUP BY t.manager, t.content_type_id, t.namespace_id, t.object_id HAVING COUNT(*) = CASE t.manager %s END) r '
+                u'GROUP BY content_type_id, namespace_id, object_id ORDER BY 3 DESC LIMIT %d') % (
+                u' UNION ALL '.join(terms), u' '.join(needed), limit)
+            cursor = connections[db].cursor()
+            cursor.execute(sql, params)
+            hits.extend([SearchHit(ctypes[ctype_id], object_id, rank) for ctype_id, object_id, rank in cursor.fetchall()])
+        hits.sort(key=lambda hit: -hit[2])
+        return hits[:limit]
 
     def _search(self, query, **kwargs):
+        """
+        Returns a queryset of the instances having all the words of query. Quoted
+        phrases must appear as such, and "word NEAR/n word" needs both words at most n
+        words apart; these are checked on the positions of the words, if the manager
+        stores them (positions=True, the default unless full_index). If rank_field is
+        given, the results get the sum of the weights of the words as rank_field, and
+        are ordered by it.
+
+        query_type='boolean' understands AND, OR, NOT, parentheses and prefixes (see
+        fts.query) instead.
+
+        fuzzy=True (or the largest edit distance) also matches the words of the vocabulary
+        close to the words of query, eg. misspelled, with weights halved for every edit.
+        """
         rank_field = kwargs.get('rank_field')
+        timer = instrumentation.current()
         qs = self.get_query_set()
         
         joins = []
         weights = []
         joins_params = []
         namespace_id = self._get_namespace_id(self.namespace)
-        for idx, word in enumerate(self._get_words(query)):
+        if namespace_id is None and self.namespace:
+            return qs.none() # nothing was ever indexed in it
+        timer.phase('namespace')
+        db = self._index_db()
+        read_db = db_for_search(db, kwargs.get('primary'))
+        if kwargs.get('query_type') == 'boolean':
+            qs = self._search_boolean(query, qs, namespace_id, db, read_db, **kwargs)
+            if kwargs.get('highlight'):
+                qs = self._with_highlighter(qs, self._highlighter(query, **kwargs))
+            timer.phase('build')
+            return qs
+        words, constraints = self._parse_query(query)
+        timer.phase('tokenize')
+        expansions = {}
+        if kwargs.get('fuzzy'):
+            expansions = self._fuzzy_expansions(words, kwargs['fuzzy'])
+            timer.phase('fuzzy')
+        pks = None
+        if constraints and self.positions:
+            pks = set(self._positional_matches(constraints, namespace_id, read_db))
+            timer.phase('positions')
+            if not pks:
+                return qs.none()
+        sharded = db != router.db_for_write(self.model)
+        if not sharded:
+            # The instances are on the same database, and replicas, as the index
+            qs = qs.using(read_db)
+        if (sharded and words) or pks is not None:
+            # Read from the index a page at a time, rather than sending pks back to the database
+            qs = self._search_shard(qs, words, namespace_id, read_db, expansions, pks, **kwargs)
+            if kwargs.get('highlight'):
+                qs = self._with_highlighter(qs, self._highlighter(query, **kwargs))
+            timer.phase('build')
+            return qs
+        if expansions:
+            qs = self._search_grouped(qs, words, namespace_id, expansions, **kwargs)
+            if kwargs.get('highlight'):
+                qs = self._with_highlighter(qs, self._highlighter(query, **kwargs))
+            timer.phase('build')
+            return qs
+        for idx, word in enumerate(words):
             if self.full_index or self.exact_search:
                 joins_params.append("'%s'" % word.replace("'", "''"))
                 if namespace_id is not None:
                     joins_params.append(namespace_id)
                     namespace_sql = u'AND i%(idx)d.namespace_id = %%%%d' % { 'idx':idx }
                 else:
-                    namespace_sql = u''
+                    namespace_sql = u'AND i%(idx)d.namespace_id IS NULL' % { 'idx':idx }
                 joins.append(u"INNER JOIN %%(words_table_name)s AS w%(idx)d ON (w%(idx)d.word = %%%%s) INNER JOIN %%(index_table_name)s AS i%(idx)d ON (w%(idx)d.id = i%(idx)d.word_id AND i%(idx)d.content_type_id = %%(content_type_id)s AND i%(idx)d.object_id = %%(table_name)s.id %(namespace_sql)s)" % { 'idx':idx, 'namespace_sql': namespace_sql })
             else:
                 joins_params.append("'%s%%%%'" % word.replace("'", "''"))
@@ -219,7 +1366,7 @@ class SearchManager(BaseManager):
                     joins_params.append(namespace_id)
                     namespace_sql = u'AND i%(idx)d.namespace_id = %%%%d' % { 'idx':idx }
                 else:
-                    namespace_sql = u''
+                    namespace_sql = u'AND i%(idx)d.namespace_id IS NULL' % { 'idx':idx }
                 joins.append(u"INNER JOIN %%(words_table_name)s AS w%(idx)d ON (w%(idx)d.word LIKE %%%%s) INNER JOIN %%(index_table_name)s AS i%(idx)d ON (w%(idx)d.id = i%(idx)d.word_id AND i%(idx)d.content_type_id = %%(content_type_id)s AND i%(idx)d.object_id = %%(table_name)s.id %(namespace_sql)s)" % { 'idx':idx, 'namespace_sql': namespace_sql })
                 qs.query.distinct = True
             weights.append("i%(idx)d.weight" % { 'idx':idx })
@@ -248,6 +1395,10 @@ class SearchManager(BaseManager):
             select[rank_field] = '+'.join(weights)
             order = ['-%s' % rank_field]
             qs = qs.extra(select=select, order_by=order)
+
+        if kwargs.get('highlight'):
+            qs = self._with_highlighter(qs, self._highlighter(query, **kwargs))
+        timer.phase('build')
         
         return qs
 
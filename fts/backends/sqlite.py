@@ -0,0 +1,168 @@
+"Sqlite Fts backend"
+import re
+
+from django.db import connection, transaction
+
+from fts.backends.base import BaseClass, BaseModel, BaseManager
+
+qn = connection.ops.quote_name
+
+# bm25() column weights
+WEIGHTS = {
+    'A' : 10.0,
+    'B' : 4.0,
+    'C' : 2.0,
+    'D' : 1.0
+}
+# Words of a plain or prefix query; FTS5 syntax in user input is dropped.
+TERM = re.compile(r'\w+', re.UNICODE)
+
+class SearchClass(BaseClass):
+    def __init__(self, server, params):
+        self.backend = 'sqlite'
+
+class SearchManager(BaseManager):
+    """
+    Keeps an FTS5 external content table, <table>_fts, next to the model's table.
+    The virtual table only stores the index; the text is read from the model's
+    table. Create it, and the triggers that maintain it, with get_create_table().
+    Only local CharField/TextField columns can be indexed.
+    """
+    def __init__(self, **kwargs):
+        super(SearchManager, self).__init__(**kwargs)
+        # Lengths of the prefixes FTS5 keeps an index for, which makes prefix
+        # queries of those lengths as fast as whole word ones.
+        self.prefix = kwargs.get('prefix', (2, 3))
+        # FTS5 only has an english stemmer.
+        self.tokenize = kwargs.get('tokenize')
+        if not self.tokenize:
+            self.tokenize = self.language_code == 'en' and 'porter unicode61 remove_diacritics 1' or 'unicode61 remove_diacritics 1'
+
+    def _fts_table(self):
+        return '%s_fts' % self.model._meta.db_table
+    fts_table = property(_fts_table)
+
+    def _columns(self):
+        """
+        Returns the (column, weight) pairs of the indexed fields, in the order of the FTS5 table.
+        """
+        columns = []
+        for field, weight in sorted(self._fields.items()):
+            if callable(field) or '__' in field:
+                raise ValueError('%r of the %s model can not be indexed by the sqlite backend.' % (field, self.model._meta.object_name))
+            columns.append((self.model._meta.get_field(field).column, weight))
+        return columns
+
+    def _create_statements(self):
+        table = self.model._meta.db_table
+        pk = qn(self.model._meta.pk.column)
+        columns = [c for c, w in self._columns()]
+        cols = ', '.join([qn(c) for c in columns])
+        new_cols = ', '.join(['new.%s' % qn(c) for c in columns])
+        old_cols = ', '.join(['old.%s' % qn(c) for c in columns])
+        options = ["content='%s'" % table, "content_rowid='%s'" % self.model._meta.pk.column, "tokenize='%s'" % self.tokenize]
+        if self.prefix:
+            options.append("prefix='%s'" % ' '.join([str(p) for p in self.prefix]))
+        d = {
+            'fts': qn(self.fts_table),
+            'table': qn(table),
+            'trigger': self.fts_table,
+            'pk': pk,
+            'cols': cols,
+            'new_cols': new_cols,
+            'old_cols': old_cols,
+            'options': ', '.join(options),
+        }
+        return [
+            "CREATE VIRTUAL TABLE %(fts)s USING fts5(%(cols)s, %(options)s);" % d,
+            "CREATE TRIGGER %(trigger)s_ai AFTER INSERT ON %(table)s BEGIN INSERT INTO %(fts)s(rowid, %(cols)s) VALUES (new.%(pk)s, %(new_cols)s); END;" % d,
+            "CREATE TRIGGER %(trigger)s_ad AFTER DELETE ON %(table)s BEGIN INSERT INTO %(fts)s(%(fts)s, rowid, %(cols)s) VALUES ('delete', old.%(pk)s, %(old_cols)s); END;" % d,
+            "CREATE TRIGGER %(trigger)s_au AFTER UPDATE ON %(table)s BEGIN INSERT INTO %(fts)s(%(fts)s, rowid, %(cols)s) VALUES ('delete', old.%(pk)s, %(old_cols)s); INSERT INTO %(fts)s(rowid, %(cols)s) VALUES (new.%(pk)s, %(new_cols)s); END;" % d,
+        ]
+
+    def get_create_table(self):
+        """Get the queries required to create the FTS5 table and the triggers that maintain it
+        """
+        return '\n'.join(self._create_statements())
+
+    def _update_index(self, pk=None):
+        """
+        Rebuilds the whole index from the model's table. With pk it does nothing: the
+        triggers from get_create_table() have already indexed the rows as they were
+        saved, and an external content index can't be rebuilt row by row, as deleting
+        the postings of a row needs the text it was indexed with.
+        """
+        if pk is not None:
+            return
+        cursor = connection.cursor()
+        cursor.execute("INSERT INTO %s(%s) VALUES ('rebuild')" % (qn(self.fts_table), qn(self.fts_table)))
+        transaction.set_dirty()
+
+    def _match(self, query, query_type):
+        """
+        Returns the FTS5 query for query. query_type='plain' matches all the words,
+        'prefix' matches all the words as prefixes, and '' or None passes the query
+        to FTS5 unchanged.
+        """
+        if not query_type:
+            return query
+        suffix = query_type == 'prefix' and '*' or ''
+        return ' '.join(['"%s"%s' % (t, suffix) for t in TERM.findall(query)])
+
+    def _search(self, query, query_type='plain', **kwargs):
+        """
+        Returns a queryset after having applied the full-text search query. If rank_field
+        is specified, it is the name of the field that will be put on each returned instance
+        with the bm25 rank (higher is better), and the results are ordered by it.
+
+        highlight is a list of field names whose snippets are put on each fetched instance
+        as <field>_highlight (see HighlightQuerySet).
+        """
+        rank_field = kwargs.get('rank_field')
+        qs = self.get_query_set()
+
+        match = self._match(query, query_type)
+        if not match:
+            return qs.none()
+
+        fts = qn(self.fts_table)
+        where = ['%s.rowid = %s.%s' % (fts, qn(self.model._meta.db_table), qn(self.model._meta.pk.column)), '%s MATCH %%s' % fts]
+        select = {}
+        order = []
+        if rank_field is not None:
+            select[rank_field] = '-bm25(%s, %s)' % (fts, ', '.join([str(WEIGHTS[w]) for c, w in self._columns()]))
+            order = ['-%s' % rank_field]
+
+        qs = qs.extra(select=select, tables=[self.fts_table], where=where, params=[match], order_by=order)
+        if kwargs.get('highlight'):
+            qs = self._with_highlighter(qs, self._highlighter(match, **kwargs))
+        return qs
+
+    def _highlighter(self, match, highlight, **kwargs):
+        """
+        Returns a function that puts the FTS5 snippet() of every field in highlight on
+        the given instances, as <field>_highlight, with a single query.
+        """
+        columns = [c for c, w in self._columns()]
+        start = kwargs.get('highlight_start', '<b>')
+        stop = kwargs.get('highlight_stop', '</b>')
+        words = min(64, kwargs.get('highlight_words', 35))
+        fts = qn(self.fts_table)
+        snippets = ', '.join(["snippet(%s, %d, %%s, %%s, '', %d)" % (fts, columns.index(self.model._meta.get_field(f).column), words) for f in highlight])
+
+        def highlighter(instances):
+            by_pk = dict((obj.pk, obj) for obj in instances)
+            sql = 'SELECT rowid, %s FROM %s WHERE %s MATCH %%s AND rowid IN (%s)' % (snippets, fts, fts, ', '.join(['%s'] * len(by_pk)))
+            cursor = connection.cursor()
+            cursor.execute(sql, [start, stop] * len(highlight) + [match] + by_pk.keys())
+            for row in cursor.fetchall():
+                obj = by_pk[row[0]]
+                for field, snippet in zip(highlight, row[1:]):
+                    setattr(obj, '%s_highlight' % field, snippet)
+        return highlighter
+
+class SearchableModel(BaseModel):
+    class Meta:
+        abstract = True
+
+    objects = SearchManager()
@@ -1,3 +1,183 @@
+"Xapian Fts backend"
+from __future__ import absolute_import
+
+import os
+
 from fts.backends.base import InvalidFtsBackendError
+from fts.backends.base import BaseClass, BaseModel, BaseManager, PagedQuerySet
+from fts.settings import FTS_XAPIAN_PATH, FTS_XAPIAN_FLUSH_INTERVAL
+
+try:
+    import xapian
+except ImportError:
+    raise InvalidFtsBackendError("Xapian FTS backend requires the xapian python bindings")
+
+LANGUAGES = {
+    '' : 'none',
+    'da' : 'danish',
+    'nl' : 'dutch',
+    'en' : 'english',
+    'fi' : 'finnish',
+    'fr' : 'french',
+    'de' : 'german',
+    'hu' : 'hungarian',
+    'it' : 'italian',
+    'no' : 'norwegian',
+    'pt' : 'portuguese',
+    'ro' : 'romanian',
+    'ru' : 'russian',
+    'es' : 'spanish',
+    'sv' : 'swedish',
+    'tr' : 'turkish',
+}
+# Within-document frequency increment of the words of a field
+WEIGHTS = {
+    'A' : 10,
+    'B' : 4,
+    'C' : 2,
+    'D' : 1
+}
+class SearchClass(BaseClass):
+    def __init__(self, server, params):
+        self.backend = 'xapian'
+
+class SearchManager(BaseManager):
+    """
+    Indexes every model in its own Xapian database, in FTS_XAPIAN_PATH or in the
+    directory given as path. Documents are identified by a Q<pk> term and store
+    the pk as their data.
+    """
+    def __init__(self, **kwargs):
+        super(SearchManager, self).__init__(**kwargs)
+        self.path = kwargs.get('path')
+        # Number of documents written between commits by update_index
+        self.flush_interval = kwargs.get('flush_interval', FTS_XAPIAN_FLUSH_INTERVAL)
+        self.stemmer = xapian.Stem(LANGUAGES[self.language_code])
+        self._database_cache = None
+
+    def _database_path(self):
+        if self.path:
+            return self.path
+        return os.path.join(FTS_XAPIAN_PATH, '%s.%s' % (self.model._meta.app_label, self.model._meta.object_name.lower()))
+
+    def _database(self):
+        """
+        Returns the database used for searching, reopened to see the latest commit, or
+        None if nothing was ever indexed.
+        """
+        if self._database_cache is None:
+            try:
+                self._database_cache = xapian.Database(self._database_path())
+            except xapian.DatabaseOpeningError:
+                return None
+        else:
+            self._database_cache.reopen()
+        return self._database_cache
+
+    def _update_index(self, pk=None):
+        """
+        Indexes one, many, or all instances. Only one process can write to a Xapian
+        database at a time, so the database is only kept open while indexing.
+        Changes are committed every flush_interval documents and at the end; a full
+        update also removes the documents of instances that no longer exist.
+        """
+        if self.model._meta.abstract:
+            return # skip abstract class updates
+        if pk is not None:
+            if isinstance(pk, (set,list,tuple)):
+                items = self.filter(pk__in=pk)
+                pks = set(pk)
+            else:
+                items = self.filter(pk=pk)
+                pks = set([pk])
+        else:
+            items = self.all()
+
+        db = xapian.WritableDatabase(self._database_path(), xapian.DB_CREATE_OR_OPEN)
+        try:
+            indexer = xapian.TermGenerator()
+            indexer.set_stemmer(self.stemmer)
+            indexed = set()
+            pending = 0
+            for item in items:
+                doc = xapian.Document()
+                indexer.set_document(doc)
+                for field, weight in self._fields.items():
+                    if callable(field):
+                        words = field(item)
+                    else:
+                        words = item
+                        for col in field.split('__'):
+                            words = getattr(words, col)
+                    indexer.index_text(unicode(words or u'').encode('utf8'), WEIGHTS[weight])
+                    # Don't match phrases across fields
+                    indexer.increase_termpos()
+                idterm = 'Q%s' % item.pk
+                doc.add_term(idterm, 0)
+                doc.set_data(str(item.pk))
+                db.replace_document(idterm, doc)
+                indexed.add(str(item.pk))
+                pending += 1
+                if self.flush_interval and pending >= self.flush_interval:
+                    db.commit()
+                    pending = 0
+
+            if pk is None:
+                stale = [t.term for t in db.allterms('Q') if t.term[1:] not in indexed]
+            else:
+                stale = ['Q%s' % p for p in pks if str(p) not in indexed]
+            for idterm in stale:
+                db.delete_document(idterm)
+            db.commit()
+        finally:
+            db.close()
+
+    def _search(self, query, query_type='plain', **kwargs):
+        """
+        Returns a queryset of the matches, in rank order, after running the query
+        through Xapian's query parser (all the words must match by default; AND, OR,
+        NOT, phrases and +/- are understood). query_type='prefix' also expands the
+        last word as a prefix, for autocomplete.
+
+        The queryset reads the matches from Xapian a page at a time, as it is sliced
+        or iterated (see PagedQuerySet), and counts them with Xapian. offset skips the
+        first matches, and at most limit are returned if it is given. If rank_field is
+        specified, it is the name of the field that will be put on each returned
+        instance with the match percentage.
+        """
+        rank_field = kwargs.get('rank_field')
+        offset = kwargs.get('offset', 0)
+        qs = self.get_query_set()
+
+        db = self._database()
+        if db is None:
+            return qs.none()
+        parser = xapian.QueryParser()
+        parser.set_stemmer(self.stemmer)
+        parser.set_stemming_strategy(xapian.QueryParser.STEM_SOME)
+        parser.set_database(db)
+        parser.set_default_op(xapian.Query.OP_AND)
+        flags = xapian.QueryParser.FLAG_DEFAULT
+        if query_type == 'prefix':
+            flags |= xapian.QueryParser.FLAG_PARTIAL
+        enquire = xapian.Enquire(db)
+        enquire.set_query(parser.parse_query(unicode(query).encode('utf8'), flags))
+
+        def matches(start, limit):
+            if limit is None:
+                limit = db.get_doccount()
+            return [(int(m.document.get_data()), m.percent) for m in enquire.get_mset(offset + start, limit)]
+
+        def count():
+            # Checking every document makes the estimate exact
+            doccount = db.get_doccount()
+            return max(enquire.get_mset(0, 0, doccount).get_matches_estimated() - offset, 0)
+
+        return qs._clone(klass=PagedQuerySet, _matches=matches, _count=count,
+            _limit=kwargs.get('limit'), _rank_field=rank_field)
+
+class SearchableModel(BaseModel):
+    class Meta:
+        abstract = True
 
-raise InvalidFtsBackendError("Xapian FTS backend not yet implemented")
\ No newline at end of file
+    objects = SearchManager()
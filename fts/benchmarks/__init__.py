@@ -0,0 +1,4 @@
+"""
+Benchmarks of indexing and searching, for the backends that can run on SQLite.
+See fts.benchmarks.run.
+"""
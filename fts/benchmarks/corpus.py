@@ -0,0 +1,88 @@
+"""
+Synthetic, reproducible corpora for the benchmarks. Everything is derived from
+a seed, so the same options always produce the same documents and queries.
+"""
+import bisect
+import random
+
+CONSONANTS = 'bcdfghjklmnprstvz'
+VOWELS = 'aeiou'
+
+def make_vocabulary(size, seed=0):
+    """
+    Returns size distinct pronounceable words, most frequent first.
+    """
+    rnd = random.Random(seed)
+    words = []
+    seen = set()
+    while len(words) < size:
+        word = ''.join(rnd.choice(CONSONANTS) + rnd.choice(VOWELS) for i in range(rnd.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+class Corpus(object):
+    """
+    Documents modeled on fts.tests.models.Blog: a short title and a longer body,
+    with words drawn from the vocabulary following Zipf's law, like natural text.
+    """
+    def __init__(self, documents=1000, vocabulary=5000, words=200, title_words=8, seed=0):
+        self.documents = documents
+        self.words = words
+        self.title_words = title_words
+        self.seed = seed
+        self.vocabulary = make_vocabulary(vocabulary, seed)
+        total = 0.0
+        self._cumulative = []
+        for rank in range(len(self.vocabulary)):
+            total += 1.0 / (rank + 1)
+            self._cumulative.append(total)
+
+    def _word(self, rnd):
+        return self.vocabulary[bisect.bisect(self._cumulative, rnd.random() * self._cumulative[-1])]
+
+    def __iter__(self):
+        """
+        Yields (title, body) pairs.
+        """
+        rnd = random.Random(self.seed)
+        for i in xrange(self.documents):
+            title = ' '.join(self._word(rnd) for j in range(rnd.randint(1, self.title_words)))
+            body = ' '.join(self._word(rnd) for j in range(rnd.randint(self.words / 2, self.words * 3 / 2)))
+            yield title.capitalize(), body.capitalize() + '.'
+
+    def queries(self, count, terms, seed=None):
+        """
+        Returns count queries of terms words each. Words are drawn from the same
+        distribution as the documents, so most multi-word queries still have matches.
+        """
+        rnd = random.Random(self.seed if seed is None else seed)
+        queries = []
+        for i in range(count):
+            queries.append(' '.join(self._word(rnd) for j in range(terms)))
+        return queries
+
+    def prefixes(self, count, length=3, seed=None):
+        """
+        Returns count prefixes of length characters of words of the vocabulary.
+        """
+        rnd = random.Random(self.seed if seed is None else seed)
+        return [self._word(rnd)[:length] for i in range(count)]
+
+    def phrases(self, count, length=2, seed=None):
+        """
+        Returns count runs of length consecutive words taken from the bodies of
+        random documents, so every phrase has at least one match.
+        """
+        rnd = random.Random(self.seed if seed is None else seed)
+        wanted = sorted(rnd.randint(0, self.documents - 1) for i in range(count))
+        phrases = []
+        for i, (title, body) in enumerate(self):
+            while wanted and wanted[0] == i:
+                words = body.rstrip('.').lower().split()
+                start = rnd.randint(0, max(0, len(words) - length))
+                phrases.append(' '.join(words[start:start + length]))
+                wanted.pop(0)
+        rnd.shuffle(phrases)
+        return phrases
@@ -0,0 +1,32 @@
+from django.db import models
+import fts
+
+# The same model as fts.tests.models.Blog for every backend that runs on SQLite.
+
+class SimpleBlog(fts.SimpleSearchableModel):
+    title = models.CharField(max_length=100)
+    body = models.TextField()
+
+    objects = fts.SimpleSearchManager(fields=(('title', 'A'), ('body', 'B')))
+    # Autocomplete style index, see fts.backends.simple.SearchManager
+    substrings = fts.SimpleSearchManager(fields=('title',), full_index=True, stem_words=False, namespace='benchmark-substrings')
+
+class DummyBlog(fts.DummySearchableModel):
+    title = models.CharField(max_length=100)
+    body = models.TextField()
+
+    objects = fts.DummySearchManager(fields=('title', 'body'))
+
+if fts.SqliteSearchableModel is not None:
+    class SqliteBlog(fts.SqliteSearchableModel):
+        title = models.CharField(max_length=100)
+        body = models.TextField()
+
+        objects = fts.SqliteSearchManager(fields=(('title', 'A'), ('body', 'B')))
+
+if fts.XapianSearchableModel is not None:
+    class XapianBlog(fts.XapianSearchableModel):
+        title = models.CharField(max_length=100)
+        body = models.TextField()
+
+        objects = fts.XapianSearchManager(fields=(('title', 'A'), ('body', 'B')))
@@ -0,0 +1,276 @@
+"""
+Benchmarks indexing and searching on a synthetic corpus, for every backend that
+can run on SQLite, and writes the results as JSON so runs on different commits
+can be compared:
+
+    DJANGO_SETTINGS_MODULE=fts.benchmarks.settings python -m fts.benchmarks.run \
+        --documents 5000 --output results.json
+
+The corpus and the queries only depend on the options (and --seed), never on the
+machine or the run.
+"""
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+from optparse import OptionParser
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection, transaction
+
+from fts.benchmarks.corpus import Corpus
+from fts.benchmarks import models
+
+TERM_COUNTS = (1, 2, 3)
+
+def percentiles(timings):
+    """
+    Returns the summary of a list of durations in seconds, in milliseconds.
+    """
+    if not timings:
+        return None
+    timings = sorted(timings)
+    def at(p):
+        return round(timings[min(len(timings) - 1, int(p * len(timings)))] * 1000, 3)
+    return {
+        'count': len(timings),
+        'mean': round(sum(timings) / len(timings) * 1000, 3),
+        'p50': at(0.50),
+        'p90': at(0.90),
+        'p99': at(0.99),
+        'max': round(timings[-1] * 1000, 3),
+    }
+
+def timed(function, *args, **kwargs):
+    """
+    Returns the duration of function(*args, **kwargs) in seconds and its result.
+    """
+    start = time.time()
+    result = function(*args, **kwargs)
+    return time.time() - start, result
+
+def search_latencies(manager, queries, limit, **kwargs):
+    """
+    Returns the durations of fetching the first limit results of each query.
+    """
+    timings = []
+    for query in queries:
+        timings.append(timed(lambda: list(manager.search(query, **kwargs)[:limit]))[0])
+    return timings
+
+def search_many_throughput(manager, queries, limit, **kwargs):
+    """
+    Returns the queries per second of a loop of searches and of search_many().
+    """
+    loop = timed(lambda: [[obj.pk for obj in manager.search(query, **kwargs)[:limit]] for query in queries])[0]
+    batch = timed(manager.search_many, queries, limit, **kwargs)[0]
+    return {
+        'loop': round(len(queries) / max(loop, 1e-6), 1),
+        'search_many': round(len(queries) / max(batch, 1e-6), 1),
+    }
+
+def count_latencies(manager, queries, **kwargs):
+    """
+    Returns the durations of search_count() and of counting the queryset of search().
+    """
+    return {
+        'search_count': percentiles([timed(manager.search_count, query, **kwargs)[0] for query in queries]),
+        'queryset_count': percentiles([timed(lambda: manager.search(query, **kwargs).count())[0] for query in queries]),
+    }
+
+def table_size(pattern):
+    """
+    Returns the bytes used by the tables and indexes whose name matches the LIKE
+    pattern, or None if SQLite wasn't compiled with the dbstat table.
+    """
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT SUM(pgsize) FROM dbstat WHERE name LIKE %s ESCAPE '\\'", [pattern])
+    except Exception:
+        return None
+    return cursor.fetchone()[0]
+
+def directory_size(path):
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            size += os.path.getsize(os.path.join(dirpath, filename))
+    return size
+
+@transaction.commit_on_success
+def load(model, corpus):
+    for title, body in corpus:
+        model.objects.create(title=title, body=body)
+
+@transaction.commit_on_success
+def update_index(manager):
+    manager.update_index()
+
+def benchmark_simple(corpus, options):
+    model = models.SimpleBlog
+    results = {}
+    results['insert'] = timed(load, model, corpus)[0]
+
+    # The dumping update writes its files in the current directory, and deletes the
+    # postings without writing new ones: run it before the live update builds them.
+    cwd = os.getcwd()
+    dump_dir = tempfile.mkdtemp()
+    try:
+        os.chdir(dump_dir)
+        dumping = {}
+        results['update_index_dumping'] = timed(model.objects._update_index, None, dumping)[0]
+        dumping['fw'].close()
+        dumping['fi'].close()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(dump_dir)
+    results['update_index'] = timed(update_index, model.objects)[0]
+
+    results['search'] = {}
+    for terms in TERM_COUNTS:
+        queries = corpus.queries(options.queries, terms, options.seed + terms)
+        results['search']['%d_terms' % terms] = percentiles(search_latencies(model.objects, queries, options.limit, rank_field='rank'))
+
+    phrases = corpus.phrases(options.queries, 2, options.seed)
+    results['phrase'] = {
+        'search': percentiles(search_latencies(model.objects, ['"%s"' % p for p in phrases], options.limit, rank_field='rank')),
+        'near': percentiles(search_latencies(model.objects, [p.replace(' ', ' NEAR/5 ', 1) for p in phrases], options.limit, rank_field='rank')),
+    }
+
+    queries = corpus.queries(options.queries, 2, options.seed)
+    results['search_many'] = search_many_throughput(model.objects, queries, options.limit, rank_field='rank')
+    results['count'] = count_latencies(model.objects, queries)
+
+    results['full_index'] = {'update_index': timed(update_index, model.substrings)[0]}
+    prefixes = corpus.prefixes(options.queries, 3, options.seed)
+    results['full_index']['search'] = percentiles(search_latencies(model.substrings, prefixes, options.limit))
+    results['suggest'] = {
+        'load': timed(model.objects._completions)[0],
+        'suggest': percentiles([timed(model.objects.suggest, prefix, options.limit)[0] for prefix in prefixes]),
+    }
+
+    from fts.models import Word, Index
+    results['size'] = {
+        'words': Word.objects.count(),
+        'postings': Index.objects.count(),
+        'bytes': table_size('fts\\_%'),
+    }
+    return results
+
+def benchmark_dummy(corpus, options):
+    model = models.DummyBlog
+    results = {}
+    results['insert'] = timed(load, model, corpus)[0]
+    results['search'] = {}
+    for terms in TERM_COUNTS:
+        queries = corpus.queries(options.queries, terms, options.seed + terms)
+        results['search']['%d_terms' % terms] = percentiles(search_latencies(model.objects, queries, options.limit))
+    return results
+
+def benchmark_sqlite(corpus, options):
+    model = models.SqliteBlog
+    results = {}
+    cursor = connection.cursor()
+    for statement in model.objects._create_statements():
+        cursor.execute(statement)
+    # The triggers index the rows while they are inserted
+    results['insert'] = timed(load, model, corpus)[0]
+    results['update_index'] = timed(update_index, model.objects)[0]
+    results['search'] = {}
+    for terms in TERM_COUNTS:
+        queries = corpus.queries(options.queries, terms, options.seed + terms)
+        results['search']['%d_terms' % terms] = percentiles(search_latencies(model.objects, queries, options.limit, rank_field='rank'))
+    prefixes = corpus.prefixes(options.queries, 3, options.seed)
+    results['prefix'] = {'search': percentiles(search_latencies(model.objects, prefixes, options.limit, query_type='prefix'))}
+    phrases = corpus.phrases(options.queries, 2, options.seed)
+    results['phrase'] = {'search': percentiles(search_latencies(model.objects, ['"%s"' % p for p in phrases], options.limit, query_type=None))}
+    results['size'] = {
+        'bytes': table_size('%s\\_fts%%' % model._meta.db_table.replace('_', '\\_')),
+    }
+    return results
+
+def benchmark_xapian(corpus, options):
+    model = models.XapianBlog
+    results = {}
+    shutil.rmtree(model.objects._database_path(), True)
+    results['insert'] = timed(load, model, corpus)[0]
+    results['update_index'] = timed(update_index, model.objects)[0]
+    results['search'] = {}
+    for terms in TERM_COUNTS:
+        queries = corpus.queries(options.queries, terms, options.seed + terms)
+        results['search']['%d_terms' % terms] = percentiles(search_latencies(model.objects, queries, options.limit, rank_field='rank'))
+    prefixes = corpus.prefixes(options.queries, 3, options.seed)
+    results['prefix'] = {'search': percentiles(search_latencies(model.objects, prefixes, options.limit, query_type='prefix'))}
+    phrases = corpus.phrases(options.queries, 2, options.seed)
+    results['phrase'] = {'search': percentiles(search_latencies(model.objects, ['"%s"' % p for p in phrases], options.limit))}
+    results['size'] = {'bytes': directory_size(model.objects._database_path())}
+    return results
+
+BENCHMARKS = {
+    'simple': benchmark_simple,
+    'dummy': benchmark_dummy,
+    'sqlite': benchmark_sqlite,
+    'xapian': benchmark_xapian,
+}
+
+def available_backends():
+    backends = ['simple', 'dummy']
+    if hasattr(models, 'SqliteBlog'):
+        backends.append('sqlite')
+    if hasattr(models, 'XapianBlog'):
+        backends.append('xapian')
+    return backends
+
+def git_revision():
+    try:
+        return subprocess.Popen(['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            cwd=os.path.dirname(os.path.abspath(__file__))).communicate()[0].strip() or None
+    except OSError:
+        return None
+
+def main(argv=None):
+    parser = OptionParser(usage='DJANGO_SETTINGS_MODULE=fts.benchmarks.settings python -m fts.benchmarks.run [options]')
+    parser.add_option('--documents', type='int', default=1000, help='number of documents [%default]')
+    parser.add_option('--vocabulary', type='int', default=5000, help='number of distinct words [%default]')
+    parser.add_option('--words', type='int', default=200, help='average number of words of a document [%default]')
+    parser.add_option('--queries', type='int', default=100, help='number of queries of every kind [%default]')
+    parser.add_option('--limit', type='int', default=10, help='number of results fetched per query [%default]')
+    parser.add_option('--seed', type='int', default=0, help='seed of the corpus and the queries [%default]')
+    parser.add_option('--backends', default=','.join(available_backends()), help='comma separated backends to run [%default]')
+    parser.add_option('--output', help='file to write the results to, instead of standard output')
+    options, args = parser.parse_args(argv)
+
+    corpus = Corpus(documents=options.documents, vocabulary=options.vocabulary, words=options.words, seed=options.seed)
+    database = settings.DATABASES['default']['NAME']
+    if os.path.exists(database):
+        os.remove(database)
+    call_command('syncdb', interactive=False, verbosity=0)
+
+    report = {
+        'revision': git_revision(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'options': dict(options.__dict__),
+        'results': {},
+    }
+    for backend in options.backends.split(','):
+        report['results'][backend] = BENCHMARKS[backend](corpus, options)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        f = open(options.output, 'w')
+        try:
+            f.write(output)
+        finally:
+            f.close()
+    else:
+        print output
+
+if __name__ == '__main__':
+    main()
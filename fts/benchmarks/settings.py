@@ -0,0 +1,20 @@
+import os
+import tempfile
+
+from fts.tests.settings import *
+
+# Out of the source tree: a run writes megabytes of postings
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(tempfile.gettempdir(), 'fts_benchmark.db'),
+    },
+}
+FTS_INDEX_SHARDS = {}
+
+INSTALLED_APPS = INSTALLED_APPS + (
+    'fts.benchmarks',
+)
+
+FTS_BACKEND = 'simple://'
+FTS_XAPIAN_PATH = os.path.join(tempfile.gettempdir(), 'fts_benchmark_xapian')
@@ -0,0 +1,213 @@
+"""
+Per-phase timing of searching and indexing.
+
+Instrumentation is off unless FTS_INSTRUMENTATION is set or enable() is called.
+While it is off the hooks in the backends only cost a call to a no-op method.
+While it is on, every search, update_index and fetch of search results sends
+operation_timed once it is over. StatsAggregator adds those up.
+
+    >>> from fts import instrumentation
+    >>> instrumentation.enable()
+    >>> stats = instrumentation.StatsAggregator().connect()
+    >>> list(Blog.objects.search('simple'))
+    >>> print stats.report()
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.dispatch import Signal
+
+from fts.settings import FTS_INSTRUMENTATION
+
+# Sent with the model as sender when an instrumented operation ends:
+#   operation: 'search', 'update_index' or 'fetch' (reading the results of a search)
+#   manager: the search manager
+#   timings: phase name -> seconds
+#   total: seconds
+#   queries: number of SQL queries run
+#   rows: rows read or written
+#   cache_hits, cache_misses: lookups of namespaces and words served by (or missing from) caches
+operation_timed = Signal(providing_args=['operation', 'manager', 'timings', 'total', 'queries', 'rows', 'cache_hits', 'cache_misses'])
+
+_enabled = FTS_INSTRUMENTATION
+_local = threading.local()
+
+def enable():
+    global _enabled
+    _enabled = True
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def is_enabled():
+    return _enabled
+
+class _NullTimer(object):
+    """
+    Stands for a Timer while instrumentation is off.
+    """
+    def phase(self, name):
+        pass
+
+    def hit(self, count=1):
+        pass
+
+    def miss(self, count=1):
+        pass
+
+    def add_rows(self, count=1):
+        pass
+
+    def pause(self):
+        pass
+
+    def resume(self):
+        pass
+
+    def finish(self):
+        pass
+
+NULL_TIMER = _NullTimer()
+
+class Timer(object):
+    """
+    Times the phases of an operation. Every call to phase(name) ends a phase: the time
+    elapsed since the previous call (or the start) is added to that phase, so phases
+    repeated in a loop add up. While paused, eg. while the caller has the rows of a
+    fetch, neither the time nor the queries count, and the debug cursors are as they were.
+    """
+    def __init__(self, operation, manager):
+        self.operation = operation
+        self.manager = manager
+        self.timings = {}
+        self.rows = 0
+        self.queries = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.total = 0.0
+        self._connections = None
+        self.resume()
+
+    def resume(self):
+        if self._connections is not None:
+            return
+        # Record the SQL queries even when DEBUG is off, on every database: the index,
+        # its replicas and the model's table can all be on different ones
+        self._connections = [(c, getattr(c, 'use_debug_cursor', None), len(c.queries)) for c in connections.all()]
+        for c, debug_cursor, count in self._connections:
+            c.use_debug_cursor = True
+        if not hasattr(_local, 'timers'):
+            _local.timers = []
+        _local.timers.append(self)
+        self._resumed = self._last = time.time()
+
+    def pause(self):
+        if self._connections is None:
+            return
+        self.total += time.time() - self._resumed
+        for c, debug_cursor, count in self._connections:
+            self.queries += len(c.queries) - count
+            c.use_debug_cursor = debug_cursor
+            if debug_cursor is False or (debug_cursor is None and not settings.DEBUG):
+                # The queries were only recorded for us, don't let them pile up
+                del c.queries[count:]
+        self._connections = None
+        stack = getattr(_local, 'timers', [])
+        if self in stack:
+            stack.remove(self)
+
+    def phase(self, name):
+        now = time.time()
+        self.timings[name] = self.timings.get(name, 0.0) + now - self._last
+        self._last = now
+
+    def hit(self, count=1):
+        self.cache_hits += count
+
+    def miss(self, count=1):
+        self.cache_misses += count
+
+    def add_rows(self, count=1):
+        self.rows += count
+
+    def finish(self):
+        self.pause()
+        operation_timed.send(sender=self.manager.model, operation=self.operation, manager=self.manager,
+            timings=self.timings, total=self.total, queries=self.queries, rows=self.rows,
+            cache_hits=self.cache_hits, cache_misses=self.cache_misses)
+
+def start(operation, manager):
+    """
+    Returns the Timer of a new operation, which current() returns until it's finished
+    (or paused), or a no-op timer if instrumentation is off.
+    """
+    if not _enabled:
+        return NULL_TIMER
+    return Timer(operation, manager)
+
+def current():
+    """
+    Returns the Timer of the innermost operation in progress in this thread.
+    """
+    timers = getattr(_local, 'timers', None)
+    if not timers:
+        return NULL_TIMER
+    return timers[-1]
+
+class StatsAggregator(object):
+    """
+    Adds up the operation_timed signals, per model and operation.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.stats = {}
+
+    def connect(self):
+        operation_timed.connect(self.receive, weak=False)
+        return self
+
+    def disconnect(self):
+        operation_timed.disconnect(self.receive)
+
+    def receive(self, sender, operation, timings, total, queries, rows, cache_hits, cache_misses, **kwargs):
+        key = '%s.%s %s' % (sender._meta.app_label, sender._meta.object_name, operation)
+        stats = self.stats.setdefault(key, {
+            'count': 0,
+            'total': 0.0,
+            'max': 0.0,
+            'phases': {},
+            'queries': 0,
+            'rows': 0,
+            'cache_hits': 0,
+            'cache_misses': 0,
+        })
+        stats['count'] += 1
+        stats['total'] += total
+        stats['max'] = max(stats['max'], total)
+        for phase, seconds in timings.items():
+            stats['phases'][phase] = stats['phases'].get(phase, 0.0) + seconds
+        stats['queries'] += queries
+        stats['rows'] += rows
+        stats['cache_hits'] += cache_hits
+        stats['cache_misses'] += cache_misses
+
+    def as_dict(self):
+        return self.stats
+
+    def report(self):
+        """
+        Returns the statistics as text, times in milliseconds.
+        """
+        lines = []
+        for key, stats in sorted(self.stats.items()):
+            lines.append('%s: %d calls, %.3f ms total, %.3f ms mean, %.3f ms max, %d queries, %d rows, %d/%d cache hits/misses' % (
+                key, stats['count'], stats['total'] * 1000, stats['total'] * 1000 / stats['count'], stats['max'] * 1000,
+                stats['queries'], stats['rows'], stats['cache_hits'], stats['cache_misses']))
+            for phase, seconds in sorted(stats['phases'].items(), key=lambda p: -p[1]):
+                lines.append('    %-20s %10.3f ms' % (phase, seconds * 1000))
+        return '\n'.join(lines)
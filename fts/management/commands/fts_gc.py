@@ -0,0 +1,200 @@
+"""
+Removes the postings of deleted instances and the words no posting uses anymore
+from the simple backend's tables.
+"""
+from optparse import make_option
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import connections, router, transaction, DatabaseError, DEFAULT_DB_ALIAS
+
+try:
+    from fts.models import Word, Index
+except ImportError:
+    Word = Index = None
+
+def _engine(using):
+    # eg. 'sqlite3' for django.db.backends.sqlite3.base
+    return connections[using].__module__.split('.')[-2]
+
+def table_size(table, using=DEFAULT_DB_ALIAS):
+    """
+    Returns the bytes used by table and its indexes, or None if the database can't tell.
+    """
+    cursor = connections[using].cursor()
+    engine = _engine(using)
+    if engine.startswith('postgresql'):
+        sql, params = 'SELECT pg_total_relation_size(%s)', [table]
+    elif engine == 'mysql':
+        sql, params = 'SELECT data_length + index_length FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s', [table]
+    elif engine == 'sqlite3':
+        # dbstat is only there if SQLite was compiled with it
+        sql, params = "SELECT SUM(pgsize) FROM dbstat WHERE name = %s OR name LIKE %s ESCAPE '\\'", [table, '%s\\_%%' % table.replace('_', '\\_')]
+    else:
+        return None
+    # On PostgreSQL, an error aborts the whole transaction unless rolled back to here
+    sid = transaction.savepoint(using=using)
+    try:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+    except DatabaseError:
+        transaction.savepoint_rollback(sid, using=using)
+        return None
+    transaction.savepoint_commit(sid, using=using)
+    return row and row[0]
+
+def _next_bound(table, last_id, batch_size, using, where='', params=()):
+    """
+    Returns the id of the last of the next batch_size rows of table after last_id,
+    so every batch only looks at a bounded range of rows.
+    """
+    connection = connections[using]
+    cursor = connection.cursor()
+    cursor.execute('SELECT id FROM %s WHERE id > %%s %s ORDER BY id LIMIT %d' % (connection.ops.quote_name(table), where, batch_size), [last_id] + list(params))
+    rows = cursor.fetchall()
+    return rows and rows[-1][0] or None
+
+def _delete(table, ids, using, where=''):
+    connection = connections[using]
+    def delete():
+        cursor = connection.cursor()
+        cursor.execute('DELETE FROM %s WHERE id IN (%s) %s' % (connection.ops.quote_name(table), ', '.join(['%s'] * len(ids)), where), ids)
+        transaction.set_dirty(using=using)
+        return cursor.rowcount
+    return transaction.commit_on_success(using=using)(delete)()
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', action='store', type='int', dest='batch_size', default=1000,
+            help='Number of rows looked at, and deleted, per transaction.'),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+            help='Only count the rows that would be deleted.'),
+        make_option('--database', action='store', dest='database', default=DEFAULT_DB_ALIAS,
+            help='Database holding the index (see FTS_INDEX_ROUTER). Defaults to the "default" database.'),
+        make_option('--vacuum', action='store_true', dest='vacuum', default=False,
+            help='Give the space back to the database once done (PostgreSQL and SQLite).'),
+    )
+    help = "Deletes the full-text index rows of deleted instances and the words no longer indexed."
+
+    def handle_noargs(self, **options):
+        if Index is None:
+            raise CommandError("fts_gc cleans up the simple backend's tables, which only exist with FTS_BACKEND = 'simple://' or FTS_CONFIGURE_ALL_BACKENDS = True")
+        self.batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+        self.verbosity = int(options.get('verbosity', 1))
+        self.db = options['database']
+        self.qn = connections[self.db].ops.quote_name
+
+        index_table = Index._meta.db_table
+        word_table = Word._meta.db_table
+        sizes = {}
+        for table, model in ((index_table, Index), (word_table, Word)):
+            sizes[table] = (table_size(table, self.db), model.objects.using(self.db).count())
+
+        postings = 0
+        for ctype in self._indexed_content_types():
+            count = self.collect_postings(ctype)
+            if count and self.verbosity > 1:
+                self.stdout.write('%s: %d orphaned postings\n' % (ctype, count))
+            postings += count
+        words = self.collect_words()
+
+        for table, count in ((index_table, postings), (word_table, words)):
+            size, rows = sizes[table]
+            line = '%s: %d of %d rows %s' % (table, count, rows, self.dry_run and 'to delete' or 'deleted')
+            if size is not None and rows:
+                line += ', about %d KB' % (size * count / rows / 1024)
+            self.stdout.write(line + '\n')
+
+        if options['vacuum'] and not self.dry_run:
+            self.vacuum([index_table, word_table])
+            for table in (index_table, word_table):
+                size = table_size(table, self.db)
+                if size is not None and sizes[table][0] is not None:
+                    self.stdout.write('%s: %d KB reclaimed\n' % (table, (sizes[table][0] - size) / 1024))
+
+    def _indexed_content_types(self):
+        cursor = connections[self.db].cursor()
+        cursor.execute('SELECT DISTINCT content_type_id FROM %s' % self.qn(Index._meta.db_table))
+        return ContentType.objects.filter(pk__in=[row[0] for row in cursor.fetchall()])
+
+    def collect_postings(self, ctype):
+        """
+        Deletes the postings of ctype whose instance doesn't exist anymore, looking at
+        batch_size postings at a time, and returns their number.
+        """
+        qn = self.qn
+        index_table = Index._meta.db_table
+        model = ctype.model_class()
+        # Instances on another database than the index are looked up by primary key
+        separate = model is not None and router.db_for_read(model) != self.db
+        if model is None or separate:
+            # If the model is gone, all of its postings are
+            join = ''
+            orphan = ''
+        else:
+            join = 'LEFT JOIN %s t ON t.%s = i.object_id' % (qn(model._meta.db_table), qn(model._meta.pk.column))
+            orphan = 'AND t.%s IS NULL' % qn(model._meta.pk.column)
+        sql = 'SELECT i.id, i.object_id FROM %s i %s WHERE i.content_type_id = %%s AND i.id > %%s AND i.id <= %%s %s' % (qn(index_table), join, orphan)
+
+        count = 0
+        last_id = 0
+        cursor = connections[self.db].cursor()
+        while True:
+            bound = _next_bound(index_table, last_id, self.batch_size, self.db, 'AND content_type_id = %s', [ctype.pk])
+            if bound is None:
+                return count
+            cursor.execute(sql, [ctype.pk, last_id, bound])
+            rows = cursor.fetchall()
+            if separate:
+                existing = set(model._default_manager.filter(pk__in=set([r[1] for r in rows])).values_list('pk', flat=True))
+                rows = [r for r in rows if r[1] not in existing]
+            ids = [r[0] for r in rows]
+            if self.dry_run:
+                count += len(ids)
+            elif ids:
+                count += _delete(index_table, ids, self.db)
+            last_id = bound
+
+    def collect_words(self):
+        """
+        Deletes the words that no posting refers to, batch_size words at a time, and
+        returns their number.
+        """
+        qn = self.qn
+        word_table = Word._meta.db_table
+        unused = 'NOT EXISTS (SELECT 1 FROM %s i WHERE i.word_id = %s.id)' % (qn(Index._meta.db_table), qn(word_table))
+        sql = 'SELECT id FROM %s WHERE id > %%s AND id <= %%s AND %s' % (qn(word_table), unused)
+
+        count = 0
+        last_id = 0
+        cursor = connections[self.db].cursor()
+        while True:
+            bound = _next_bound(word_table, last_id, self.batch_size, self.db)
+            if bound is None:
+                return count
+            cursor.execute(sql, [last_id, bound])
+            ids = [row[0] for row in cursor.fetchall()]
+            if self.dry_run:
+                count += len(ids)
+            elif ids:
+                # Checked again while deleting, in case the word got indexed meanwhile
+                count += _delete(word_table, ids, self.db, 'AND ' + unused)
+            last_id = bound
+
+    def vacuum(self, tables):
+        connection = connections[self.db]
+        cursor = connection.cursor()
+        engine = _engine(self.db)
+        if engine.startswith('postgresql'):
+            # VACUUM can't run inside a transaction
+            connection.connection.set_isolation_level(0)
+            try:
+                for table in tables:
+                    cursor.execute('VACUUM ANALYZE %s' % self.qn(table))
+            finally:
+                connection.connection.set_isolation_level(1)
+        elif engine == 'sqlite3':
+            cursor.execute('VACUUM')
+        elif self.verbosity > 0:
+            self.stdout.write('Vacuuming is not supported for %s, skipped.\n' % engine)
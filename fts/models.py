@@ -45,6 +45,9 @@ if FTS_CONFIGURE_ALL_BACKENDS or FTS_BACKEND.startswith('simple://'):
         content_type = models.ForeignKey(ContentType)
         object_id = models.PositiveIntegerField(db_index=True)
         content_object = generic.GenericForeignKey('content_type', 'object_id')
+
+        # Positions of the word in the instance's text, see fts.backends.simple.pack_positions()
+        positions = models.TextField(null=True, blank=True)
         
         def __unicode__(self):
             return u'%s [%s]' % (self.content_object, self.word.word)
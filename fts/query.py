@@ -0,0 +1,153 @@
+"""
+Parser of boolean search queries, such as:
+
+    apple AND (pie OR tart) NOT crumble
+    "apple pie" -crumble tart*
+
+Words next to each other must all match, OR binds less tightly than AND, NOT
+or a leading - excludes what follows, a trailing * matches a word as a prefix,
+quotes make a phrase and parentheses group. Operators are only recognized in
+upper case. parse() never fails: what can't be understood is dropped or taken
+as words, as user input should be.
+"""
+import re
+
+TOKEN = re.compile(r'[-+]?"[^"]*"?|[()]|[^\s()"]+', re.UNICODE)
+OPERATORS = ('AND', 'OR', 'NOT')
+
+class Node(object):
+    def __eq__(self, other):
+        return type(self) is type(other) and self.__dict__ == other.__dict__
+
+    def __ne__(self, other):
+        return not self == other
+
+class Term(Node):
+    def __init__(self, text, prefix=False):
+        self.text = text
+        self.prefix = prefix
+
+    def __repr__(self):
+        return 'Term(%r%s)' % (self.text, self.prefix and ', prefix=True' or '')
+
+class Phrase(Node):
+    def __init__(self, text):
+        self.text = text
+
+    def __repr__(self):
+        return 'Phrase(%r)' % self.text
+
+class Not(Node):
+    def __init__(self, child):
+        self.child = child
+
+    def __repr__(self):
+        return 'Not(%r)' % self.child
+
+class And(Node):
+    def __init__(self, children):
+        self.children = children
+
+    def __repr__(self):
+        return 'And(%r)' % self.children
+
+class Or(Node):
+    def __init__(self, children):
+        self.children = children
+
+    def __repr__(self):
+        return 'Or(%r)' % self.children
+
+def _combine(cls, children):
+    children = [c for c in children if c is not None]
+    if not children:
+        return None
+    if len(children) == 1:
+        return children[0]
+    return cls(children)
+
+class Parser(object):
+    def __init__(self, query):
+        self.tokens = []
+        for token in TOKEN.findall(query):
+            if len(token) > 1 and token[0] == '-':
+                self.tokens.extend(['NOT', token[1:]])
+            elif len(token) > 1 and token[0] == '+':
+                self.tokens.append(token[1:])
+            else:
+                self.tokens.append(token)
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return None
+
+    def parse(self):
+        node = self.parse_or()
+        while self.peek() is not None:
+            # An unbalanced ')'
+            self.pos += 1
+            node = _combine(And, [node, self.parse_or()])
+        return node
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.peek() == 'OR':
+            self.pos += 1
+            children.append(self.parse_and())
+        return _combine(Or, children)
+
+    def parse_and(self):
+        children = []
+        while self.peek() not in (None, ')', 'OR'):
+            if self.peek() == 'AND':
+                self.pos += 1
+                continue
+            children.append(self.parse_unary())
+        return _combine(And, children)
+
+    def parse_unary(self):
+        if self.peek() == 'NOT':
+            self.pos += 1
+            if self.peek() in (None, ')', 'AND', 'OR'):
+                return None
+            child = self.parse_unary()
+            return child is not None and Not(child) or None
+        return self.parse_primary()
+
+    def parse_primary(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        if token == '(':
+            node = self.parse_or()
+            if self.peek() == ')':
+                self.pos += 1
+            return node
+        if token.startswith('"'):
+            text = token.strip('"').strip()
+            return text and Phrase(text) or None
+        if token.endswith('*'):
+            text = token.rstrip('*')
+            return text and Term(text, prefix=True) or None
+        return Term(token)
+
+def parse(query):
+    """
+    Returns the tree of query, made of Term, Phrase, Not, And and Or nodes, or None
+    if it has no words.
+    """
+    return Parser(query).parse()
+
+def positive_terms(node):
+    """
+    Returns the Term and Phrase nodes of the tree that aren't excluded by a Not.
+    """
+    if node is None or isinstance(node, Not):
+        return []
+    if isinstance(node, (And, Or)):
+        terms = []
+        for child in node.children:
+            terms.extend(positive_terms(child))
+        return terms
+    return [node]
@@ -0,0 +1,88 @@
+"""
+Placement of the simple backend's words and postings on database aliases.
+
+Every (model, namespace) pair has its words and postings on a single database,
+which needs the fts tables (syncdb --database=<alias>). Searches only read the
+database of the manager's model and namespace, or one of its replicas: indexes
+are always written to the primary, searches go to the replicas in turn, unless
+reads are pinned to the primary.
+"""
+import itertools
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.importlib import import_module
+
+from fts.settings import FTS_INDEX_ROUTER, FTS_INDEX_SHARDS, FTS_INDEX_REPLICAS
+
+_local = threading.local()
+
+class IndexRouter(object):
+    """
+    Places the index following FTS_INDEX_SHARDS, or the given shards: the alias of
+    'namespace:<slug>', else of '<app_label>.<model>', else of '<app_label>', else
+    the default database.
+    """
+    def __init__(self, shards=None, replicas=None):
+        if shards is None:
+            shards = FTS_INDEX_SHARDS
+        if replicas is None:
+            replicas = FTS_INDEX_REPLICAS
+        self.shards = shards
+        self.replicas = dict((db, itertools.cycle(aliases)) for db, aliases in replicas.items() if aliases)
+
+    def db_for_index(self, model, namespace=None):
+        opts = model._meta
+        keys = ('%s.%s' % (opts.app_label, opts.object_name.lower()), opts.app_label)
+        if namespace:
+            keys = ('namespace:%s' % namespace,) + keys
+        for key in keys:
+            if key in self.shards:
+                return self.shards[key]
+        return DEFAULT_DB_ALIAS
+
+    def db_for_search(self, db):
+        """
+        Returns the alias searches of the database db read: its replicas round-robin, if any.
+        """
+        if db in self.replicas:
+            return self.replicas[db].next()
+        return db
+
+_router = None
+
+def get_router():
+    global _router
+    if _router is None:
+        module, attr = FTS_INDEX_ROUTER.rsplit('.', 1)
+        try:
+            _router = getattr(import_module(module), attr)()
+        except (ImportError, AttributeError), e:
+            raise ImproperlyConfigured('Error loading FTS_INDEX_ROUTER %s: "%s"' % (FTS_INDEX_ROUTER, e))
+    return _router
+
+def db_for_index(model, namespace=None):
+    """
+    Returns the alias of the database holding the index of model's instances in namespace.
+    """
+    return get_router().db_for_index(model, namespace)
+
+def db_for_search(db, primary=False):
+    """
+    Returns the alias a search of the index on the database db reads, which is db
+    itself if primary is true or reads are pinned to the primaries.
+    """
+    if primary or getattr(_local, 'pinned', 0):
+        return db
+    return get_router().db_for_search(db)
+
+def pin_primary():
+    """
+    Makes the searches of this thread read the primaries, eg. to see an index that
+    was just updated, until unpin_primary() is called as many times.
+    """
+    _local.pinned = getattr(_local, 'pinned', 0) + 1
+
+def unpin_primary():
+    _local.pinned = max(0, getattr(_local, 'pinned', 0) - 1)
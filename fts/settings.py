@@ -1,4 +1,33 @@
 from django.conf import settings
 
 FTS_BACKEND = getattr(settings, 'FTS_BACKEND', 'simple://')
-FTS_CONFIGURE_ALL_BACKENDS = getattr(settings, 'FTS_CONFIGURE_ALL_BACKENDS', True)
+# Also create the tables of the simple backend when it isn't FTS_BACKEND, so it
+# can be used next to the configured one. Backends are loaded on first use either way.
+FTS_CONFIGURE_ALL_BACKENDS = getattr(settings, 'FTS_CONFIGURE_ALL_BACKENDS', False)
+
+# Directory holding the Xapian databases, one per model, and the number of
+# documents written between commits while indexing (0 commits only at the end).
+FTS_XAPIAN_PATH = getattr(settings, 'FTS_XAPIAN_PATH', 'fts_xapian')
+FTS_XAPIAN_FLUSH_INTERVAL = getattr(settings, 'FTS_XAPIAN_FLUSH_INTERVAL', 1000)
+
+# Language code -> stopwords file replacing the built-in list, either a path or
+# 'package:path/in/package' for a data file distributed with a Python package.
+FTS_STOPWORDS_FILES = getattr(settings, 'FTS_STOPWORDS_FILES', {})
+
+# Time the phases of searches and index updates, see fts.instrumentation.
+FTS_INSTRUMENTATION = getattr(settings, 'FTS_INSTRUMENTATION', False)
+
+# Class deciding which database alias holds the simple backend's words and
+# postings of a model and namespace (see fts.routers), and the shards the
+# default one uses: {'namespace:<slug>' or '<app_label>.<model>' or '<app_label>': alias}
+FTS_INDEX_ROUTER = getattr(settings, 'FTS_INDEX_ROUTER', 'fts.routers.IndexRouter')
+FTS_INDEX_SHARDS = getattr(settings, 'FTS_INDEX_SHARDS', {})
+
+# Primary alias -> aliases of its read replicas, which searches read in turn.
+# Indexes are always written to the primary.
+FTS_INDEX_REPLICAS = getattr(settings, 'FTS_INDEX_REPLICAS', {})
+
+# Largest edit distance of fuzzy searches (fuzzy=True searches with it), and the
+# seconds between two checks for new words of their in-memory index of the words.
+FTS_FUZZY_MAX_DISTANCE = getattr(settings, 'FTS_FUZZY_MAX_DISTANCE', 2)
+FTS_FUZZY_REFRESH = getattr(settings, 'FTS_FUZZY_REFRESH', 60)
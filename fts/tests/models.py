@@ -1,3 +1,6 @@
+import os
+import tempfile
+
 from django.db import models
 import fts
 
@@ -21,3 +24,62 @@ class Blog(fts.SearchableModel):
 
     def __unicode__(self):
         return u"%s" % (self.title)
+
+class SqliteBlog(fts.SqliteSearchableModel):
+    title = models.CharField(max_length=100)
+    body = models.TextField()
+
+    objects = fts.SqliteSearchManager(fields=(('title', 'A'), ('body', 'B')))
+
+# Indexed in the made up language 'xx', whose stopwords are read from stopwords.txt
+# (see FTS_STOPWORDS_FILES in the test settings).
+class StopwordsBlog(fts.SimpleSearchableModel):
+    title = models.CharField(max_length=100)
+    body = models.TextField()
+
+    objects = fts.SimpleSearchManager(fields=('title', 'body'), language_code='xx', stem_words=False)
+
+# Its index is on the 'shard' database (see FTS_INDEX_SHARDS in the test settings).
+class ShardBlog(fts.SimpleSearchableModel):
+    title = models.CharField(max_length=100)
+    body = models.TextField()
+
+    objects = fts.SimpleSearchManager(fields=(('title', 'A'), ('body', 'B')))
+
+# The SQL of the pgsql backend can be checked without PostgreSQL, as long as it isn't run.
+class PgsqlBlog(fts.PgsqlSearchableModel):
+    title = models.CharField(max_length=100)
+    body = models.TextField()
+
+    objects = fts.PgsqlSearchManager(fields=(('title', 'A'), ('body', 'B')))
+
+class PgsqlArticle(fts.PgsqlSearchableModel):
+    language = models.CharField(max_length=2, blank=True)
+    body = models.TextField()
+
+    objects = fts.PgsqlSearchManager(fields=('body',), language_field='language')
+
+class PgsqlCountry(models.Model):
+    name = models.CharField(max_length=100)
+
+class PgsqlAuthor(models.Model):
+    name = models.CharField(max_length=100)
+    country = models.ForeignKey(PgsqlCountry)
+
+# Indexes the text of related rows, kept up to date by triggers on their tables.
+class PgsqlPost(fts.PgsqlSearchableModel):
+    author = models.ForeignKey(PgsqlAuthor)
+    body = models.TextField()
+
+    objects = fts.PgsqlSearchManager(fields=(('body', 'A'), ('author__name', 'B'), ('author__country__name', 'C')))
+
+# Only defined, and tested, where the Xapian python bindings are installed.
+if fts.XapianSearchManager is not None:
+    class XapianBlog(fts.XapianSearchableModel):
+        title = models.CharField(max_length=100)
+        body = models.TextField()
+
+        objects = fts.XapianSearchManager(fields=(('title', 'A'), ('body', 'B')),
+            path=os.path.join(tempfile.gettempdir(), 'fts_test_xapian_blog'))
+else:
+    XapianBlog = None
@@ -3,8 +3,23 @@ DIRNAME = os.path.dirname(__file__)
 
 DEFAULT_CHARSET = 'utf-8'
 
-DATABASE_ENGINE = 'sqlite3'
-DATABASE_NAME = os.path.join(DIRNAME, 'fts_test.db')
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(DIRNAME, 'fts_test.db'),
+    },
+    # Holds the index of ShardBlog, see fts.routers
+    'shard': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(DIRNAME, 'fts_test_shard.db'),
+    },
+    # Plays a read replica that hasn't caught up with anything: it has the tables,
+    # but no rows
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(DIRNAME, 'fts_test_replica.db'),
+    },
+}
 
 #DATABASE_ENGINE = 'mysql'
 #DATABASE_NAME = 'fts_test'
@@ -20,6 +35,14 @@ DATABASE_NAME = os.path.join(DIRNAME, 'fts_test.db')
 #DATABASE_HOST = 'localhost'
 #DATABASE_PORT = '5432'
 
+FTS_STOPWORDS_FILES = {
+    'xx': 'fts.tests:stopwords.txt',
+}
+
+FTS_INDEX_SHARDS = {
+    'tests.shardblog': 'shard',
+}
+
 INSTALLED_APPS = (
     'django.contrib.contenttypes',
     'fts',
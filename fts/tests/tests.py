@@ -1,3 +1,827 @@
 # -*- coding: utf-8 -*-
 r"""
+Indexing and searching a model without a namespace (the default):
+
+>>> from fts.tests.models import Blog
+>>> first = Blog.objects.create(title=u'Simple test', body=u'A full text search for simple tests.')
+>>> second = Blog.objects.create(title=u'Another entry', body=u'Nothing to see here.')
+>>> Blog.objects.update_index()
+>>> [b.title for b in Blog.objects.search('simple')]
+[u'Simple test']
+
+Updating the index of one instance only replaces its own postings:
+
+>>> second.body = u'A simple entry after all.'
+>>> second.save()
+>>> Blog.objects.update_index(second.pk)
+>>> sorted([b.title for b in Blog.objects.search('simple')])
+[u'Another entry', u'Simple test']
+>>> Blog.objects.update_index([first.pk, second.pk])
+>>> sorted([b.title for b in Blog.objects.search('simple')])
+[u'Another entry', u'Simple test']
+
+The text of pgsql searches is a parameter of the query, prefixes and quotes included:
+
+>>> from fts.tests.models import PgsqlBlog, PgsqlArticle
+>>> def compiled_sql(qs):
+...     return qs.query.get_compiler(qs.db).as_sql()
+>>> sql, params = compiled_sql(PgsqlBlog.objects.search('new yo', query_type='prefix', rank_field='rank'))
+>>> "to_tsquery('english', %s)" in sql, "'new'" in sql
+(True, False)
+>>> [p for p in params if p == "'new':* & 'yo':*"]
+["'new':* & 'yo':*", "'new':* & 'yo':*"]
+>>> sql, params = compiled_sql(PgsqlBlog.objects.search("o'reilly"))
+>>> "reilly" in sql, list(params)
+(False, ["o'reilly"])
+
+The rows without a known language are indexed, and searched, with the manager's:
+
+>>> sql, params = compiled_sql(PgsqlArticle.objects.search('book'))
+>>> "\"language\" = 'en' OR" in sql, "\"language\" IS NULL OR" in sql, "NOT IN ('da', " in sql
+(True, True, True)
+>>> sql, params = compiled_sql(PgsqlArticle.objects.search('kirja', language='fi'))
+>>> "\"language\" = 'fi'" in sql, "NOT IN" in sql
+(True, False)
+>>> [line.split()[2] for line in PgsqlArticle.objects.get_create_index().splitlines() if 'NOT IN' in line]
+['"tests_pgsqlarticle_search_index_en"']
+
+An unknown language is an error, except as the manager's default, which falls back
+to the configuration without stemming:
+
+>>> PgsqlArticle.objects.search('kirja', language='xx')
+Traceback (most recent call last):
+    ...
+ValueError: Unknown language 'xx', expected one of: da, de, en, es, fi, fr, hu, it, nl, no, pt, ro, ru, sv, tr
+>>> PgsqlBlog.objects.search('kirja', language='xx', query_type='prefix')
+Traceback (most recent call last):
+    ...
+ValueError: Unknown language 'xx', expected one of: da, de, en, es, fi, fr, hu, it, nl, no, pt, ro, ru, sv, tr
+>>> from fts.backends import pgsql
+>>> unknown = pgsql.SearchManager(fields=('body',), language_code='ja')
+>>> unknown.language_code, unknown.language
+('', 'simple')
+
+Values that aren't field names, eg. returned by callables, are parameters, and
+None is indexed as an empty text:
+
+>>> PgsqlBlog.objects._column_sql(None), PgsqlBlog.objects._relation_path(5), PgsqlBlog.objects._column_sql('title')
+(None, None, '"tests_pgsqlblog"."title"')
+>>> PgsqlBlog.objects._set_vectors_sql([(None, 'A'), (5, 'B'), ('title', 'C')])
+('"search_index" = setweight(to_tsvector(\'english\', %s), \'A\') || setweight(to_tsvector(\'english\', %s), \'B\') || setweight(to_tsvector(\'english\', coalesce("tests_pgsqlblog"."title",\'\')), \'C\')', [u'', u'5'])
+
+'fk__field' fields are read with correlated subqueries, and every table they go
+through gets a trigger rebuilding the vectors of the rows referencing a changed row:
+
+>>> from fts.tests.models import PgsqlPost
+>>> PgsqlPost.objects._column_sql('author__country__name')
+'(SELECT r1."name" FROM "tests_pgsqlauthor" r0 INNER JOIN "tests_pgsqlcountry" r1 ON r1."id" = r0."country_id" WHERE r0."id" = "tests_pgsqlpost"."author_id")'
+>>> author, country = PgsqlPost.objects._get_create_relation_triggers()
+>>> for q in (author, country):
+...     print q.split(' WHERE "tests_pgsqlpost".')[-1].split(';')[0]
+...     for line in q.splitlines():
+...         if line.strip().startswith(('CREATE TRIGGER', 'WHEN')):
+...             print line.strip()
+"author_id" = NEW."id"
+CREATE TRIGGER tests_pgsqlpost_author_tsvector_trigger AFTER UPDATE OF "country_id", "name" ON "tests_pgsqlauthor" FOR EACH ROW
+WHEN (OLD."country_id" IS DISTINCT FROM NEW."country_id" OR OLD."name" IS DISTINCT FROM NEW."name") EXECUTE PROCEDURE tests_pgsqlpost_author_tsvector_function();
+"author_id" IN (SELECT r0."id" FROM "tests_pgsqlauthor" r0 WHERE r0."country_id" = NEW."id")
+CREATE TRIGGER tests_pgsqlpost_author_country_tsvector_trigger AFTER UPDATE OF "name" ON "tests_pgsqlcountry" FOR EACH ROW
+WHEN (OLD."name" IS DISTINCT FROM NEW."name") EXECUTE PROCEDURE tests_pgsqlpost_author_country_tsvector_function();
+>>> 'SET %s WHERE' % PgsqlPost.objects._set_vectors_sql(PgsqlPost.objects._fields.items(), '"tests_pgsqlpost"')[0] in author
+True
+
+Fuzzy searches also find the words a few edits away, ranked below exact matches,
+and every instance once:
+
+>>> from django.core.cache import cache
+>>> from fts.backends import simple
+>>> simple._FUZZY_INDEXES.clear()
+>>> third = Blog.objects.create(title=u'Misspelled', body=u'Full text serach.')
+>>> Blog.objects.update_index(third.pk)
+>>> [b.title for b in Blog.objects.search('serach')]
+[u'Misspelled']
+>>> [(b.title, b.rank) for b in Blog.objects.search('search', fuzzy=True, rank_field='rank')]
+[(u'Simple test', 10), (u'Misspelled', 5.0)]
+>>> Blog.objects.search('search', fuzzy=True, rank_field='rank').count(), Blog.objects.search_count('search', fuzzy=True)
+(2, 2)
+>>> [b.title for b in Blog.objects.search('search')]
+[u'Simple test']
+
+Cached counts aren't shared by fuzzy and exact searches:
+
+>>> int(Blog.objects.search_count('search', cache_timeout=60)), int(Blog.objects.search_count('search', cache_timeout=60, fuzzy=True))
+(1, 2)
+
+Phrases match the words next to each other only, however many instances have them all:
+
+>>> for i in range(1000):
+...     _ = Blog.objects.create(title=u'City %d' % i, body=u'New pizza in York.')
+>>> york = Blog.objects.create(title=u'Pizza', body=u'New York pizza.')
+>>> Blog.objects.update_index()
+>>> [b.title for b in Blog.objects.search('"new york" pizza')]
+[u'Pizza']
+>>> Blog.objects.search('pizza NEAR/3 york').count(), Blog.objects.search_count('pizza NEAR/3 york')
+(1001, 1001)
+>>> len(compiled_sql(Blog.objects.search('pizza NEAR/3 york'))[1]) < 999
+True
+
+The matches of phrases aren't sent back to the database: the matches of the words
+are read from the index, checked in Python, and only a page of them is fetched at
+a time, boolean queries included:
+
+>>> from django.db import connection
+>>> from fts.backends import base
+>>> old_page_size = base.SEARCH_PAGE_SIZE
+>>> base.SEARCH_PAGE_SIZE = 50
+>>> connection.use_debug_cursor = True
+>>> old_queries = len(connection.queries)
+>>> len(list(Blog.objects.search('pizza NEAR/3 york', rank_field='rank'))), Blog.objects.search_count('pizza NEAR/3 york'), len(Blog.objects.search_ids('pizza NEAR/3 york', limit=10, offset=995))
+(1001, 1001, 6)
+>>> [b.title for b in Blog.objects.search('"new york" pizza', rank_field='rank')[:5]]
+[u'Pizza']
+>>> sorted([b.title for b in Blog.objects.search(u'"new york" OR simple', query_type='boolean')])
+[u'Another entry', u'Pizza', u'Simple test']
+>>> results = Blog.objects.search(u'pizza -"new york"', query_type='boolean', rank_field='rank')
+>>> results.count(), len(list(results)), Blog.objects.search_count(u'pizza -"new york"', query_type='boolean')
+(1000, 1000, 1000)
+>>> Blog.objects.search(u'NOT "new pizza"', query_type='boolean').count() == Blog.objects.count() - 1000
+True
+>>> [b.title for b in Blog.objects.search(u'pizza -"new york"', query_type='boolean').filter(title=u'City 7')]
+[u'City 7']
+>>> Blog.objects.search_ids(u'"york pizza" OR (simple -"simple tests")', query_type='boolean', with_rank=False) == [york.pk, second.pk]
+True
+>>> max([len(q['sql']) for q in connection.queries[old_queries:]]) < 4000
+True
+>>> connection.use_debug_cursor = None
+>>> base.SEARCH_PAGE_SIZE = old_page_size
+
+Further constraints are only checked on the matches so far, a batch of them at a time:
+
+>>> simple.POSITIONS_BATCH_SIZE = 7
+>>> Blog.objects.search_count(u'"new pizza" pizza NEAR/2 york'), Blog.objects.search_count(u'"new york" pizza NEAR/2 york')
+(1000, 1)
+>>> simple.POSITIONS_BATCH_SIZE = 500
+
+search_many() splits its statements by the number of words too:
+
+>>> queries = [u'pizza new york nowhere%d' % i for i in range(300)] + [u'new york pizza', u'new pizza', u'simple']
+>>> results = Blog.objects.search_many(queries, limit=2000)
+>>> len(results[u'pizza new york nowhere7']), len(results[u'new york pizza']), len(results[u'new pizza']), len(results[u'simple'])
+(0, 1001, 1001, 2)
+>>> simple.SEARCH_MANY_BATCH_PARAMS = 5
+>>> Blog.objects.search_many(queries, limit=2000) == results
+True
+>>> simple.SEARCH_MANY_BATCH_PARAMS = 900
+>>> Blog.objects.filter(title__startswith=u'City').delete()
+>>> Blog.objects.update_index()
+
+The facets leave out the copy of the index of a rebuild in progress:
+
+>>> from django.contrib.contenttypes.models import ContentType
+>>> from fts.models import Index
+>>> shadow_id = Blog.objects._clear_shadow()
+>>> Blog.objects._update_index(first.pk, shadow=shadow_id)
+>>> facets = Blog.objects.search_facets('simple')
+>>> facets['namespace'], facets['content_type'][ContentType.objects.get_for_model(Blog)]
+({None: 2}, 2)
+>>> Blog.objects._drop_shadow(shadow_id)
+
+Instrumentation counts the queries of every database:
+
+>>> from django.db import connections
+>>> from fts import instrumentation
+>>> instrumentation.enable()
+>>> stats = instrumentation.StatsAggregator().connect()
+>>> [b.title for b in Blog.objects.search('simple test')]
+[u'Simple test']
+>>> instrumentation.disable()
+>>> stats.disconnect()
+>>> stats.as_dict()['tests.Blog search']['queries'] > 0, stats.as_dict()['tests.Blog fetch']['queries']
+(True, 1)
+>>> set([getattr(c, 'use_debug_cursor', None) for c in connections.all()])
+set([None])
+
+With DEBUG on, the queries stay in the log of Django:
+
+>>> from django.conf import settings
+>>> from django.db import connection
+>>> settings.DEBUG = True
+>>> instrumentation.enable()
+>>> before = len(connection.queries)
+>>> [b.title for b in Blog.objects.search('simple test')]
+[u'Simple test']
+>>> len(connection.queries) > before
+True
+
+and reading only part of the results leaves the debug cursors as they were:
+
+>>> settings.DEBUG = False
+>>> connection.queries = []
+>>> rows = Blog.objects.search('simple').iterator()
+>>> rows.next().title
+u'Simple test'
+>>> getattr(connection, 'use_debug_cursor', None), len(connection.queries), instrumentation.current() is instrumentation.NULL_TIMER
+(None, 0, True)
+>>> del rows
+>>> instrumentation.disable()
+
+Boolean queries are parsed into a tree, whatever the input:
+
+>>> from fts.query import parse, positive_terms
+>>> parse(u'apple AND (pie OR tart) NOT crumble')
+And([Term(u'apple'), Or([Term(u'pie'), Term(u'tart')]), Not(Term(u'crumble'))])
+>>> parse(u'"apple pie" -crumble tart*')
+And([Phrase(u'apple pie'), Not(Term(u'crumble')), Term(u'tart', prefix=True)])
+>>> parse(u'apple -"pie crust" +tart')
+And([Term(u'apple'), Not(Phrase(u'pie crust')), Term(u'tart')])
+>>> parse(u'a OR b c')
+Or([Term(u'a'), And([Term(u'b'), Term(u'c')])])
+>>> parse(u'apple or pie')
+And([Term(u'apple'), Term(u'or'), Term(u'pie')])
+>>> parse(u'(apple pie')
+And([Term(u'apple'), Term(u'pie')])
+>>> parse(u'apple) pie')
+And([Term(u'apple'), Term(u'pie')])
+>>> parse(u'NOT'), parse(u'"'), parse(u'*'), parse(u'')
+(None, None, None, None)
+>>> parse(u'apple NOT')
+Term(u'apple')
+>>> positive_terms(parse(u'apple OR (pie -crumble)'))
+[Term(u'apple'), Term(u'pie')]
+
+and searched from the index:
+
+>>> [b.title for b in Blog.objects.search(u'simple NOT entry', query_type='boolean')]
+[u'Simple test']
+>>> sorted([b.title for b in Blog.objects.search(u'pizza OR misspelled', query_type='boolean')])
+[u'Misspelled', u'Pizza']
+>>> sorted([b.title for b in Blog.objects.search(u'simpl* -test', query_type='boolean')])
+[u'Another entry']
+>>> [b.title for b in Blog.objects.search(u'"york pizza" -"new pizza"', query_type='boolean')]
+[u'Pizza']
+>>> sorted([b.title for b in Blog.objects.search(u'NOT simple', query_type='boolean')])
+[u'Misspelled', u'Pizza']
+>>> Blog.objects.search(u'', query_type='boolean').count(), Blog.objects.search(u'NOT', query_type='boolean').count()
+(0, 0)
+>>> sorted([b.title for b in Blog.objects.search(u'(pizza OR simple) -entry', query_type='boolean')])
+[u'Pizza', u'Simple test']
+>>> [b.title for b in Blog.objects.search(u'simple (nowhere OR "text search")', query_type='boolean')]
+[u'Simple test']
+>>> [b.title for b in Blog.objects.search(u'NOT (pizza OR simple)', query_type='boolean')]
+[u'Misspelled']
+
+The matches are read from the postings of the words, not from the model's table,
+unless the query can match instances without any of them:
+
+>>> def plan(qs):
+...     sql, params = compiled_sql(qs)
+...     cursor = connection.cursor()
+...     _ = cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+...     return [row[-1] for row in cursor.fetchall()]
+>>> for query in (u'pizza', u'pizza OR simple', u'(pizza OR simple) -entry', u'simple (text OR nowhere) -entry', u'NOT pizza'):
+...     [d for d in plan(Blog.objects.search(query, query_type='boolean', rank_field='rank')) if d.startswith('SCAN') and 'tests_blog' in d] != []
+False
+False
+False
+False
+True
+
+The fuzzy lookups find the words of the vocabulary within an edit distance,
+counting transpositions as one edit:
+
+>>> from fts.words.fuzzy import deletes, edit_distance, SymmetricDeleteIndex
+>>> sorted(deletes(u'abc', 1))
+[u'ab', u'abc', u'ac', u'bc']
+>>> sorted(deletes(u'ab', 2))
+[u'', u'a', u'ab', u'b']
+>>> edit_distance(u'search', u'serach'), edit_distance(u'search', u'searches'), edit_distance(u'kitten', u'sitting')
+(1, 2, 3)
+>>> edit_distance(u'kitten', u'sitting', 1), edit_distance(u'a', u'abcd', 2), edit_distance(u'', u'ab')
+(2, 3, 2)
+>>> index = SymmetricDeleteIndex(max_distance=2, prefix_length=4)
+>>> for word in [u'search', u'searches', u'serach', u'research', u'pizza']:
+...     index.add(word)
+>>> index.add(u'search')
+>>> len(index)
+5
+>>> index.lookup(u'search')
+[(u'search', 0), (u'serach', 1), (u'research', 2), (u'searches', 2)]
+>>> index.lookup(u'search', 1)
+[(u'search', 0), (u'serach', 1)]
+>>> index.lookup(u'search', 5) == index.lookup(u'search')
+True
+>>> index.lookup(u'zebra')
+[]
+
+Completions are the most frequent words starting with a prefix:
+
+>>> from fts.words.suggest import Completions
+>>> completions = Completions([(u'tart', 3), (u'tea', 5), (u'text', 12), (u'test', 3), (u'apple', 1)])
+>>> len(completions)
+5
+>>> completions.complete(u'te')
+[(u'text', 12), (u'tea', 5), (u'test', 3)]
+>>> completions.complete(u't', limit=2)
+[(u'text', 12), (u'tea', 5)]
+>>> completions.complete(u'tex'), completions.complete(u'z'), completions.complete(u'')[-1]
+([(u'text', 12)], [], (u'apple', 1))
+
+suggest() completes the last word typed with the indexed words of the model:
+
+>>> Blog.objects.suggest(u'full te')
+[(u'text', 2), (u'test', 1)]
+>>> Blog.objects.suggest(u'Sim'), Blog.objects.suggest(u'simple '), Blog.objects.suggest(u'zz')
+([(u'simpl', 2)], [], [])
+
+The words are loaded again once the index was updated and they're SUGGEST_REFRESH seconds old:
+
+>>> fourth = Blog.objects.create(title=u'Texture', body=u'Rough texture.')
+>>> Blog.objects.update_index(fourth.pk)
+>>> Blog.objects.suggest(u'tex')
+[(u'text', 2)]
+>>> simple.SUGGEST_REFRESH = 0
+>>> Blog.objects.suggest(u'tex')
+[(u'text', 2), (u'textur', 1)]
+>>> simple.SUGGEST_REFRESH = 60
+>>> pk = fourth.pk
+>>> fourth.delete()
+>>> Blog.objects.update_index(pk)
+
+The positions of a word in an instance are stored as base 36 differences:
+
+>>> from fts.backends.simple import pack_positions, unpack_positions, _phrase_match, _near_match
+>>> pack_positions([40, 3, 5]), pack_positions([0, 36, 1332]), pack_positions([])
+('3,2,z', '0,10,100', '')
+>>> unpack_positions('3,2,z'), unpack_positions(''), unpack_positions(None)
+([3, 5, 40], [], [])
+>>> unpack_positions(pack_positions(range(0, 5000, 7))) == range(0, 5000, 7)
+True
+>>> _phrase_match([(0, [1, 8]), (1, [5, 9]), (3, [11])]), _phrase_match([(0, [1]), (1, [3])])
+(True, False)
+>>> _near_match([1, 20], [5, 30], 4), _near_match([1, 20], [6, 30], 4)
+(True, False)
+
+Stop words count as positions, and phrases don't run across fields:
+
+>>> fifth = Blog.objects.create(title=u'Pasta with cheese', body=u'Cheese pasta.')
+>>> Blog.objects.update_index(fifth.pk)
+>>> [b.title for b in Blog.objects.search(u'"pasta with cheese"')], [b.title for b in Blog.objects.search(u'"pasta cheese"')]
+([u'Pasta with cheese'], [])
+>>> [b.title for b in Blog.objects.search(u'"cheese cheese"')], [b.title for b in Blog.objects.search(u'pasta NEAR/1 cheese')]
+([], [u'Pasta with cheese'])
+>>> pk = fifth.pk
+>>> fifth.delete()
+>>> Blog.objects.update_index(pk)
+
+search_ids() reads the matches from the index alone, best first and then by primary key:
+
+>>> Blog.objects.search_ids(u'simple') == [(first.pk, 10), (second.pk, 10)]
+True
+>>> Blog.objects.search_ids(u'simple', with_rank=False, limit=1, offset=1) == [second.pk]
+True
+>>> Blog.objects.search_ids(u'simple', after=(10, first.pk)) == [(second.pk, 10)]
+True
+>>> Blog.objects.search_ids(u'simple', fuzzy=True, with_rank=False) == Blog.objects.search_ids(u'simple', with_rank=False)
+True
+>>> Blog.objects.search_ids(u'nowhere'), Blog.objects.search_ids(u'simple', after=(10, second.pk))
+([], [])
+
+iter_search() reads the matches chunk by chunk, after the last one:
+
+>>> [(b.title, b.rank) for b in Blog.objects.iter_search(u'simple', chunk_size=1, rank_field='rank')]
+[(u'Simple test', 10), (u'Another entry', 10)]
+>>> [b.title for b in Blog.objects.iter_search(u'text', chunk_size=2)]
+[u'Simple test', u'Misspelled']
+>>> list(Blog.objects.iter_search(u'nowhere'))
+[]
+
+search_models() searches several models at once, and loads the instances found:
+
+>>> import fts
+>>> blog_type = ContentType.objects.get_for_model(Blog)
+>>> [(hit[0] == blog_type, hit.object.title, hit[2]) for hit in fts.search_models(u'simple', models=[Blog])]
+[(True, u'Simple test', 10), (True, u'Another entry', 10)]
+>>> [hit.object.title for hit in fts.search_models(u'text', models=[Blog.objects], limit=1)]
+[u'Simple test']
+>>> fts.search_models(u'nowhere', models=[Blog])
+[]
+
+Every word is looked for on its own: a word can match the prefix of several, and
+several words only count once, with their best weight, as in search(). Managers of
+the same model and namespace don't find an instance twice:
+
+>>> prefixes = simple.SearchManager(exact_search=False)
+>>> prefixes.model = Blog
+>>> def titles_and_ranks(results):
+...     return sorted([(getattr(r, 'object', r).title, r[2] if isinstance(r, tuple) else r.rank) for r in results])
+>>> titles_and_ranks(fts.search_models(u'tex text', models=[prefixes]))
+[(u'Misspelled', 20), (u'Simple test', 20)]
+>>> titles_and_ranks(fts.search_models(u'se', models=[prefixes]))
+[(u'Misspelled', 10), (u'Simple test', 10)]
+>>> for query in (u'tex text', u'se', u'full se', u'simple nothing'):
+...     titles_and_ranks(fts.search_models(query, models=[prefixes])) == titles_and_ranks(prefixes.search(query, rank_field='rank'))
+True
+True
+True
+True
+>>> titles_and_ranks(fts.search_models(u'full tex', models=[Blog.objects, prefixes]))
+[(u'Misspelled', 20), (u'Simple test', 20)]
+
+rebuild_index() replaces the postings in one go, and leaves no copy of the index behind:
+
+>>> Blog.objects.rebuild_index()
+>>> [b.title for b in Blog.objects.search(u'simple')], Blog.objects.search_count(u'text')
+([u'Simple test', u'Another entry'], 2)
+>>> Index.objects.filter(namespace__slug__contains=u'~rebuild-').count()
+0
+
+While a rebuild runs, its shadow namespace exists in the database: that, and not
+the cache, tells updates to index into it too. A rebuild that fails drops it:
+
+>>> from django.core.cache import cache
+>>> from fts.models import Namespace
+>>> shadow_id = Blog.objects._clear_shadow()
+>>> cache.clear()
+>>> Blog.objects._rebuilding() == shadow_id
+True
+>>> Blog.objects.update_index(first.pk)
+>>> Index.objects.filter(namespace=shadow_id, object_id=first.pk).count() > 0
+True
+>>> Blog.objects._drop_shadow(shadow_id)
+>>> Blog.objects._rebuilding(), Namespace.objects.filter(slug__contains=u'~rebuild-').count()
+(None, 0)
+>>> def failing(pk, dumping=None, shadow=None):
+...     raise ValueError('indexing failed')
+>>> Blog.objects._update_index = failing
+>>> Blog.objects.rebuild_index()
+Traceback (most recent call last):
+    ...
+ValueError: indexing failed
+>>> del Blog.objects._update_index
+>>> Blog.objects._rebuilding(), Namespace.objects.filter(slug__contains=u'~rebuild-').count()
+(None, 0)
+>>> sorted([b.title for b in Blog.objects.search(u'simple')])
+[u'Another entry', u'Simple test']
+
+Shadow namespaces fit in the slug column, however long the namespace:
+
+>>> long_first = simple.SearchManager(namespace=u'n' * 45 + u'-first')
+>>> long_second = simple.SearchManager(namespace=u'n' * 45 + u'-second')
+>>> long_first.model = long_second.model = Blog
+>>> [len(m._shadow_namespace()) <= 50 for m in (long_first, long_second)]
+[True, True]
+>>> long_first._shadow_namespace() != long_second._shadow_namespace()
+True
+>>> long_first._shadow_namespace().endswith(u'~rebuild-%d' % ContentType.objects.get_for_model(Blog).pk)
+True
+>>> Blog.objects._shadow_namespace() == u'~rebuild-%d' % ContentType.objects.get_for_model(Blog).pk
+True
+
+The sqlite backend keeps an FTS5 table up to date with triggers:
+
+>>> from django.db import connection
+>>> from fts.tests.models import SqliteBlog
+>>> cursor = connection.cursor()
+>>> for statement in SqliteBlog.objects.get_create_table().splitlines():
+...     _ = cursor.execute(statement)
+>>> python = SqliteBlog.objects.create(title=u'Python', body=u'Searching text with a script.')
+>>> sqlite = SqliteBlog.objects.create(title=u'SQLite', body=u'Full text search in SQLite, searched from Python.')
+>>> for i in range(5):
+...     _ = SqliteBlog.objects.create(title=u'Other %d' % i, body=u'Nothing to see.')
+>>> [b.title for b in SqliteBlog.objects.search(u'searches')]
+[u'Python', u'SQLite']
+>>> SqliteBlog.objects.search(u'"').count(), SqliteBlog.objects.search(u'nowhere').count()
+(0, 0)
+
+Ranks are -bm25(), weighted by field, best first:
+
+>>> [(b.title, b.rank > 0) for b in SqliteBlog.objects.search(u'python', rank_field='rank')]
+[(u'Python', True), (u'SQLite', True)]
+>>> [b.title for b in SqliteBlog.objects.search(u'sql', query_type='prefix')]
+[u'SQLite']
+
+Highlights are snippets of the fields:
+
+>>> [b.title_highlight for b in SqliteBlog.objects.search(u'python', highlight=['title'], rank_field='rank')]
+[u'<b>Python</b>', u'SQLite']
+>>> [b.body_highlight for b in SqliteBlog.objects.search(u'sqlite', highlight=['body'], highlight_start='[', highlight_stop=']')]
+[u'Full text search in [SQLite], searched from Python.']
+
+Updates and deletions go through the triggers, and update_index() of some rows does nothing:
+
+>>> sqlite.body = u'An embedded database.'
+>>> sqlite.save()
+>>> [b.title for b in SqliteBlog.objects.search(u'python')], [b.title for b in SqliteBlog.objects.search(u'embedded')]
+([u'Python'], [u'SQLite'])
+>>> python.delete()
+>>> SqliteBlog.objects.update_index(sqlite.pk)
+>>> [b.title for b in SqliteBlog.objects.search(u'python')]
+[]
+>>> SqliteBlog.objects.update_index()
+>>> [b.title for b in SqliteBlog.objects.search(u'database')]
+[u'SQLite']
+
+Sharding: the router places an index following FTS_INDEX_SHARDS, by namespace,
+model, then application:
+
+>>> from fts.routers import IndexRouter, db_for_index
+>>> from fts.tests.models import ShardBlog
+>>> router = IndexRouter(shards={'namespace:autocomplete': 'fts_autocomplete', 'tests.blog': 'fts_blog', 'tests': 'fts_tests'}, replicas={})
+>>> router.db_for_index(Blog), router.db_for_index(Blog, 'autocomplete'), router.db_for_index(ShardBlog), router.db_for_index(ShardBlog, 'other')
+('fts_blog', 'fts_autocomplete', 'fts_tests', 'fts_tests')
+>>> IndexRouter(shards={}, replicas={}).db_for_index(Blog)
+'default'
+>>> db_for_index(ShardBlog), db_for_index(Blog)
+('shard', 'default')
+
+The index of ShardBlog is written to the 'shard' database, and searches read it
+from there, a page at a time, without leaving any match out:
+
+>>> from fts.backends import base
+>>> from fts.models import Word
+>>> for i in range(1005):
+...     _ = ShardBlog.objects.create(title=u'City %d' % i, body=u'A city blog, number %d.' % i)
+>>> _ = ShardBlog.objects.create(title=u'Village', body=u'Not a town, a village blog.')
+>>> ShardBlog.objects.update_index()
+>>> Index.objects.filter(content_type=ContentType.objects.get_for_model(ShardBlog)).count()
+0
+>>> Index.objects.using('shard').filter(content_type=ContentType.objects.get_for_model(ShardBlog)).count() > 0
+True
+>>> Word.objects.using('shard').filter(word='blog').count(), Word.objects.filter(word='blog').count()
+(1, 0)
+>>> old_page_size = base.SEARCH_PAGE_SIZE
+>>> base.SEARCH_PAGE_SIZE = 200
+>>> results = ShardBlog.objects.search(u'city', rank_field='rank')
+>>> results.count()
+1005
+>>> titles = [b.title for b in results]
+>>> len(titles), len(set(titles))
+(1005, 1005)
+>>> [b.title for b in results[1000:1003]] == titles[1000:1003], results[1004].title == titles[1004]
+(True, True)
+>>> all([b.rank > 0 for b in results[1000:1003]])
+True
+>>> ShardBlog.objects.search(u'blog').count(), ShardBlog.objects.search(u'village').count()
+(1006, 1)
+>>> ShardBlog.objects.search(u'city', limit=10).count(), len(ShardBlog.objects.search(u'city', limit=10))
+(10, 10)
+>>> results.filter(title__startswith=u'City 1').count()
+116
+>>> ShardBlog.objects.search(u'"city blog" number', query_type='boolean').count()
+1005
+>>> [ShardBlog.objects.search(query, query_type='boolean').count() for query in (u'village OR number', u'blog -number', u'NOT city')]
+[1006, 1, 1]
+>>> ShardBlog.objects.search(u'"town a village"').count(), ShardBlog.objects.search(u'"blog number"').count()
+(1, 1005)
+>>> base.SEARCH_PAGE_SIZE = old_page_size
+>>> ShardBlog.objects.all().delete()
+>>> ShardBlog.objects.update_index()
+>>> ShardBlog.objects.search(u'city').count()
+0
+
+Read replicas: searches read the replicas of the index's database in turn, unless
+they are pinned to the primary. The 'replica' database has nothing indexed:
+
+>>> from fts import routers
+>>> from fts.routers import db_for_search, pin_primary, unpin_primary
+>>> router = IndexRouter(shards={'tests.shardblog': 'shard'}, replicas={'shard': ['replica', 'shard'], 'default': ['replica']})
+>>> [router.db_for_search('shard') for i in range(4)], router.db_for_search('other')
+(['replica', 'shard', 'replica', 'shard'], 'other')
+>>> old_router = routers._router
+>>> routers._router = router
+>>> _ = ShardBlog.objects.create(title=u'Harbour', body=u'Boats.')
+>>> ShardBlog.objects.update_index()
+>>> [ShardBlog.objects.search(u'harbour').count() for i in range(4)]
+[0, 1, 0, 1]
+>>> ShardBlog.objects.search(u'harbour', primary=True).count()
+1
+
+After a write, pinning the reads to the primary makes the searches see it, until
+they are unpinned as many times:
+
+>>> pin_primary()
+>>> [ShardBlog.objects.search(u'harbour').count() for i in range(2)]
+[1, 1]
+>>> pin_primary()
+>>> unpin_primary()
+>>> [db_for_search('shard') for i in range(2)], db_for_search('default')
+(['shard', 'shard'], 'default')
+>>> [PgsqlBlog.objects.search('pizza').db for i in range(2)]
+['default', 'default']
+>>> unpin_primary()
+>>> [db_for_search('shard') for i in range(2)], db_for_search('default')
+(['replica', 'shard'], 'replica')
+>>> [PgsqlBlog.objects.search('pizza').db for i in range(2)], PgsqlBlog.objects.search('pizza', primary=True).db
+(['replica', 'replica'], 'default')
+
+Indexing reads the instances from the primary, even where Django's routers send
+the model's reads to a replica:
+
+>>> from django.db import router as django_router
+>>> class ReplicaReads(object):
+...     def db_for_read(self, model, **hints):
+...         return 'replica'
+...     def db_for_write(self, model, **hints):
+...         return 'default'
+>>> old_routers = django_router.routers
+>>> django_router.routers = [ReplicaReads()]
+>>> _ = ShardBlog.objects.create(title=u'Lighthouse', body=u'Light.')
+>>> ShardBlog.objects.filter(title=u'Lighthouse').count()
+0
+>>> ShardBlog.objects.update_index()
+>>> ShardBlog.objects.search(u'lighthouse', primary=True).count(), ShardBlog.objects.search(u'harbour', primary=True).count()
+(1, 1)
+>>> django_router.routers = old_routers
+>>> routers._router = old_router
+>>> ShardBlog.objects.all().delete()
+>>> ShardBlog.objects.update_index()
+
+fts_gc deletes the postings of the instances deleted since they were indexed, and
+the words only they had; --dry-run only counts them:
+
+>>> from StringIO import StringIO
+>>> from django.core.management import call_command
+>>> from fts.management.commands.fts_gc import table_size
+>>> zeppelin = Blog.objects.create(title=u'Zeppelin', body=u'Quixotic airship.')
+>>> Blog.objects.update_index(zeppelin.pk)
+>>> blog_type = ContentType.objects.get_for_model(Blog)
+>>> Index.objects.filter(content_type=blog_type, object_id=zeppelin.pk).count()
+3
+>>> zeppelin_pk = zeppelin.pk
+>>> zeppelin.delete()
+>>> out = StringIO()
+>>> call_command('fts_gc', dry_run=True, stdout=out)
+>>> print out.getvalue()
+fts_index: ... of ... rows to delete...
+fts_word: ... of ... rows to delete...
+>>> Index.objects.filter(content_type=blog_type, object_id=zeppelin_pk).count(), Word.objects.filter(word__startswith='zeppelin').count()
+(3, 1)
+>>> out = StringIO()
+>>> call_command('fts_gc', batch_size=7, stdout=out)
+>>> print out.getvalue()
+fts_index: ... of ... rows deleted...
+fts_word: ... of ... rows deleted...
+>>> Index.objects.filter(content_type=blog_type, object_id=zeppelin_pk).count(), Word.objects.filter(word__startswith='zeppelin').count()
+(0, 0)
+>>> Index.objects.filter(content_type=blog_type, object_id=first.pk).count() > 0
+True
+>>> out = StringIO()
+>>> call_command('fts_gc', stdout=out)
+>>> print out.getvalue()
+fts_index: 0 of ... rows deleted...
+fts_word: 0 of ... rows deleted...
+
+table_size() returns None when the database can't tell:
+
+>>> table_size('fts_index') is None or table_size('fts_index') > 0
+True
+>>> table_size('no_such_table') is None
+True
+
+Highlights are put on the instances as <field>_highlight, with the words of the
+query between the markers:
+
+>>> sorted([(b.title_highlight, b.body_highlight) for b in Blog.objects.search(u'simple', highlight=('title', 'body'))])
+[(u'<b>Simple</b> test', u'A full text search for <b>simple</b> tests.'), (u'Another entry', u'A <b>simple</b> entry after all.')]
+>>> sorted([b.body_highlight for b in Blog.objects.search(u'simple', highlight=('body',), highlight_start=u'[', highlight_stop=u']')])
+[u'A [simple] entry after all.', u'A full text search for [simple] tests.']
+
+They are computed a chunk of HIGHLIGHT_CHUNK_SIZE instances at a time, and only for
+the chunks read:
+
+>>> from fts.backends.base import HighlightQuerySet
+>>> chunks = []
+>>> def record(instances):
+...     chunks.append([b.title for b in instances])
+>>> old_chunk_size = base.HIGHLIGHT_CHUNK_SIZE
+>>> base.HIGHLIGHT_CHUNK_SIZE = 2
+>>> for i in range(3):
+...     _ = Blog.objects.create(title=u'Chunk %d' % i, body=u'')
+>>> qs = Blog.objects._with_highlighter(Blog.objects.filter(title__startswith=u'Chunk').order_by('title'), record)
+>>> isinstance(qs, HighlightQuerySet), [b.title for b in qs]
+(True, [u'Chunk 0', u'Chunk 1', u'Chunk 2'])
+>>> chunks
+[[u'Chunk 0', u'Chunk 1'], [u'Chunk 2']]
+>>> chunks = []
+>>> rows = qs.iterator()
+>>> rows.next().title, chunks
+(u'Chunk 0', [[u'Chunk 0', u'Chunk 1']])
+>>> rows.close()
+>>> [b.title for b in qs.filter(title=u'Chunk 2')], chunks
+([u'Chunk 2'], [[u'Chunk 0', u'Chunk 1'], [u'Chunk 2']])
+>>> base.HIGHLIGHT_CHUNK_SIZE = old_chunk_size
+>>> Blog.objects.filter(title__startswith=u'Chunk').delete()
+
+The pgsql backend highlights the same fields, 'fk__field' names included, with
+ts_headline:
+
+>>> print PgsqlPost.objects._headlines_sql(('body', 'author__name'), "to_tsquery('english', %s)", 'english')
+ts_headline('english', coalesce("tests_pgsqlpost"."body",''), to_tsquery('english', %s), %s), ts_headline('english', coalesce((SELECT r0."name" FROM "tests_pgsqlauthor" r0 WHERE r0."id" = "tests_pgsqlpost"."author_id"),''), to_tsquery('english', %s), %s)
+>>> qs = PgsqlPost.objects.search('pizza', highlight=('body', 'author__name'))
+>>> PgsqlPost.objects.search('pizza', highlight=('author__pgsqlpost_set',))
+Traceback (most recent call last):
+    ...
+ValueError: Can't highlight 'author__pgsqlpost_set': only fields of PgsqlPost and 'fk__field' names are.
+
+The approximate count of the pgsql backend is read from the first row of the
+EXPLAIN; without an estimate there, the search is counted exactly:
+
+>>> pgsql.plan_rows((u'Bitmap Heap Scan on tests_pgsqlblog  (cost=12.25..1432.61 rows=48211 width=72)',))
+48211
+>>> pgsql.plan_rows((u'Result',)), pgsql.plan_rows((0, u'Init', 0)), pgsql.plan_rows(None), pgsql.plan_rows(())
+(None, None, None, None)
+>>> PgsqlBlog.objects._search = lambda query, **kwargs: PgsqlBlog.objects.all()
+>>> count = PgsqlBlog.objects.search_count('pizza', approximate=True, threshold=0)
+>>> int(count), count.method
+(0, 'exact')
+>>> del PgsqlBlog.objects._search
+
+Stopwords can be read from files: FTS_STOPWORDS_FILES of the test settings reads
+those of the language 'xx' from fts/tests/stopwords.txt, a data file of the
+fts.tests package. They are left out of the index and of the queries:
+
+>>> from fts.tests.models import StopwordsBlog
+>>> from fts.words.stop import FTS_STOPWORDS, register_stopwords_file
+>>> sorted(FTS_STOPWORDS['xx'])
+[u'entry', u'see', u'simple']
+>>> _ = StopwordsBlog.objects.create(title=u'Simple test', body=u'A full text search for simple tests.')
+>>> _ = StopwordsBlog.objects.create(title=u'Another entry', body=u'Nothing to see here.')
+>>> StopwordsBlog.objects.update_index()
+>>> def indexed_words(model):
+...     return sorted(set(Index.objects.filter(content_type=ContentType.objects.get_for_model(model)).values_list('word__word', flat=True)))
+>>> indexed_words(StopwordsBlog)
+[u'a', u'another', u'for', u'full', u'here', u'nothing', u'search', u'test', u'tests', u'text', u'to']
+>>> [b.title for b in StopwordsBlog.objects.search(u'simple tests')]
+[u'Simple test']
+>>> [b.title for b in StopwordsBlog.objects.search(u'another entry')]
+[u'Another entry']
+
+register_stopwords_file() takes a path too, and replaces the words already loaded:
+
+>>> import os, tempfile
+>>> fd, path = tempfile.mkstemp(suffix='.txt')
+>>> os.write(fd, 'nothing here # and a comment\na\n')
+31
+>>> os.close(fd)
+>>> register_stopwords_file('xx', path)
+>>> sorted(FTS_STOPWORDS['xx'])
+[u'a', u'here', u'nothing']
+>>> StopwordsBlog.objects.update_index()
+>>> indexed_words(StopwordsBlog)
+[u'another', u'entry', u'for', u'full', u'search', u'see', u'simple', u'test', u'tests', u'text', u'to']
+>>> [b.title for b in StopwordsBlog.objects.search(u'nothing to see')]
+[u'Another entry']
+>>> register_stopwords_file('xx', 'fts.tests:stopwords.txt')
+>>> os.remove(path)
+>>> sorted(FTS_STOPWORDS['xx'])
+[u'entry', u'see', u'simple']
 """
+
+import shutil
+
+from django.test import TestCase
+from django.utils import unittest
+
+from fts.tests.models import XapianBlog
+
+@unittest.skipIf(XapianBlog is None, 'the Xapian python bindings are not installed')
+class XapianSearchTest(TestCase):
+    """
+    Searches are paged from Xapian: none of the matches is left out, and they are counted by Xapian.
+    """
+    def setUp(self):
+        shutil.rmtree(XapianBlog.objects._database_path(), ignore_errors=True)
+        for i in range(1100):
+            XapianBlog.objects.create(title=u'City %d' % i, body=u'A city blog.')
+        XapianBlog.objects.create(title=u'Village', body=u'Not a town.')
+        XapianBlog.objects.update_index()
+
+    def tearDown(self):
+        shutil.rmtree(XapianBlog.objects._database_path(), ignore_errors=True)
+
+    def test_count(self):
+        self.assertEqual(XapianBlog.objects.search(u'city').count(), 1100)
+        self.assertEqual(XapianBlog.objects.search(u'village').count(), 1)
+        self.assertEqual(XapianBlog.objects.search(u'nowhere').count(), 0)
+        self.assertEqual(XapianBlog.objects.search(u'city', limit=20).count(), 20)
+
+    def test_pages(self):
+        results = XapianBlog.objects.search(u'city', rank_field='rank')
+        titles = [b.title for b in results]
+        self.assertEqual(len(titles), 1100)
+        self.assertEqual(len(set(titles)), 1100)
+        page = list(results[1050:1060])
+        self.assertEqual([b.title for b in page], titles[1050:1060])
+        self.assertTrue(all(b.rank > 0 for b in page))
+        self.assertEqual(results[1099].title, titles[1099])
+        self.assertRaises(IndexError, lambda: results[1100])
+        self.assertEqual(len(list(results[1090:])), 10)
+
+    def test_offset(self):
+        titles = [b.title for b in XapianBlog.objects.search(u'city')]
+        self.assertEqual([b.title for b in XapianBlog.objects.search(u'city', offset=1000, limit=20)], titles[1000:1020])
+        self.assertEqual(XapianBlog.objects.search(u'city', offset=1090).count(), 10)
+
+    def test_filter(self):
+        results = XapianBlog.objects.search(u'city').filter(title__startswith=u'City 10')
+        self.assertEqual(results.count(), 111)
@@ -0,0 +1,90 @@
+"""
+Lookup of the words of a vocabulary within a small edit distance of a word.
+
+SymmetricDeleteIndex stores every word under the strings obtained by deleting up
+to max_distance of its characters, and looks a word up through its own deletes:
+two words within distance k always share one of them. A lookup only costs the
+deletes of the word looked up and the check of the few candidates found, however
+large the vocabulary. Only the first prefix_length characters are indexed, which
+bounds the memory used by long words; candidates are still checked on the whole
+words.
+"""
+import threading
+
+def deletes(word, distance):
+    """
+    Returns the set of the strings obtained by deleting up to distance characters of word.
+    """
+    results = set([word])
+    last = results
+    for i in range(distance):
+        found = set()
+        for w in last:
+            for j in range(len(w)):
+                found.add(w[:j] + w[j + 1:])
+        last = found - results
+        results |= last
+    return results
+
+def edit_distance(a, b, limit=None):
+    """
+    Returns the number of insertions, deletions, substitutions and transpositions of
+    two adjacent characters turning a into b, or limit + 1 as soon as it's known to
+    be over limit.
+    """
+    if limit is None:
+        limit = max(len(a), len(b))
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before = None
+    previous = range(len(b) + 1)
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1] and 1 or 0
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+class SymmetricDeleteIndex(object):
+    def __init__(self, max_distance=2, prefix_length=7):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.words = set()
+        # delete -> words
+        self.deletes = {}
+        # Id of the last Word added, for loaders adding the new words only
+        self.last_id = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.words)
+
+    def add(self, word):
+        if word in self.words:
+            return
+        self.words.add(word)
+        for delete in deletes(word[:self.prefix_length], self.max_distance):
+            self.deletes.setdefault(delete, []).append(word)
+
+    def lookup(self, word, distance=None):
+        """
+        Returns the (word, distance) pairs of the words within distance (by default
+        max_distance, which it can't exceed) of word, closest first.
+        """
+        if distance is None or distance > self.max_distance:
+            distance = self.max_distance
+        candidates = set()
+        for delete in deletes(word[:self.prefix_length], distance):
+            candidates.update(self.deletes.get(delete, ()))
+        matches = []
+        for candidate in candidates:
+            d = edit_distance(word, candidate, distance)
+            if d <= distance:
+                matches.append((d, candidate))
+        matches.sort()
+        return [(candidate, d) for d, candidate in matches]
@@ -0,0 +1,45 @@
+"""
+Completion of prefixes with the most frequent words of a vocabulary, in memory.
+
+The words are kept sorted, so the words starting with a prefix are a slice found
+by bisection, and the most frequent of them are picked from that slice. Short
+prefixes have large slices, so their completions are remembered.
+"""
+from array import array
+from bisect import bisect_left
+import heapq
+
+# Completions of prefixes shorter than this are remembered
+CACHED_PREFIX_LENGTH = 3
+
+class Completions(object):
+    def __init__(self, frequencies):
+        """
+        frequencies are (word, frequency) pairs.
+        """
+        frequencies = sorted(frequencies)
+        self.words = [w for w, f in frequencies]
+        self.frequencies = array('l', [f for w, f in frequencies])
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.words)
+
+    def complete(self, prefix, limit=10):
+        """
+        Returns the (word, frequency) pairs of the limit most frequent words starting
+        with prefix, most frequent first.
+        """
+        key = (prefix, limit)
+        if key in self._cache:
+            return self._cache[key]
+        start = bisect_left(self.words, prefix)
+        if prefix:
+            end = bisect_left(self.words, prefix[:-1] + unichr(ord(prefix[-1]) + 1), start)
+        else:
+            end = len(self.words)
+        best = heapq.nlargest(limit, xrange(start, end), key=self.frequencies.__getitem__)
+        completions = [(self.words[i], self.frequencies[i]) for i in best]
+        if len(prefix) < CACHED_PREFIX_LENGTH:
+            self._cache[key] = completions
+        return completions